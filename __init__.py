@@ -4,9 +4,49 @@ import os.path
 
 import util.logger
 import webserver
+import werkzeug.middleware.proxy_fix
 
+import db
+import lazy
+import ratelimit
 import routes
+import scheduler
 import swagger_specs
 
+# Defer building the API documentation and loading the debug routes until they are first requested.
+LAZY_START = bool(os.environ.get('PAKET_BRIDGE_LAZY_START'))
+LAZY_PATHS = ('/',)
+LAZY_PREFIXES = ('/apispec', '/flasgger_static', "/v{}/debug/".format(routes.VERSION))
+INGEST = bool(os.environ.get('PAKET_BRIDGE_INGEST'))
+
+
+def setup_full_app():
+    """Create the app serving the API, its documentation and the debug routes."""
+    # Imported here, so lazy starts only pay for it when a debug route is first called.
+    import debug_routes  # pylint: disable=import-outside-toplevel
+    app = webserver.setup(routes.BLUEPRINT, swagger_specs.CONFIG)
+    app.register_blueprint(debug_routes.BLUEPRINT)
+    return app
+
+
+def start_workers():
+    """
+    Start the enabled background workers - ingestion and the scheduler - in
+    threads of the current process. Call it in a single process, after the
+    server forked its workers, since threads do not survive forks.
+    """
+    if INGEST:
+        db.start_ingestion()
+    if scheduler.ENABLED:
+        scheduler.SCHEDULER.start()
+
+
 util.logger.setup()
-APP = webserver.setup(routes.BLUEPRINT, swagger_specs.CONFIG)
+if LAZY_START:
+    APP = webserver.setup(routes.BLUEPRINT)
+    APP.wsgi_app = lazy.LazyDispatcher(APP.wsgi_app, setup_full_app, LAZY_PATHS, LAZY_PREFIXES)
+else:
+    APP = setup_full_app()
+if ratelimit.TRUSTED_PROXIES:
+    # So rate limits apply to the clients of the proxies, rather than to the proxies.
+    APP.wsgi_app = werkzeug.middleware.proxy_fix.ProxyFix(APP.wsgi_app, x_for=ratelimit.TRUSTED_PROXIES)
@@ -1,3 +1,8 @@
 """Run the PAKET bridge server."""
+import os
+
 import bridge
+# In debug mode, the app is served by a child process that the reloader marks, and restarts on changes.
+if not bridge.webserver.validation.DEBUG or os.environ.get('WERKZEUG_RUN_MAIN'):
+    bridge.start_workers()
 bridge.APP.run('0.0.0.0', bridge.routes.PORT, bridge.webserver.validation.DEBUG)
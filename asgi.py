@@ -0,0 +1,248 @@
+"""
+Run the PAKET bridge under an asyncio ASGI server.
+
+The Flask app is served unchanged, so validation and error codes are the same
+as under the development server, but each request runs on a bounded thread
+pool so a single process can wait on many Horizon calls at once. The pool is
+as large as the Horizon connection pool, since more threads would only wait
+for a connection, and requests arriving while the pool and its queue are full
+are turned away at once with a 503 rather than left to time out. Event streams
+(bul_account_events) are served on the event loop itself rather than on the
+pool, since they mostly wait, and so do not count against it. Run with any
+ASGI server, e.g. `uvicorn bridge.asgi:APP`, or with `python -m bridge.asgi`.
+The background workers are started on the lifespan startup event, so run a
+single process.
+"""
+import asyncio
+import concurrent.futures
+import io
+import json
+import os
+import sys
+import urllib.parse
+
+import webserver.validation
+
+import bridge
+import events
+import horizon
+import ratelimit
+import routes
+
+MAX_IN_FLIGHT = int(os.environ.get('PAKET_BRIDGE_MAX_IN_FLIGHT', horizon.POOL_SIZE))
+MAX_QUEUED = int(os.environ.get('PAKET_BRIDGE_MAX_QUEUED', MAX_IN_FLIGHT))
+BUSY_RETRY_AFTER = 1
+EVENTS_PATH = "/v{}/bul_account_events".format(routes.VERSION)
+
+
+class WSGIAdapter:
+    """
+    Serve a WSGI app as an ASGI app, running it on a bounded thread pool.
+    Up to max_queued requests wait for a thread, and any more are rejected.
+    """
+
+    def __init__(self, wsgi_app, max_workers, max_queued):
+        self.wsgi_app = wsgi_app
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers, 'asgi')
+        self.max_requests = max_workers + max_queued
+        # Only touched from the event loop, so they need no lock.
+        self.requests = 0
+        self.streams = 0
+
+    @staticmethod
+    def gen_environ(scope, body):
+        """Create a WSGI environ from an ASGI HTTP scope and request body."""
+        server_name, server_port = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            'PATH_INFO': scope['path'],
+            'QUERY_STRING': scope['query_string'].decode('latin-1'),
+            'SERVER_NAME': server_name,
+            'SERVER_PORT': str(server_port),
+            'SERVER_PROTOCOL': "HTTP/{}".format(scope['http_version']),
+            'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False}
+        for name, value in scope['headers']:
+            name, value = name.decode('latin-1').upper().replace('-', '_'), value.decode('latin-1')
+            if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                name = "HTTP_{}".format(name)
+            environ[name] = "{},{}".format(environ[name], value) if name in environ else value
+        return environ
+
+    def run_wsgi_app(self, environ):
+        """Call the WSGI app, returning its status, headers and body iterator."""
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            """Record the status and headers of the response."""
+            if exc_info and response:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+        body = self.wsgi_app(environ, start_response)
+        return response['status'], response['headers'], body
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    bridge.start_workers()
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    self.executor.shutdown(wait=True)
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if scope['type'] != 'http':
+            return
+        if scope['path'] == EVENTS_PATH:
+            await self.serve_events(scope, receive, send)
+            return
+        if self.requests >= self.max_requests:
+            await self.send_error(send, 503, 'server is busy, retry later', BUSY_RETRY_AFTER)
+            return
+        self.requests += 1
+        try:
+            await self.serve(scope, receive, send)
+        finally:
+            self.requests -= 1
+
+    @staticmethod
+    async def send_error(send, status, error, retry_after=None):
+        """Respond with a JSON error, like routes.error_response, without running the app."""
+        body = json.dumps({'status': status, 'error': error}).encode()
+        headers = [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+        if retry_after:
+            headers.append((b'retry-after', str(retry_after).encode()))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    @staticmethod
+    async def read_body(receive):
+        """Read the whole body of a request."""
+        body, more_body = [], True
+        while more_body:
+            message = await receive()
+            body.append(message.get('body', b''))
+            more_body = message.get('more_body', False)
+        return b''.join(body)
+
+    async def serve(self, scope, receive, send):
+        """Serve an HTTP request on the thread pool."""
+        body = await self.read_body(receive)
+        loop = asyncio.get_running_loop()
+        status, headers, chunks = await loop.run_in_executor(
+            self.executor, self.run_wsgi_app, self.gen_environ(scope, body))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        # Chunks are pulled on the pool too, so streaming responses do not block the loop,
+        # and pulling stops once the client goes away, so abandoned streams free their thread.
+        chunks_iterator = iter(chunks)
+        disconnected = asyncio.ensure_future(self.wait_for_disconnect(receive))
+        try:
+            while True:
+                next_chunk = loop.run_in_executor(self.executor, next, chunks_iterator, None)
+                await asyncio.wait((next_chunk, disconnected), return_when=asyncio.FIRST_COMPLETED)
+                if disconnected.done():
+                    # The iterator can only be closed once the chunk it is producing is done.
+                    await next_chunk
+                    return
+                chunk = next_chunk.result()
+                if chunk is None:
+                    break
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            disconnected.cancel()
+            if hasattr(chunks, 'close'):
+                await loop.run_in_executor(self.executor, chunks.close)
+        await send({'type': 'http.response.body', 'body': b''})
+
+    @staticmethod
+    async def wait_for_disconnect(receive):
+        """Wait until the client of a request disconnects."""
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def serve_events(self, scope, receive, send):
+        """
+        Serve an event stream on the event loop, with the same validation, rate
+        limit and events as routes.bul_account_events_handler, but no thread.
+        """
+        body = await self.read_body(receive)
+        values = dict(urllib.parse.parse_qsl(scope['query_string'].decode('latin-1')))
+        if dict(scope['headers']).get(b'content-type', b'').startswith(b'application/x-www-form-urlencoded'):
+            values.update(urllib.parse.parse_qsl(body.decode('latin-1')))
+        kwargs = {'queried_pubkey': values.get('queried_pubkey')}
+        if kwargs['queried_pubkey'] is None:
+            await self.send_error(send, 400, 'missing queried_pubkey')
+            return
+        try:
+            routes.check_and_fix_kwargs(kwargs)
+        except tuple(webserver.validation.INTERNAL_ERROR_CODES) as exception:
+            await self.send_error(send, 400, str(exception))
+            return
+        client_ip = ratelimit.client_ip(
+            (scope.get('client') or ('', 0))[0],
+            b','.join(value for name, value in scope['headers'] if name == b'x-forwarded-for').decode('latin-1'))
+        retry_after = ratelimit.check_limits('bul_account_events', ip=client_ip)
+        if retry_after:
+            await self.send_error(
+                send, 429, ratelimit.too_many_calls('bul_account_events', retry_after)['error'], retry_after)
+            return
+        if self.streams >= events.MAX_ASYNC_STREAMS:
+            await self.send_error(send, 503, 'too many event streams, retry later', events.STREAMS_RETRY_AFTER)
+            return
+        self.streams += 1
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'), (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no')]})
+            if await self.stream_events(kwargs['queried_pubkey'], receive, send):
+                await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            self.streams -= 1
+
+    async def stream_events(self, pubkey, receive, send):
+        """
+        Send the BUL payments of pubkey as server-sent events, with heartbeats when
+        idle, for up to events.MAX_STREAM_SECONDS. Return False if the client left.
+        """
+        loop = asyncio.get_running_loop()
+        watcher = events.FEED.watch(pubkey, events.AsyncWatcher(loop))
+        disconnected = asyncio.ensure_future(self.wait_for_disconnect(receive))
+        deadline = loop.time() + events.MAX_STREAM_SECONDS
+        try:
+            while loop.time() < deadline:
+                record = asyncio.ensure_future(watcher.get())
+                await asyncio.wait(
+                    (record, disconnected), timeout=max(0, min(events.HEARTBEAT_INTERVAL, deadline - loop.time())),
+                    return_when=asyncio.FIRST_COMPLETED)
+                if disconnected.done():
+                    record.cancel()
+                    return False
+                if record.done():
+                    event = events.format_event(record.result())
+                else:
+                    record.cancel()
+                    event = events.HEARTBEAT
+                await send({'type': 'http.response.body', 'body': event.encode(), 'more_body': True})
+            return True
+        finally:
+            disconnected.cancel()
+            events.FEED.unwatch(pubkey, watcher)
+
+
+APP = WSGIAdapter(bridge.APP, MAX_IN_FLIGHT, MAX_QUEUED)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(APP, host='0.0.0.0', port=int(bridge.routes.PORT))
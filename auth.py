@@ -0,0 +1,52 @@
+"""Keypair helpers and replay protection for authenticated calls."""
+import functools
+import os
+
+import flask
+
+import paket_stellar
+
+import cache
+
+REPLAY_WINDOW = float(os.environ.get('PAKET_BRIDGE_REPLAY_WINDOW', 60 * 60))
+REPLAY_CACHE_SIZE = int(os.environ.get('PAKET_BRIDGE_REPLAY_CACHE_SIZE', 100000))
+KEYPAIR_CACHE_SIZE = int(os.environ.get('PAKET_BRIDGE_KEYPAIR_CACHE_SIZE', 10000))
+# Used (pubkey, fingerprint) pairs, kept for the replay window.
+FINGERPRINTS = cache.gen_cache('fingerprints', REPLAY_CACHE_SIZE, REPLAY_WINDOW)
+
+
+class ReplayedFingerprint(Exception):
+    """A signed fingerprint was used more than once."""
+
+
+@functools.lru_cache(KEYPAIR_CACHE_SIZE)
+def get_keypair(pubkey):
+    """
+    Get the keypair of a pubkey, decoding each pubkey only once. Pre-flight checks
+    verify the signatures of submitted transactions with these keypairs, which hold
+    no secret and are not changed by verifying. The signatures of authenticated calls
+    are verified by webserver.validation, which decodes the caller's pubkey itself.
+    """
+    return paket_stellar.stellar_base.keypair.Keypair.from_address(pubkey)
+
+
+def record(pubkey, fingerprint):
+    """Record the use of a fingerprint by pubkey, raising ReplayedFingerprint if it was already used."""
+    if not FINGERPRINTS.add((pubkey, fingerprint), True):
+        raise ReplayedFingerprint("fingerprint already used by {}".format(pubkey))
+
+
+def reject_replays(handler):
+    """
+    Reject authenticated calls whose fingerprint was already used within the replay window.
+    The signature on the fingerprint was already verified by webserver.validation.call, so
+    it is not verified again. Calls without a fingerprint (which the webserver only lets
+    through in debug mode) are not checked.
+    """
+    @functools.wraps(handler)
+    def _reject_replays(user_pubkey, *args, **kwargs):
+        fingerprint = flask.request.headers.get('Fingerprint')
+        if fingerprint is not None:
+            record(user_pubkey, fingerprint)
+        return handler(user_pubkey, *args, **kwargs)
+    return _reject_replays
@@ -0,0 +1,60 @@
+"""Routing of Horizon calls between several Horizon nodes."""
+import threading
+import time
+
+import circuit
+
+# Weight of the latest measurement in the rolling latency of a node.
+LATENCY_SMOOTHING = .3
+# Seconds after which the rolling latency of a node that got no calls is dropped, so the node is measured again
+# rather than left unused after a few slow calls.
+LATENCY_TTL = 60
+
+
+class Node:
+    """A Horizon node, with its own circuit breaker and rolling latency."""
+
+    def __init__(self, url, failure_threshold=5, reset_timeout=30):
+        self.url = url.rstrip('/')
+        self.breaker = circuit.CircuitBreaker(self.url, failure_threshold, reset_timeout)
+        self.lock = threading.Lock()
+        self.latency = None
+        self.measured_at = None
+
+    def observe(self, seconds):
+        """Add a latency measurement to the rolling latency of the node."""
+        with self.lock:
+            if self.get_latency() is None:
+                self.latency = seconds
+            else:
+                self.latency += LATENCY_SMOOTHING * (seconds - self.latency)
+            self.measured_at = time.monotonic()
+
+    def get_latency(self):
+        """Get the rolling latency of the node, or None if it was not measured in the last LATENCY_TTL seconds."""
+        if self.measured_at is None or time.monotonic() - self.measured_at >= LATENCY_TTL:
+            return None
+        return self.latency
+
+
+class Balancer:
+    """
+    A set of Horizon nodes, in order of preference. Reads go to the healthy
+    node with the lowest rolling latency, while submissions go to the most
+    preferred healthy node, failing over to the next ones.
+    """
+
+    def __init__(self, urls, failure_threshold=5, reset_timeout=30):
+        self.nodes = [Node(url, failure_threshold, reset_timeout) for url in urls]
+
+    def ranked(self, fastest_first=False):
+        """
+        Get the available nodes, fastest or most preferred first. Nodes with no
+        recent latency measurement come first, so every node gets measured, and
+        a node that was slow once gets another chance.
+        """
+        nodes = [node for node in self.nodes if node.breaker.is_available()]
+        if fastest_first:
+            latencies = {node: node.get_latency() for node in nodes}
+            nodes.sort(key=lambda node: -1 if latencies[node] is None else latencies[node])
+        return nodes
@@ -0,0 +1 @@
+"""Bridge benchmarks"""
@@ -0,0 +1,119 @@
+"""An in-process stand-in for Horizon, with configurable latency and error injection."""
+import hashlib
+import http.server
+import json
+import random
+import re
+import socketserver
+import threading
+import time
+import urllib.parse
+
+import paket_stellar
+
+ACCOUNT_PATH = re.compile(r'^/accounts/(?P<pubkey>G[A-Z2-7]{55})$')
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """HTTP server handling each request on its own thread."""
+    daemon_threads = True
+
+
+class FakeHorizon:
+    """
+    Serve just enough of the Horizon API for the bridge: loading accounts and
+    submitting transactions. Every response is delayed by latency seconds
+    (plus up to jitter seconds), and a share of error_rate requests fail,
+    half of the submissions among them with tx_bad_seq.
+    """
+
+    def __init__(self, latency=.05, jitter=.01, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.gen_handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        """The base URL of the fake Horizon."""
+        return "http://127.0.0.1:{}".format(self.server.server_address[1])
+
+    @staticmethod
+    def account(pubkey):
+        """Get the raw details of a trusting, funded account."""
+        return {
+            'id': pubkey, 'account_id': pubkey, 'sequence': '4294967296',
+            'signers': [{'public_key': pubkey, 'weight': 1, 'key': pubkey, 'type': 'ed25519_public_key'}],
+            'thresholds': {'low_threshold': 0, 'med_threshold': 0, 'high_threshold': 0},
+            'balances': [
+                {
+                    'asset_type': 'credit_alphanum4', 'asset_code': paket_stellar.BUL_TOKEN_CODE,
+                    'asset_issuer': paket_stellar.ISSUER, 'balance': '1000.0000000', 'limit': '922337203685.4775807'},
+                {'asset_type': 'native', 'balance': '100.0000000'}]}
+
+    def gen_handler(self):
+        """Create a request handler class bound to this fake Horizon."""
+        horizon = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            """Handle a single Horizon request."""
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def respond(self, status, body):
+                """Send a JSON response."""
+                body = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def delay_or_fail(self):
+                """Apply the configured latency, and return True if this request should fail."""
+                with horizon.lock:
+                    horizon.requests += 1
+                time.sleep(horizon.latency + random.uniform(0, horizon.jitter))
+                return random.random() < horizon.error_rate
+
+            # pylint: disable=invalid-name
+            # Method names are dictated by BaseHTTPRequestHandler.
+            def do_GET(self):
+                """Load an account."""
+                match = ACCOUNT_PATH.match(urllib.parse.urlparse(self.path).path)
+                if self.delay_or_fail():
+                    self.respond(503, {'status': 503, 'title': 'Service Unavailable'})
+                elif match is None:
+                    self.respond(404, {'status': 404, 'title': 'Resource Missing'})
+                else:
+                    self.respond(200, horizon.account(match.group('pubkey')))
+
+            def do_POST(self):
+                """Submit a transaction."""
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                envelope = urllib.parse.parse_qs(body.decode()).get('tx', [''])[0]
+                if self.delay_or_fail():
+                    if random.random() < .5:
+                        self.respond(400, {'status': 400, 'title': 'Transaction Failed', 'extras': {
+                            'envelope_xdr': envelope, 'result_codes': {'transaction': 'tx_bad_seq'}}})
+                    else:
+                        self.respond(503, {'status': 503, 'title': 'Service Unavailable'})
+                else:
+                    self.respond(200, {
+                        'hash': hashlib.sha256(envelope.encode()).hexdigest(), 'ledger': 1, 'envelope_xdr': envelope})
+            # pylint: enable=invalid-name
+
+        return Handler
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,279 @@
+"""
+Benchmark the bridge routes against an in-process fake Horizon.
+
+Each endpoint is driven at rising concurrency, and the throughput, latency
+percentiles and memory allocated per request are written as JSON, so that
+results of different versions can be compared with --baseline. The time it
+takes to import the bridge, with and without lazy start, is profiled too.
+Run from the bridge directory with `python -m benchmarks.run`.
+"""
+import argparse
+import concurrent.futures
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+import paket_stellar
+import webserver
+import webserver.validation
+
+import horizon
+import ratelimit
+import routes
+import transactions
+
+import benchmarks.fake_horizon
+
+APP = webserver.setup(routes.BLUEPRINT)
+APP.testing = True
+# All benchmark calls come from a single address, so rate limits would only measure rejections.
+ratelimit.LIMITS.clear()
+HOST = 'http://localhost'
+CONCURRENCY_LEVELS = (1, 4, 16, 64)
+SCENARIOS = (
+    'bul_account', 'prepare_account', 'prepare_trust', 'prepare_send_buls', 'batch',
+    'submit_transaction', 'prepare_escrow')
+MEMORY_SAMPLE_SIZE = 20
+IMPORT_PROFILE_SIZE = 15
+CLIENTS = threading.local()
+
+
+def post(path, seed=None, **kwargs):
+    """Post a call to the bridge from the client of the current thread and return its status code."""
+    if not hasattr(CLIENTS, 'client'):
+        CLIENTS.client = APP.test_client()
+    headers = None
+    if seed:
+        fingerprint = webserver.validation.generate_fingerprint(
+            "{}/v{}/{}".format(HOST, routes.VERSION, path), kwargs)
+        headers = {
+            'Pubkey': paket_stellar.get_keypair(seed=seed).address().decode(),
+            'Fingerprint': fingerprint, 'Signature': webserver.validation.sign_fingerprint(fingerprint, seed)}
+    return CLIENTS.client.post(
+        "/v{}/{}".format(routes.VERSION, path), headers=headers, data=kwargs).status_code
+
+
+class Scenarios:
+    """The calls to benchmark, each making a single request with varying arguments."""
+
+    def __init__(self, accounts_num):
+        keypairs = [paket_stellar.get_keypair() for _ in range(accounts_num)]
+        self.pubkeys = [keypair.address().decode() for keypair in keypairs]
+        self.seeds = [keypair.seed().decode() for keypair in keypairs]
+        self.sequences = itertools.count(4294967296)
+        # Added to package deadlines, so every signed call has a fingerprint of its own, and is not a replay.
+        self.nonces = itertools.count()
+
+    def random_pubkey(self):
+        """Get one of the benchmark pubkeys."""
+        return random.choice(self.pubkeys)
+
+    def signed_envelope(self):
+        """Get a signed BUL transfer envelope."""
+        index = random.randrange(len(self.seeds))
+        unsigned = transactions.prepare_send_buls(
+            self.pubkeys[index], next(self.sequences), self.random_pubkey(), 1)
+        builder = paket_stellar.stellar_base.builder.Builder(
+            horizon_uri=paket_stellar.HORIZON_SERVER, secret=self.seeds[index])
+        builder.import_from_xdr(unsigned)
+        builder.sign()
+        return builder.gen_te().xdr().decode()
+
+    def bul_account(self):
+        """Query an account."""
+        return post('bul_account', queried_pubkey=self.random_pubkey())
+
+    def prepare_account(self):
+        """Prepare an account creation."""
+        return post('prepare_account', from_pubkey=self.random_pubkey(), new_pubkey=self.random_pubkey())
+
+    def prepare_trust(self):
+        """Prepare a trust line."""
+        return post('prepare_trust', from_pubkey=self.random_pubkey())
+
+    def prepare_send_buls(self):
+        """Prepare a BUL transfer."""
+        return post(
+            'prepare_send_buls', from_pubkey=self.random_pubkey(), to_pubkey=self.random_pubkey(), amount_buls=1)
+
+    def batch(self):
+        """Prepare an onboarding batch."""
+        funder, new_pubkey = self.random_pubkey(), self.random_pubkey()
+        return post('batch', operations=json.dumps([
+            {'call': 'prepare_account', 'from_pubkey': funder, 'new_pubkey': new_pubkey},
+            {'call': 'prepare_trust', 'from_pubkey': new_pubkey},
+            {'call': 'prepare_send_buls', 'from_pubkey': funder, 'to_pubkey': new_pubkey, 'amount_buls': 1}]))
+
+    def submit_transaction(self):
+        """Submit a signed transaction."""
+        return post('submit_transaction', transaction=self.signed_envelope())
+
+    def prepare_escrow(self):
+        """Prepare the transactions of a package."""
+        return post(
+            'prepare_escrow', random.choice(self.seeds),
+            launcher_pubkey=self.random_pubkey(), courier_pubkey=self.random_pubkey(),
+            recipient_pubkey=self.random_pubkey(), payment_buls=10, collateral_buls=20,
+            deadline_timestamp=int(time.time()) + 60 * 60 + next(self.nonces))
+
+
+def percentile(sorted_values, fraction):
+    """Get a percentile of a sorted list of values."""
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def timed(call):
+    """Make a call and return its status code and latency."""
+    start = time.perf_counter()
+    status = call()
+    return status, time.perf_counter() - start
+
+
+def memory_per_request(call, sample_size=MEMORY_SAMPLE_SIZE):
+    """Get the mean peak memory allocated while serving a request, in bytes."""
+    peaks = []
+    for _ in range(sample_size):
+        tracemalloc.start()
+        call()
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return sum(peaks) // len(peaks)
+
+
+def measure(call, concurrency, requests_num):
+    """Drive a call at a concurrency level and return its throughput and latency statistics."""
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        start = time.perf_counter()
+        results = list(executor.map(lambda _: timed(call), range(requests_num)))
+        duration = time.perf_counter() - start
+    latencies = sorted(latency for _, latency in results)
+    return {
+        'concurrency': concurrency,
+        'requests': requests_num,
+        'errors': sum(1 for status, _ in results if status >= 400),
+        'requests_per_second': requests_num / duration,
+        'latency': {
+            'mean': sum(latencies) / len(latencies),
+            'p50': percentile(latencies, .5),
+            'p95': percentile(latencies, .95),
+            'p99': percentile(latencies, .99)}}
+
+
+def run(scenarios, names, concurrency_levels, requests_num):
+    """Benchmark the named scenarios and return a list of results."""
+    results = []
+    for name in names:
+        call = getattr(scenarios, name)
+        memory = memory_per_request(call)
+        for concurrency in concurrency_levels:
+            result = measure(call, concurrency, max(requests_num, concurrency))
+            result.update(endpoint=name, memory_per_request=memory)
+            print("{endpoint} x{concurrency}: {requests_per_second:.1f} req/s, p50 {p50:.4f}s, p95 {p95:.4f}s, "
+                  "p99 {p99:.4f}s, {errors} errors".format(**result, **result['latency']), file=sys.stderr)
+            results.append(result)
+    return results
+
+
+def profile_import(lazy_start):
+    """
+    Import the bridge package in a fresh interpreter, and return the time it
+    took and the modules whose own import took longest.
+    """
+    bridge_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join((os.path.dirname(bridge_directory), bridge_directory)))
+    env.pop('PAKET_BRIDGE_LAZY_START', None)
+    if lazy_start:
+        env['PAKET_BRIDGE_LAZY_START'] = '1'
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', "import {}".format(os.path.basename(bridge_directory))],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    duration = time.perf_counter() - start
+    imports = []
+    for line in process.stderr.splitlines():
+        try:
+            self_time, cumulative_time, module = line[len('import time:'):].split('|')
+            imports.append((int(self_time), int(cumulative_time), module.strip()))
+        except ValueError:
+            # The header line and any other output.
+            continue
+    print("import with lazy start {}: {:.3f}s".format('on' if lazy_start else 'off', duration), file=sys.stderr)
+    return {
+        'lazy_start': lazy_start,
+        'succeeded': process.returncode == 0,
+        'seconds': duration,
+        'slowest_modules': [
+            {'module': module, 'self_seconds': self_time / 10 ** 6, 'cumulative_seconds': cumulative_time / 10 ** 6}
+            for self_time, cumulative_time, module in sorted(imports, reverse=True)[:IMPORT_PROFILE_SIZE]]}
+
+
+def compare(results, baseline, tolerance):
+    """Print the change from a baseline run, and return the regressions beyond tolerance."""
+    baseline = {(result['endpoint'], result['concurrency']): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        key = result['endpoint'], result['concurrency']
+        if key not in baseline:
+            continue
+        throughput = result['requests_per_second'] / baseline[key]['requests_per_second'] - 1
+        latency = result['latency']['p95'] / baseline[key]['latency']['p95'] - 1
+        print("{} x{}: throughput {:+.1%}, p95 latency {:+.1%}".format(*key, throughput, latency), file=sys.stderr)
+        if throughput < -tolerance or latency > tolerance:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    """Parse arguments, run the benchmarks and write the results."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--endpoints', nargs='*', choices=SCENARIOS, help='endpoints to benchmark (default all)')
+    parser.add_argument('--concurrency', nargs='*', type=int, default=CONCURRENCY_LEVELS)
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint and concurrency level')
+    parser.add_argument('--accounts', type=int, default=100, help='number of distinct accounts to use')
+    parser.add_argument('--latency', type=float, default=.05, help='fake Horizon latency in seconds')
+    parser.add_argument('--jitter', type=float, default=.01, help='fake Horizon latency jitter in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of failing Horizon requests')
+    parser.add_argument('--output', help='file to write the JSON results to (default stdout)')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare to')
+    parser.add_argument('--tolerance', type=float, default=.1, help='allowed regression from the baseline')
+    args = parser.parse_args()
+
+    with benchmarks.fake_horizon.FakeHorizon(args.latency, args.jitter, args.error_rate) as fake_horizon:
+        # Both the bridge's nodes, which PAKET_BRIDGE_HORIZON_SERVERS may have set, and paket_stellar's server.
+        horizon.SERVERS[:] = [fake_horizon.url]
+        horizon.get_balancer.cache_clear()
+        paket_stellar.HORIZON_SERVER = fake_horizon.url
+        scenarios = Scenarios(args.accounts)
+        results = run(scenarios, args.endpoints or SCENARIOS, args.concurrency, args.requests)
+        horizon_requests = fake_horizon.requests
+
+    report = {
+        'version': routes.VERSION,
+        'python': platform.python_version(),
+        'timestamp': int(time.time()),
+        'horizon': {
+            'latency': args.latency, 'jitter': args.jitter, 'error_rate': args.error_rate,
+            'requests': horizon_requests},
+        'import_profile': [profile_import(lazy_start) for lazy_start in (False, True)],
+        'results': results}
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            if compare(results, json.load(baseline), args.tolerance):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,327 @@
+"""
+Caches for the PAKET bridge.
+
+Caches are created with gen_cache, and are either kept in each process (the
+local backend) or shared by all the processes on a host through an SQLite
+database, preferably on a memory backed file system (the shared backend).
+Both backends have the same interface, and the shared one stores values as JSON.
+The backend of a cache is only chosen when it is first used, so launchers can
+choose it after the bridge was imported.
+"""
+import collections
+import concurrent.futures
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+SHARED_PATH = os.environ.get('PAKET_BRIDGE_SHARED_CACHE_PATH', os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'paket-bridge-cache.db'))
+SHARED_MMAP_SIZE = 64 * 2 ** 20
+# Number of writes between evictions of expired and excess entries from a shared cache.
+SHARED_EVICTION_INTERVAL = 1000
+# Prefix of the names of shared caches, overriding the one get_namespace derives from the bridge's configuration.
+NAMESPACE = os.environ.get('PAKET_BRIDGE_CACHE_NAMESPACE')
+
+
+class TTLCache:
+    """A bounded, thread safe LRU cache with a per entry time to live."""
+
+    def __init__(self, max_size=1024, ttl=5):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+
+    def get(self, key, default=None):
+        """Get a fresh value from the cache, or default if there is none."""
+        with self.lock:
+            try:
+                expiry, value = self.entries[key]
+            except KeyError:
+                return default
+            if expiry < time.monotonic():
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, ttl):
+        """Put a value in the cache, evicting the least recently used entry if full. Requires the lock."""
+        self.entries[key] = time.monotonic() + (self.ttl if ttl is None else ttl), value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def set(self, key, value, ttl=None):
+        """Put a value in the cache, evicting the least recently used entry if full."""
+        if self.max_size < 1:
+            return
+        with self.lock:
+            self.put(key, value, ttl)
+
+    def add(self, key, value, ttl=None):
+        """Put a value in the cache only if it holds no fresh value for key. Return True if it was put."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] >= time.monotonic():
+                return False
+            if self.max_size > 0:
+                self.put(key, value, ttl)
+            return True
+
+    def update(self, key, function, ttl=None):
+        """
+        Atomically replace the value of key with function(value), value being
+        None if there is no fresh one, and return the new value. If the new
+        value is None, key is removed, and if it is value itself, the entry is
+        left as it is, expiry included.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            current = entry[1] if entry is not None and entry[0] >= time.monotonic() else None
+            value = function(current)
+            if value is None:
+                self.entries.pop(key, None)
+            elif value is not current and self.max_size > 0:
+                self.put(key, value, ttl)
+            return value
+
+    def invalidate(self, *keys):
+        """Remove keys from the cache."""
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SharedCache:
+    """
+    A bounded cache with a per entry time to live, shared by all the processes
+    using the same database file. When full, the entries closest to expiry are
+    evicted first. Keys and values must be JSON serializable.
+    """
+
+    def __init__(self, name, max_size=1024, ttl=5, path=SHARED_PATH):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.connections = threading.local()
+        self.writes_lock = threading.Lock()
+        self.writes = 0
+        # Not kept open, so no connection is inherited by processes forked after the cache is created.
+        with contextlib.closing(self.connect()) as connection:
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS entries(
+                    name VARCHAR(64) NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expiry REAL NOT NULL,
+                    PRIMARY KEY (name, key))''')
+            connection.execute('CREATE INDEX IF NOT EXISTS entries_expiry ON entries(name, expiry)')
+
+    def connect(self):
+        """Open a connection to the database."""
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=OFF')
+        connection.execute("PRAGMA mmap_size={}".format(SHARED_MMAP_SIZE))
+        return connection
+
+    def connection(self):
+        """Get the connection of the current thread, opening a new one in forked processes."""
+        if getattr(self.connections, 'pid', None) != os.getpid():
+            self.connections.connection, self.connections.pid = self.connect(), os.getpid()
+        return self.connections.connection
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Get a cursor in a write transaction, committed on success."""
+        sql = self.connection().cursor()
+        sql.execute('BEGIN IMMEDIATE')
+        try:
+            yield sql
+        except BaseException:
+            sql.execute('ROLLBACK')
+            raise
+        sql.execute('COMMIT')
+
+    def read(self, sql, key):
+        """Get the fresh value of key, or None."""
+        sql.execute(
+            'SELECT value FROM entries WHERE name = ? AND key = ? AND expiry >= ?',
+            (self.name, json.dumps(key), time.time()))
+        row = sql.fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def write(self, sql, key, value, ttl):
+        """Put a value in the cache, evicting expired and excess entries every so often."""
+        sql.execute('INSERT OR REPLACE INTO entries VALUES(?, ?, ?, ?)', (
+            self.name, json.dumps(key), json.dumps(value), time.time() + (self.ttl if ttl is None else ttl)))
+        with self.writes_lock:
+            self.writes += 1
+            evict = self.writes % SHARED_EVICTION_INTERVAL == 0
+        if evict:
+            sql.execute('DELETE FROM entries WHERE name = ? AND expiry < ?', (self.name, time.time()))
+            sql.execute(
+                'DELETE FROM entries WHERE name = ? AND key IN ('
+                'SELECT key FROM entries WHERE name = ? ORDER BY expiry DESC LIMIT -1 OFFSET ?)',
+                (self.name, self.name, self.max_size))
+
+    def get(self, key, default=None):
+        """Get a fresh value from the cache, or default if there is none."""
+        value = self.read(self.connection().cursor(), key)
+        return default if value is None else value
+
+    def set(self, key, value, ttl=None):
+        """Put a value in the cache."""
+        if self.max_size < 1:
+            return
+        with self.transaction() as sql:
+            self.write(sql, key, value, ttl)
+
+    def add(self, key, value, ttl=None):
+        """Put a value in the cache only if it holds no fresh value for key. Return True if it was put."""
+        with self.transaction() as sql:
+            if self.read(sql, key) is not None:
+                return False
+            if self.max_size > 0:
+                self.write(sql, key, value, ttl)
+            return True
+
+    def update(self, key, function, ttl=None):
+        """
+        Atomically replace the value of key with function(value), value being
+        None if there is no fresh one, and return the new value. If the new
+        value is None, key is removed, and if it is value itself, the entry is
+        left as it is, expiry included.
+        """
+        with self.transaction() as sql:
+            current = self.read(sql, key)
+            value = function(current)
+            if value is None:
+                sql.execute('DELETE FROM entries WHERE name = ? AND key = ?', (self.name, json.dumps(key)))
+            elif value is not current and self.max_size > 0:
+                self.write(sql, key, value, ttl)
+            return value
+
+    def invalidate(self, *keys):
+        """Remove keys from the cache."""
+        with self.transaction() as sql:
+            sql.executemany(
+                'DELETE FROM entries WHERE name = ? AND key = ?', [(self.name, json.dumps(key)) for key in keys])
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        with self.transaction() as sql:
+            sql.execute('DELETE FROM entries WHERE name = ?', (self.name,))
+
+    def __len__(self):
+        sql = self.connection().cursor()
+        sql.execute('SELECT COUNT(*) FROM entries WHERE name = ? AND expiry >= ?', (self.name, time.time()))
+        return sql.fetchone()[0]
+
+
+def get_backend():
+    """Get the configured cache backend, 'local' or 'shared'."""
+    return os.environ.get('PAKET_BRIDGE_CACHE_BACKEND', 'local')
+
+
+def get_namespace():
+    """
+    Get the prefix of the names of shared caches: NAMESPACE if set, or a hash of
+    the network passphrase, Horizon servers and BUL issuer in use, so bridges on
+    different networks, nodes or assets sharing a host (and so a cache database)
+    do not read each other's accounts, sequences and submissions.
+    """
+    if NAMESPACE:
+        return NAMESPACE
+    # Imported here, since they use caches themselves, and are loaded by the time a cache is first used.
+    import paket_stellar  # pylint: disable=import-outside-toplevel
+    import horizon  # pylint: disable=import-outside-toplevel,cyclic-import
+    import transactions  # pylint: disable=import-outside-toplevel
+    values = [transactions.network_passphrase(), str(paket_stellar.ISSUER)] + (
+        horizon.SERVERS or [paket_stellar.HORIZON_SERVER])
+    return hashlib.sha256('\n'.join(values).encode()).hexdigest()[:16]
+
+
+def create_cache(name, max_size, ttl):
+    """Create a cache of the configured backend, named so a shared cache is the same in all processes."""
+    if get_backend() == 'shared':
+        return SharedCache("{}:{}".format(get_namespace(), name), max_size, ttl)
+    return TTLCache(max_size, ttl)
+
+
+class LazyCache:
+    """A cache of the backend configured when it is first used, rather than when it is declared."""
+
+    def __init__(self, name, max_size, ttl):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.cache = None
+
+    def get_cache(self):
+        """Get the underlying cache, creating it on first use."""
+        if self.cache is None:
+            with self.lock:
+                if self.cache is None:
+                    self.cache = create_cache(self.name, self.max_size, self.ttl)
+        return self.cache
+
+    def __getattr__(self, name):
+        return getattr(self.get_cache(), name)
+
+    def __len__(self):
+        return len(self.get_cache())
+
+
+def gen_cache(name, max_size=1024, ttl=5):
+    """Declare a cache, whose backend is chosen when it is first used."""
+    return LazyCache(name, max_size, ttl)
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into a single call, whose outcome all of them share."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, function, *args, **kwargs):
+        """
+        Call function, unless a call with the same key is in flight, in which
+        case wait for it instead. Return the result, and whether it was shared.
+        Exceptions are raised in all the waiting callers.
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = concurrent.futures.Future()
+        if not leader:
+            return call.result(), True
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as exception:
+            call.set_exception(exception)
+            raise
+        else:
+            call.set_result(result)
+        finally:
+            with self.lock:
+                del self.calls[key]
+        return result, False
@@ -0,0 +1,76 @@
+"""A circuit breaker, failing calls fast while their upstream is unhealthy."""
+import contextlib
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpen(Exception):
+    """A call was rejected because its upstream is considered unavailable."""
+
+
+class CircuitBreaker:
+    """
+    Count consecutive failures of calls to an upstream, and once they reach
+    failure_threshold, reject all calls for reset_timeout seconds. After that
+    a single probe call is let through: its success closes the circuit, and
+    its failure opens it for another reset_timeout.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+
+    def before_call(self):
+        """Raise CircuitOpen if a call may not be made now."""
+        with self.lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                return
+        raise CircuitOpen("{} is unavailable, retry in {:.0f} seconds".format(
+            self.name, max(0, self.reset_timeout - (time.monotonic() - self.opened_at))))
+
+    def is_available(self):
+        """Check if a call may be made now, without changing the state of the circuit."""
+        with self.lock:
+            return self.state == CLOSED or (
+                self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout)
+
+    def record_success(self):
+        """Record a successful call, closing the circuit."""
+        with self.lock:
+            self.state = CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        """Record a failed call, opening the circuit if there were too many or if it was a probe."""
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    @contextlib.contextmanager
+    def guard(self, failures=(Exception,)):
+        """Run a block as a call through the breaker, counting the given exception types as failures."""
+        self.before_call()
+        try:
+            yield
+        except failures:
+            self.record_failure()
+            raise
+        except Exception:
+            # Other errors (e.g. a missing account) show the upstream is responsive.
+            self.record_success()
+            raise
+        self.record_success()
@@ -0,0 +1,330 @@
+"""
+Local index of the escrow and relay packages prepared by the bridge.
+
+The database is at PAKET_BRIDGE_DB, and its tables are created when it is
+first used rather than when the bridge is imported.
+"""
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import util.logger
+
+import horizon
+
+LOGGER = util.logger.logging.getLogger('pkt.bridge.db')
+DB_PATH = os.environ.get('PAKET_BRIDGE_DB', 'bridge.db')
+INGEST_RETRY_DELAY = 5
+# Ingested events between saves of the ingestion cursor. Ingesting an operation twice does no harm, so after
+# a restart up to this many operations are ingested again rather than writing the cursor on every event.
+CURSOR_SAVE_INTERVAL = 100
+PACKAGES_PAGE_SIZE = 50
+MAX_PACKAGES_PAGE_SIZE = 200
+CONNECTIONS = threading.local()
+# Paths of the databases whose tables were created by this process.
+INITIALIZED_PATHS = set()
+INITIALIZED_PATHS_LOCK = threading.Lock()
+
+# Package statuses, in the order a package goes through them.
+PREPARED = 'prepared'
+LAUNCHED = 'launched'
+DELIVERED = 'delivered'
+REFUNDED = 'refunded'
+RELAYED = 'relayed'
+CLOSED = 'closed'
+ACTIVE_STATUSES = (PREPARED, LAUNCHED)
+
+ROLES = {
+    'escrow': ('launcher_pubkey', 'courier_pubkey', 'recipient_pubkey'),
+    'relay': ('relayer_pubkey', 'relayee_pubkey')}
+ROLE_NAMES = tuple(column[:-len('_pubkey')] for roles in ROLES.values() for column in roles)
+# Types of the operations that can change the status of a package, the others are skipped without a lookup.
+INGESTED_TYPES = ('set_options', 'payment', 'account_merge')
+
+
+class InvalidCursor(Exception):
+    """A packages cursor was not returned by get_packages."""
+
+
+def connect():
+    """Open a connection to the database."""
+    connection = sqlite3.connect(DB_PATH, timeout=30)
+    connection.row_factory = sqlite3.Row
+    connection.execute('PRAGMA journal_mode=WAL')
+    return connection
+
+
+@contextlib.contextmanager
+def sql_connection():
+    """
+    Get a cursor on the thread's connection, opening a new one in forked processes, committing on success.
+    The tables are created the first time the process connects.
+    """
+    if getattr(CONNECTIONS, 'pid', None) != os.getpid():
+        if DB_PATH not in INITIALIZED_PATHS:
+            init_db()
+        CONNECTIONS.connection, CONNECTIONS.pid = connect(), os.getpid()
+    with CONNECTIONS.connection:
+        yield CONNECTIONS.connection.cursor()
+
+
+def init_db():
+    """Create the tables and indexes, if they do not exist."""
+    with INITIALIZED_PATHS_LOCK, contextlib.closing(connect()) as connection, connection:
+        sql = connection.cursor()
+        sql.execute('''
+            CREATE TABLE IF NOT EXISTS escrows(
+                escrow_pubkey VARCHAR(56) PRIMARY KEY,
+                launcher_pubkey VARCHAR(56) NOT NULL,
+                courier_pubkey VARCHAR(56) NOT NULL,
+                recipient_pubkey VARCHAR(56) NOT NULL,
+                payment_buls INTEGER NOT NULL,
+                collateral_buls INTEGER NOT NULL,
+                deadline_timestamp INTEGER NOT NULL,
+                status VARCHAR(16) NOT NULL,
+                transactions TEXT NOT NULL,
+                created_timestamp INTEGER NOT NULL,
+                updated_timestamp INTEGER NOT NULL)''')
+        sql.execute('''
+            CREATE TABLE IF NOT EXISTS relays(
+                relay_pubkey VARCHAR(56) PRIMARY KEY,
+                relayer_pubkey VARCHAR(56) NOT NULL,
+                relayee_pubkey VARCHAR(56) NOT NULL,
+                relayer_stroops INTEGER NOT NULL,
+                relayee_stroops INTEGER NOT NULL,
+                deadline_timestamp INTEGER NOT NULL,
+                status VARCHAR(16) NOT NULL,
+                transactions TEXT NOT NULL,
+                created_timestamp INTEGER NOT NULL,
+                updated_timestamp INTEGER NOT NULL)''')
+        for table, roles in ROLES.items():
+            # Packages are listed by role in deadline order, so the role indexes are ordered the same way.
+            for column in roles:
+                sql.execute(
+                    "CREATE INDEX IF NOT EXISTS {0}s_{1}_deadline ON {0}s({1}, deadline_timestamp, {0}_pubkey)".format(
+                        table, column))
+            sql.execute("CREATE INDEX IF NOT EXISTS {0}s_deadline_timestamp ON {0}s(deadline_timestamp)".format(table))
+        sql.execute('CREATE TABLE IF NOT EXISTS cursors(stream VARCHAR(32) PRIMARY KEY, cursor VARCHAR(32) NOT NULL)')
+        sql.execute('''
+            CREATE TABLE IF NOT EXISTS scheduled(
+                transaction_hash VARCHAR(64) PRIMARY KEY,
+                envelope TEXT NOT NULL,
+                due_timestamp INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                attempts INTEGER NOT NULL)''')
+        INITIALIZED_PATHS.add(DB_PATH)
+
+
+def add_escrow(
+        escrow_pubkey, launcher_pubkey, courier_pubkey, recipient_pubkey,
+        payment_buls, collateral_buls, deadline_timestamp, transactions):
+    """Record a prepared escrow, replacing any previous preparation of the same escrow account."""
+    now = int(time.time())
+    with sql_connection() as sql:
+        sql.execute('INSERT OR REPLACE INTO escrows VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+            escrow_pubkey, launcher_pubkey, courier_pubkey, recipient_pubkey, payment_buls, collateral_buls,
+            deadline_timestamp, PREPARED, json.dumps(transactions), now, now))
+
+
+def add_relay(relay_pubkey, relayer_pubkey, relayee_pubkey, relayer_stroops, relayee_stroops,
+              deadline_timestamp, transactions):
+    """Record a prepared relay, replacing any previous preparation of the same relay account."""
+    now = int(time.time())
+    with sql_connection() as sql:
+        sql.execute('INSERT OR REPLACE INTO relays VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+            relay_pubkey, relayer_pubkey, relayee_pubkey, relayer_stroops, relayee_stroops,
+            deadline_timestamp, PREPARED, json.dumps(transactions), now, now))
+
+
+def format_package(row):
+    """Convert a database row to a package dict."""
+    package = dict(row)
+    package['transactions'] = json.loads(package['transactions'])
+    return package
+
+
+def format_cursor(table, package):
+    """Get the cursor of the packages listed after a package: its deadline and pubkey."""
+    return "{}:{}".format(package['deadline_timestamp'], package["{}_pubkey".format(table)])
+
+
+def parse_cursor(cursor):
+    """Get the deadline and pubkey of the last package listed before a cursor."""
+    try:
+        deadline_timestamp, package_pubkey = cursor.split(':', 1)
+        return int(deadline_timestamp), package_pubkey
+    except (AttributeError, ValueError):
+        raise InvalidCursor("invalid packages cursor {}".format(cursor))
+
+
+def get_packages(pubkey, role=None, active_only=False, limit=PACKAGES_PAGE_SIZE, cursor=None):
+    """
+    Get the escrows and relays pubkey takes part in, optionally only in a given
+    role (e.g. launcher) and only those not yet settled, ordered by deadline.
+    At most limit packages are returned, starting after cursor, along with the
+    cursor of the next page, or None if there are no more packages.
+    """
+    limit = max(1, min(limit, MAX_PACKAGES_PAGE_SIZE))
+    parameters = {'pubkey': pubkey, 'limit': limit + 1}
+    if cursor is not None:
+        parameters['deadline_timestamp'], parameters['package_pubkey'] = parse_cursor(cursor)
+    pages = []
+    with sql_connection() as sql:
+        for table, roles in ROLES.items():
+            columns = roles if role is None else tuple(
+                column for column in roles if column == "{}_pubkey".format(role))
+            if not columns:
+                continue
+            query = "SELECT * FROM {}s WHERE ({})".format(
+                table, ' OR '.join("{} = :pubkey".format(column) for column in columns))
+            if active_only:
+                query += " AND status IN ({})".format(', '.join("'{}'".format(status) for status in ACTIVE_STATUSES))
+            if cursor is not None:
+                query += (
+                    " AND (deadline_timestamp > :deadline_timestamp OR "
+                    "(deadline_timestamp = :deadline_timestamp AND {}_pubkey > :package_pubkey))".format(table))
+            sql.execute(query + " ORDER BY deadline_timestamp, {}_pubkey LIMIT :limit".format(table), parameters)
+            pages.extend((table, format_package(row)) for row in sql.fetchall())
+    # Each table was read up to one package past the limit, so the merged page tells if any package is left.
+    pages.sort(key=lambda page: (page[1]['deadline_timestamp'], page[1]["{}_pubkey".format(page[0])]))
+    packages = {"{}s".format(table): [] for table in ROLES}
+    for table, package in pages[:limit]:
+        packages["{}s".format(table)].append(package)
+    packages['next_cursor'] = format_cursor(*pages[limit - 1]) if len(pages) > limit else None
+    return packages
+
+
+def update_status(table, pubkey, status):
+    """Set the status of a package, returning True if it is tracked."""
+    with sql_connection() as sql:
+        sql.execute("UPDATE {0}s SET status = ?, updated_timestamp = ? WHERE {0}_pubkey = ?".format(table), (
+            status, int(time.time()), pubkey))
+        return sql.rowcount > 0
+
+
+def get_package(table, pubkey):
+    """Get a package by its escrow or relay pubkey, or None if it is not tracked."""
+    with sql_connection() as sql:
+        sql.execute("SELECT * FROM {0}s WHERE {0}_pubkey = ?".format(table), (pubkey,))
+        row = sql.fetchone()
+    return None if row is None else format_package(row)
+
+
+def ingest_operation(operation):
+    """
+    Update the status of the package whose account an operation was made from, if any.
+    Return True if a package was updated.
+    """
+    if operation.get('type') not in INGESTED_TYPES:
+        return False
+    source = operation.get('source_account')
+    updated = False
+    for table in ROLES:
+        package = get_package(table, source)
+        if package is None:
+            continue
+        status = None
+        if operation['type'] == 'set_options' and package['status'] == PREPARED:
+            status = LAUNCHED
+        elif operation['type'] == 'payment' and table == 'escrow':
+            status = DELIVERED if operation.get('to') == package['courier_pubkey'] else REFUNDED
+        elif operation['type'] == 'payment' and table == 'relay':
+            # The relay transaction pays the relayer as well, in the same transaction as the relayee.
+            if operation.get('to') == package['relayee_pubkey']:
+                status = RELAYED
+            elif package['status'] != RELAYED:
+                status = REFUNDED
+        elif operation['type'] == 'account_merge':
+            status = CLOSED
+        if status is not None:
+            LOGGER.info("%s %s is now %s", table, source, status)
+            updated = update_status(table, source, status) or updated
+    return updated
+
+
+def get_cursor(stream):
+    """Get the last ingested cursor of a Horizon stream."""
+    with sql_connection() as sql:
+        sql.execute('SELECT cursor FROM cursors WHERE stream = ?', (stream,))
+        row = sql.fetchone()
+    return 'now' if row is None else row['cursor']
+
+
+def set_cursor(stream, cursor):
+    """Record the last ingested cursor of a Horizon stream."""
+    with sql_connection() as sql:
+        sql.execute('INSERT OR REPLACE INTO cursors VALUES(?, ?)', (stream, cursor))
+
+
+def insert_scheduled(transaction_hash, envelope, due_timestamp):
+    """
+    Record a new scheduled envelope, after all the recorded ones. Return its
+    position, or None if it is already recorded.
+    """
+    with sql_connection() as sql:
+        sql.execute('''
+            INSERT OR IGNORE INTO scheduled
+            SELECT ?, ?, ?, COALESCE(MAX(position), -1) + 1, 0 FROM scheduled''', (
+                transaction_hash, envelope, due_timestamp))
+        if not sql.rowcount:
+            return None
+        sql.execute('SELECT position FROM scheduled WHERE transaction_hash = ?', (transaction_hash,))
+        return sql.fetchone()['position']
+
+
+def count_scheduled():
+    """Count the scheduled envelopes."""
+    with sql_connection() as sql:
+        sql.execute('SELECT COUNT(*) FROM scheduled')
+        return sql.fetchone()[0]
+
+
+def add_scheduled(transaction_hash, envelope, due_timestamp, position, attempts=0):
+    """Record a scheduled envelope, or its new due time and attempts if it is already recorded."""
+    with sql_connection() as sql:
+        sql.execute('INSERT OR REPLACE INTO scheduled VALUES(?, ?, ?, ?, ?)', (
+            transaction_hash, envelope, due_timestamp, position, attempts))
+
+
+def remove_scheduled(transaction_hash):
+    """Forget a scheduled envelope."""
+    with sql_connection() as sql:
+        sql.execute('DELETE FROM scheduled WHERE transaction_hash = ?', (transaction_hash,))
+
+
+def get_scheduled():
+    """Get all the scheduled envelopes."""
+    with sql_connection() as sql:
+        sql.execute('SELECT * FROM scheduled ORDER BY due_timestamp, position')
+        return [dict(row) for row in sql.fetchall()]
+
+
+def ingest():
+    """Follow the Horizon operations stream forever, updating the statuses of tracked packages."""
+    while True:
+        try:
+            unsaved_events = 0
+            for event_id, operation in horizon.stream_events('/operations', get_cursor('operations')):
+                updated = isinstance(operation, dict) and ingest_operation(operation)
+                if not event_id:
+                    continue
+                unsaved_events += 1
+                if updated or unsaved_events >= CURSOR_SAVE_INTERVAL:
+                    set_cursor('operations', event_id)
+                    unsaved_events = 0
+        # pylint: disable=broad-except
+        # The ingestion worker must survive any upstream failure.
+        except Exception as exception:
+            LOGGER.warning("operations ingestion failed: %s", exception)
+        # pylint: enable=broad-except
+        time.sleep(INGEST_RETRY_DELAY)
+
+
+def start_ingestion():
+    """Start the ingestion worker in a background thread."""
+    thread = threading.Thread(target=ingest, name='ingestion', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,72 @@
+"""Debug routes of the PAKET bridge, kept apart so they can be loaded lazily."""
+import os
+
+import flasgger
+import flask
+
+import paket_stellar
+import util.logger
+import webserver.validation
+
+import horizon
+import logtail
+import metrics
+import routes
+import swagger_specs
+import transactions
+
+VERSION = routes.VERSION
+FOLLOW_LOG_MAX_SECONDS = 60 * 10
+BLUEPRINT = flask.Blueprint('debug', __name__)
+metrics.instrument_blueprint(BLUEPRINT)
+
+
+@BLUEPRINT.route("/v{}/debug/fund".format(VERSION), methods=['POST'])
+@flasgger.swag_from(swagger_specs.FUND_FROM_ISSUER)
+@webserver.validation.call(['funded_pubkey'])
+@metrics.instrument
+def fund_handler(funded_pubkey, funded_buls=1000000000):
+    """
+    Give an account BULs - for debug only.
+    ---
+    :return:
+    """
+    # Built and signed here rather than by paket_stellar, so it goes through the balanced Horizon session.
+    envelope = transactions.gen_send_buls_envelope(
+        paket_stellar.ISSUER, horizon.get_sequence(paket_stellar.ISSUER), funded_pubkey, funded_buls)
+    envelope.sign(paket_stellar.get_keypair(seed=paket_stellar.ISSUER_SEED))
+    response = horizon.submit_transaction(transactions.envelope_xdr(envelope), envelope)
+    return {'status': 200, 'response': response}
+
+
+@BLUEPRINT.route("/v{}/debug/log".format(VERSION), methods=['POST'])
+@flasgger.swag_from(swagger_specs.LOG)
+@webserver.validation.call
+@metrics.instrument
+def view_log_handler(lines_num=10, logger_name=None, level=None):
+    """
+    Get last lines of log - for debug only.
+    Specify lines_num to get the x last lines, and optionally logger_name
+    and level to get only lines from that logger and level.
+    """
+    return {'status': 200, 'log': logtail.tail(
+        os.path.join(util.logger.LOG_DIR_NAME, util.logger.LOG_FILE_NAME), lines_num, logger_name, level)}
+
+
+@BLUEPRINT.route("/v{}/debug/log/follow".format(VERSION), methods=['POST'])
+@flasgger.swag_from(swagger_specs.FOLLOW_LOG)
+def follow_log_handler():
+    """
+    Stream lines as they are added to the log - for debug only.
+    Optionally specify logger_name and level to filter the streamed lines,
+    and follow_seconds to limit the time the stream stays open.
+    """
+    if not webserver.validation.DEBUG:
+        return routes.error_response(403, 'only available in debug mode')
+    try:
+        duration = min(int(flask.request.values.get('follow_seconds', 60)), FOLLOW_LOG_MAX_SECONDS)
+    except ValueError:
+        return routes.error_response(400, 'follow_seconds must be a number')
+    return flask.Response(flask.stream_with_context(logtail.follow(
+        os.path.join(util.logger.LOG_DIR_NAME, util.logger.LOG_FILE_NAME),
+        flask.request.values.get('logger_name'), flask.request.values.get('level'), duration)), mimetype='text/plain')
@@ -0,0 +1,162 @@
+"""
+Fan out of the Horizon BUL payments stream to clients watching accounts.
+
+Under a WSGI server each stream holds a server thread, so only MAX_STREAMS
+are served at once by each process. The ASGI entry point (asgi.py) serves
+streams on its event loop instead, without a thread per client, up to
+MAX_ASYNC_STREAMS at once.
+"""
+import asyncio
+import collections
+import json
+import os
+import queue
+import threading
+import time
+
+import paket_stellar
+import util.logger
+
+import horizon
+
+LOGGER = util.logger.logging.getLogger('pkt.bridge.events')
+WATCHER_QUEUE_SIZE = int(os.environ.get('PAKET_BRIDGE_WATCHER_QUEUE_SIZE', 100))
+# Each stream served by a WSGI server holds a server thread, so a process only serves a few at once.
+MAX_STREAMS = int(os.environ.get('PAKET_BRIDGE_MAX_EVENT_STREAMS', 2))
+# Streams served on the ASGI event loop only hold a socket and a queue, so many more fit in a process.
+MAX_ASYNC_STREAMS = int(os.environ.get('PAKET_BRIDGE_MAX_ASYNC_EVENT_STREAMS', 1000))
+MAX_STREAM_SECONDS = int(os.environ.get('PAKET_BRIDGE_MAX_EVENT_STREAM_SECONDS', 10 * 60))
+STREAMS_RETRY_AFTER = 30
+HEARTBEAT_INTERVAL = 15
+HEARTBEAT = ':\n\n'
+RECONNECT_DELAY = 1
+MAX_RECONNECT_DELAY = 60
+
+
+class PaymentsFeed:
+    """
+    A single subscription to the Horizon payments stream, started on first
+    use, whose BUL payments are dispatched to every client watching the
+    sending or receiving account.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.watchers = collections.defaultdict(set)
+        self.cursor = 'now'
+        self.thread = None
+
+    def watch(self, pubkey, watcher=None):
+        """
+        Start watching the payments of pubkey, returning the watcher they will
+        be put in: a queue, unless another object with put_nowait is given.
+        """
+        if watcher is None:
+            watcher = queue.Queue(WATCHER_QUEUE_SIZE)
+        with self.lock:
+            self.watchers[pubkey].add(watcher)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='payments-feed', daemon=True)
+                self.thread.start()
+        return watcher
+
+    def unwatch(self, pubkey, watcher):
+        """Stop putting the payments of pubkey in a watcher queue."""
+        with self.lock:
+            self.watchers[pubkey].discard(watcher)
+            if not self.watchers[pubkey]:
+                del self.watchers[pubkey]
+
+    @staticmethod
+    def is_bul_payment(record):
+        """Check if a payments stream record is a BUL payment."""
+        return (
+            isinstance(record, dict) and record.get('asset_code') == paket_stellar.BUL_TOKEN_CODE and
+            record.get('asset_issuer') == paket_stellar.ISSUER)
+
+    def dispatch(self, record):
+        """Put a BUL payment in the queues of all the clients watching its accounts."""
+        pubkeys = {record.get('from'), record.get('to')}
+        # The balances of both accounts just changed.
+        horizon.ACCOUNTS.invalidate(*pubkeys)
+        with self.lock:
+            watchers = [watcher for pubkey in pubkeys for watcher in self.watchers.get(pubkey, ())]
+        for watcher in watchers:
+            try:
+                watcher.put_nowait(record)
+            except queue.Full:
+                LOGGER.warning("dropping payment %s for a slow watcher", record.get('id'))
+
+    def run(self):
+        """Follow the payments stream forever, resuming from the last seen event after failures."""
+        delay = RECONNECT_DELAY
+        while True:
+            try:
+                for event_id, record in horizon.stream_events('/payments', self.cursor):
+                    delay = RECONNECT_DELAY
+                    if event_id:
+                        self.cursor = event_id
+                    if self.is_bul_payment(record):
+                        self.dispatch(record)
+            # pylint: disable=broad-except
+            # The feed must survive any upstream failure.
+            except Exception as exception:
+                LOGGER.warning("payments stream failed: %s", exception)
+            # pylint: enable=broad-except
+            time.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+
+class AsyncWatcher:
+    """A watcher handing the payments put in it by the feed thread to a client served on an event loop."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.records = asyncio.Queue(WATCHER_QUEUE_SIZE)
+
+    def put_nowait(self, record):
+        """Pass a payment to the event loop, from the feed thread."""
+        try:
+            self.loop.call_soon_threadsafe(self.deliver, record)
+        except RuntimeError:
+            # The loop was closed while the client was being unwatched.
+            pass
+
+    def deliver(self, record):
+        """Queue a payment for the client, on the event loop."""
+        try:
+            self.records.put_nowait(record)
+        except asyncio.QueueFull:
+            LOGGER.warning("dropping payment %s for a slow watcher", record.get('id'))
+
+    async def get(self):
+        """Wait for the next payment."""
+        return await self.records.get()
+
+
+FEED = PaymentsFeed()
+STREAMS = threading.BoundedSemaphore(MAX_STREAMS)
+
+
+def format_event(record):
+    """Format a payment record as a server-sent event."""
+    return "id: {}\nevent: payment\ndata: {}\n\n".format(record.get('paging_token', ''), json.dumps(record))
+
+
+def server_sent_events(pubkey, max_seconds=MAX_STREAM_SECONDS):
+    """
+    Yield the BUL payments of pubkey as server-sent events, with heartbeats
+    when idle, for up to max_seconds.
+    """
+    watcher = FEED.watch(pubkey)
+    deadline = time.monotonic() + max_seconds
+    try:
+        while time.monotonic() < deadline:
+            try:
+                record = watcher.get(timeout=max(0, min(HEARTBEAT_INTERVAL, deadline - time.monotonic())))
+            except queue.Empty:
+                yield HEARTBEAT
+                continue
+            yield format_event(record)
+    finally:
+        FEED.unwatch(pubkey, watcher)
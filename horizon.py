@@ -0,0 +1,284 @@
+"""Access layer for all the Horizon calls made by the PAKET bridge."""
+import functools
+import json
+import os
+import random
+import time
+
+import requests
+import requests.adapters
+import urllib3.exceptions
+
+import paket_stellar
+import util.conversion
+import util.logger
+
+import balancer
+import cache
+import circuit
+import metrics
+import sequences
+import transactions
+
+LOGGER = util.logger.logging.getLogger('pkt.bridge.horizon')
+# Comma separated Horizon nodes in order of preference, defaulting to the paket_stellar server.
+SERVERS = [url.strip() for url in os.environ.get('PAKET_BRIDGE_HORIZON_SERVERS', '').split(',') if url.strip()]
+ACCOUNT_CACHE_TTL = float(os.environ.get('PAKET_BRIDGE_ACCOUNT_CACHE_TTL', 5))
+ACCOUNT_CACHE_SIZE = int(os.environ.get('PAKET_BRIDGE_ACCOUNT_CACHE_SIZE', 10000))
+SEQUENCE_TTL = float(os.environ.get('PAKET_BRIDGE_SEQUENCE_TTL', 300))
+POOL_HOSTS = int(os.environ.get('PAKET_BRIDGE_HORIZON_POOL_HOSTS', 4))
+POOL_SIZE = int(os.environ.get('PAKET_BRIDGE_HORIZON_POOL_SIZE', 32))
+CONNECT_TIMEOUT = float(os.environ.get('PAKET_BRIDGE_HORIZON_CONNECT_TIMEOUT', 5))
+READ_TIMEOUT = float(os.environ.get('PAKET_BRIDGE_HORIZON_READ_TIMEOUT', 30))
+ACCOUNT_READ_TIMEOUT = float(os.environ.get('PAKET_BRIDGE_HORIZON_ACCOUNT_READ_TIMEOUT', 5))
+READ_RETRIES = int(os.environ.get('PAKET_BRIDGE_HORIZON_READ_RETRIES', 2))
+RETRY_BACKOFF = float(os.environ.get('PAKET_BRIDGE_HORIZON_RETRY_BACKOFF', .1))
+FAILURE_THRESHOLD = int(os.environ.get('PAKET_BRIDGE_HORIZON_FAILURE_THRESHOLD', 5))
+RESET_TIMEOUT = float(os.environ.get('PAKET_BRIDGE_HORIZON_RESET_TIMEOUT', 30))
+STREAM_READ_TIMEOUT = float(os.environ.get('PAKET_BRIDGE_HORIZON_STREAM_READ_TIMEOUT', 5 * 60))
+BAD_SEQUENCE = 'tx_bad_seq'
+ACCOUNTS = cache.gen_cache('accounts', ACCOUNT_CACHE_SIZE, ACCOUNT_CACHE_TTL)
+ACCOUNT_LOADS = cache.SingleFlight()
+# Guards the calls paket_stellar makes to its own server, which do not go through the balancer.
+BREAKER = circuit.CircuitBreaker('horizon', FAILURE_THRESHOLD, RESET_TIMEOUT)
+
+
+class OutcomeUnknown(Exception):
+    """A submitted transaction may or may not have been applied, since Horizon did not say."""
+
+
+def gen_session():
+    """
+    Create a keep-alive HTTP session with a connection pool of POOL_SIZE
+    connections to each of up to POOL_HOSTS Horizon hosts. Callers block
+    when all the connections to a host are in use.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_SIZE, pool_block=True)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+SESSION = gen_session()
+
+
+def backoff(attempt):
+    """Get a jittered delay before retrying a call for the attempt-th time."""
+    return random.uniform(0, RETRY_BACKOFF * 2 ** attempt)
+
+
+@functools.lru_cache()
+def get_balancer():
+    """Get the balancer of the Horizon nodes, creating it on first use."""
+    return balancer.Balancer(SERVERS or [paket_stellar.HORIZON_SERVER], FAILURE_THRESHOLD, RESET_TIMEOUT)
+
+
+def get_nodes(method):
+    """Get the nodes to send a request to, in order: the fastest first for reads, the preferred first otherwise."""
+    nodes = get_balancer().ranked(fastest_first=method == 'GET')
+    if not nodes:
+        metrics.HORIZON_CALLS.inc(method=method, outcome='rejected')
+        raise circuit.CircuitOpen('all Horizon nodes are unavailable')
+    return nodes
+
+
+def never_sent(exception):
+    """Check if a request failed before reaching Horizon, so sending it again can not apply it twice."""
+    if isinstance(exception, requests.ConnectTimeout):
+        return True
+    if isinstance(exception, requests.ConnectionError) and exception.args:
+        return isinstance(getattr(exception.args[0], 'reason', None), urllib3.exceptions.NewConnectionError)
+    return False
+
+
+def request(method, path, read_timeout=READ_TIMEOUT, retries=0, idempotent=True, **kwargs):
+    """
+    Send a request to Horizon through the shared session, routed by the balancer.
+    Connection errors, timeouts and server errors count as failures of the node,
+    and are retried up to retries times on the next available node, with jittered
+    exponential backoff once all of them were tried. Calls that are not idempotent
+    are only retried when they never reached the node.
+    """
+    nodes = get_nodes(method)
+    for attempt in range(retries + 1):
+        node = nodes[attempt % len(nodes)]
+        if attempt:
+            metrics.HORIZON_RETRIES.inc(method=method)
+            if attempt >= len(nodes):
+                time.sleep(backoff(attempt // len(nodes)))
+        try:
+            node.breaker.before_call()
+        except circuit.CircuitOpen:
+            metrics.HORIZON_CALLS.inc(method=method, outcome='rejected')
+            if attempt == retries:
+                raise
+            continue
+        outcome = 'error'
+        try:
+            with metrics.phase('horizon'):
+                start = time.perf_counter()
+                response = SESSION.request(
+                    method, "{}{}".format(node.url, path), timeout=(CONNECT_TIMEOUT, read_timeout), **kwargs)
+                node.observe(time.perf_counter() - start)
+            outcome = response.status_code
+        # pylint: disable=broad-except
+        # Any error must be recorded, or a failed probe would leave the circuit half open.
+        except Exception as exception:
+            node.breaker.record_failure()
+            if (attempt == retries or not isinstance(exception, requests.RequestException) or
+                    not (idempotent or never_sent(exception))):
+                raise
+            LOGGER.info("%s %s on %s failed, retrying: %s", method, path, node.url, exception)
+            continue
+        # pylint: enable=broad-except
+        finally:
+            metrics.HORIZON_CALLS.inc(method=method, outcome=outcome)
+        if response.status_code < 500:
+            node.breaker.record_success()
+            return response
+        node.breaker.record_failure()
+        if attempt == retries or not idempotent:
+            return response
+        LOGGER.info("%s %s on %s failed with %s, retrying", method, path, node.url, response.status_code)
+    return response
+
+
+def call(function, *args, **kwargs):
+    """
+    Call a paket_stellar function that accesses Horizon through the circuit breaker.
+    Connection errors, timeouts and server errors count as failures of Horizon, and
+    are raised as CircuitOpen, like failures of the bridge's own Horizon calls.
+    """
+    try:
+        with BREAKER.guard(failures=(requests.RequestException,)):
+            return function(*args, **kwargs)
+    except circuit.CircuitOpen:
+        metrics.HORIZON_CALLS.inc(method='CALL', outcome='rejected')
+        raise
+    except requests.RequestException as exception:
+        metrics.HORIZON_CALLS.inc(method='CALL', outcome='error')
+        raise circuit.CircuitOpen("Horizon is unavailable: {}".format(exception)) from exception
+
+
+def stream_events(path, cursor='now'):
+    """
+    Yield (id, data) pairs of a Horizon event stream, starting after cursor.
+    The stream is read from the fastest available node, and ends when the node
+    closes it or is silent for STREAM_READ_TIMEOUT.
+    """
+    node = get_nodes('GET')[0]
+    metrics.HORIZON_CALLS.inc(method='STREAM', outcome='opened')
+    response = SESSION.get(
+        "{}{}".format(node.url, path), params={'cursor': cursor},
+        headers={'Accept': 'text/event-stream'}, stream=True, timeout=(CONNECT_TIMEOUT, STREAM_READ_TIMEOUT))
+    with response:
+        response.raise_for_status()
+        event_id = data = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith('id:'):
+                event_id = line[3:].strip()
+            elif line.startswith('data:'):
+                data = line[5:].strip()
+            elif not line and data is not None:
+                yield event_id, json.loads(data)
+                event_id = data = None
+
+
+def fetch_account(pubkey):
+    """Fetch the raw details of an account from Horizon."""
+    response = request('GET', "/accounts/{}".format(pubkey), ACCOUNT_READ_TIMEOUT, READ_RETRIES)
+    if response.status_code == 404:
+        raise paket_stellar.StellarAccountNotExists("no account found for {}".format(pubkey))
+    response.raise_for_status()
+    return response.json()
+
+
+def load_account(pubkey):
+    """
+    Load the raw details of an account from Horizon. Concurrent loads of the
+    same account share a single Horizon call.
+    """
+    details, shared = ACCOUNT_LOADS.do(pubkey, fetch_account, pubkey)
+    if shared:
+        metrics.COALESCED_CALLS.inc(kind='account')
+    return details
+
+
+def format_bul_account(pubkey, details):
+    """Extract the details of a BUL account from the raw details of a Stellar account."""
+    account = {'sequence': details['sequence'], 'signers': details['signers'], 'thresholds': details['thresholds']}
+    for balance in details['balances']:
+        if balance['asset_type'] == 'native':
+            account['xlm_balance'] = util.conversion.units_to_stroops(balance['balance'])
+        elif balance['asset_code'] == paket_stellar.BUL_TOKEN_CODE and balance['asset_issuer'] == paket_stellar.ISSUER:
+            account['bul_balance'] = util.conversion.units_to_stroops(balance['balance'])
+            account['bul_limit'] = util.conversion.units_to_stroops(balance['limit'])
+    if 'bul_balance' not in account:
+        raise paket_stellar.TrustError("account {} does not trust {} from {}".format(
+            pubkey, paket_stellar.BUL_TOKEN_CODE, paket_stellar.ISSUER))
+    return account
+
+
+def load_sequence(pubkey):
+    """Load the current sequence number of an account from Horizon."""
+    return int(load_account(pubkey)['sequence'])
+
+
+SEQUENCES = sequences.SequenceTracker(load_sequence, ACCOUNT_CACHE_SIZE, SEQUENCE_TTL)
+
+
+def get_sequence(pubkey):
+    """Get the tracked sequence number of pubkey, which its next transaction should be built on."""
+    if SEQUENCES.is_tracked(pubkey):
+        metrics.CACHE_HITS.inc(cache='sequences')
+    else:
+        metrics.CACHE_MISSES.inc(cache='sequences')
+    return SEQUENCES.get(pubkey)
+
+
+def get_bul_account(pubkey):
+    """Get the details of a BUL account, from cache if a fresh copy is available."""
+    account = ACCOUNTS.get(pubkey)
+    if account is None:
+        metrics.CACHE_MISSES.inc(cache='accounts')
+        account = format_bul_account(pubkey, load_account(pubkey))
+        ACCOUNTS.set(pubkey, account)
+    else:
+        metrics.CACHE_HITS.inc(cache='accounts')
+    return account
+
+
+def submit_transaction(envelope, decoded=None):
+    """
+    Submit a signed transaction envelope, invalidate the accounts it touched
+    and keep track of the source account's sequence number. Pass the decoded
+    envelope, if it was already decoded, to save decoding it again.
+    The envelope is only sent to another node if it never reached the first
+    one; when Horizon times out or fails, OutcomeUnknown is raised instead,
+    since the transaction may still be applied.
+    """
+    transaction = (decoded or transactions.decode(envelope)).tx
+    source = transactions.address(transaction.source)
+    try:
+        response = request(
+            'POST', '/transactions', retries=len(get_balancer().nodes) - 1, idempotent=False, data={'tx': envelope})
+    except requests.RequestException as exception:
+        if never_sent(exception):
+            raise
+        raise OutcomeUnknown("transaction from {} may or may not be applied: {}".format(source, exception))
+    if response.status_code >= 500:
+        raise OutcomeUnknown("transaction from {} may or may not be applied: Horizon responded {}".format(
+            source, response.status_code))
+    if response.status_code != 200:
+        details = response.json()
+        if BAD_SEQUENCE in str(details):
+            LOGGER.warning("bad sequence submitted from %s, resyncing", source)
+            SEQUENCES.reset(source)
+        raise paket_stellar.StellarTransactionFailed(details)
+    response = response.json()
+    SEQUENCES.observe(source, int(transaction.sequence))
+    pubkeys = transactions.touched_pubkeys(transaction)
+    LOGGER.debug("invalidating cached accounts %s", pubkeys)
+    ACCOUNTS.invalidate(*pubkeys)
+    return response
@@ -0,0 +1,37 @@
+"""Deferred building of the parts of the bridge that are not needed to serve its API."""
+import threading
+
+
+class LazyDispatcher:
+    """
+    A WSGI middleware passing requests for some paths to an app that is only
+    built when first requested, and all other requests to the main app.
+    """
+
+    def __init__(self, app, factory, paths=(), prefixes=()):
+        """
+        :param app: the main WSGI app
+        :param factory: a callable returning the lazily built WSGI app
+        :param paths: exact paths served by the lazily built app
+        :param prefixes: path prefixes served by the lazily built app
+        """
+        self.app = app
+        self.factory = factory
+        self.paths = frozenset(paths)
+        self.prefixes = tuple(prefixes)
+        self.lock = threading.Lock()
+        self.lazy_app = None
+
+    def get_lazy_app(self):
+        """Get the lazily built app, building it on first use."""
+        if self.lazy_app is None:
+            with self.lock:
+                if self.lazy_app is None:
+                    self.lazy_app = self.factory()
+        return self.lazy_app
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path in self.paths or path.startswith(self.prefixes):
+            return self.get_lazy_app()(environ, start_response)
+        return self.app(environ, start_response)
@@ -0,0 +1,100 @@
+"""Efficient tailing of the bridge log file."""
+import mmap
+import os
+import re
+import time
+
+BLOCK_SIZE = 64 * 1024
+FOLLOW_INTERVAL = .5
+# The level and logger name fields of a log line, which follow its timestamp: "<timestamp> LEVEL name: message",
+# the logger name optionally followed by a line number.
+LINE_PATTERN = re.compile(r'^.*?\b(?P<level>DEBUG|INFO|WARNING|ERROR|CRITICAL)\s+(?P<name>[^\s:]+)(?::\d+)?:')
+
+
+def reverse_lines(logfile, block_size=BLOCK_SIZE):
+    """Yield the lines of a binary file from last to first, reading it backwards in blocks."""
+    logfile.seek(0, os.SEEK_END)
+    position = logfile.tell()
+    remainder = b''
+    while position > 0:
+        read_size = min(block_size, position)
+        position -= read_size
+        logfile.seek(position)
+        lines = (logfile.read(read_size) + remainder).split(b'\n')
+        # The first line may continue in the previous block.
+        remainder = lines.pop(0)
+        for line in reversed(lines):
+            yield line
+    yield remainder
+
+
+def reverse_lines_mmap(logfile):
+    """Yield the lines of a binary file from last to first, using a memory map."""
+    if os.fstat(logfile.fileno()).st_size == 0:
+        return
+    with mmap.mmap(logfile.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        end = len(mapped)
+        while end >= 0:
+            start = mapped.rfind(b'\n', 0, end) + 1
+            yield mapped[start:end]
+            end = start - 1
+
+
+def line_matches(line, logger_name=None, level=None):
+    """
+    Check if a log line was logged by logger_name (or its children) and at level.
+    Lines without a level and logger name, such as those of tracebacks, only match when not filtering.
+    """
+    if logger_name is None and level is None:
+        return True
+    fields = LINE_PATTERN.match(line)
+    if fields is None:
+        return False
+    if logger_name is not None and not (
+            fields.group('name') == logger_name or fields.group('name').startswith(logger_name + '.')):
+        return False
+    if level is not None and fields.group('level') != level.upper():
+        return False
+    return True
+
+
+def tail(path, lines_num, logger_name=None, level=None, use_mmap=False):
+    """
+    Get the last lines_num lines of a log file, newest first, optionally
+    filtered by logger name and level. Reading stops as soon as enough
+    lines are found, so the cost does not depend on the size of the file.
+    """
+    lines = []
+    if lines_num < 1:
+        return lines
+    with open(path, 'rb') as logfile:
+        reader = reverse_lines_mmap(logfile) if use_mmap else reverse_lines(logfile)
+        for index, line in enumerate(reader):
+            # The last line is empty if the file ends with a newline.
+            if index == 0 and not line:
+                continue
+            line = line.decode(errors='replace')
+            if line_matches(line, logger_name, level):
+                lines.append(line + '\n')
+                if len(lines) == lines_num:
+                    break
+    return lines
+
+
+def follow(path, logger_name=None, level=None, duration=60):
+    """Yield lines appended to a log file for duration seconds, optionally filtered."""
+    deadline = time.monotonic() + duration
+    with open(path, errors='replace') as logfile:
+        logfile.seek(0, os.SEEK_END)
+        partial = ''
+        while time.monotonic() < deadline:
+            line = logfile.readline()
+            if not line:
+                time.sleep(FOLLOW_INTERVAL)
+                continue
+            line, partial = partial + line, ''
+            if not line.endswith('\n'):
+                partial = line
+                continue
+            if line_matches(line, logger_name, level):
+                yield line
@@ -0,0 +1,360 @@
+"""
+Latency histograms and counters for the PAKET bridge, exposed in the
+Prometheus text format. Metrics are kept per process, and when
+PAKET_BRIDGE_METRICS_DIR is set, each process also writes a snapshot of
+its metrics there every FLUSH_INTERVAL seconds, so any of them can expose
+the sum over all the processes, including the ones that already exited.
+The counts of exited processes are added up in a single snapshot, so the
+directory does not grow as workers are recycled.
+"""
+import atexit
+import collections
+import contextlib
+import fcntl
+import functools
+import glob
+import json
+import os
+import threading
+import time
+
+import flask
+
+import util.logger
+import webserver.validation
+
+LOGGER = util.logger.logging.getLogger('pkt.bridge.metrics')
+
+BUCKETS = (.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, float('inf'))
+REGISTRY = []
+FLUSH_INTERVAL = float(os.environ.get('PAKET_BRIDGE_METRICS_FLUSH_INTERVAL', 1))
+# The snapshot file of the current process, if metrics are shared, and the pid it was chosen in.
+SNAPSHOT = {'pid': None, 'path': None}
+SNAPSHOT_LOCK = threading.Lock()
+# Snapshot holding the sum of the counts of all the exited processes.
+EXITED_SNAPSHOT_NAME = 'exited.json'
+
+
+def escape(value):
+    """Escape a label value for the Prometheus text format."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels, **extra_labels):
+    """Format a sorted tuple of label pairs (with optional extra labels) for the Prometheus text format."""
+    labels = list(labels) + list(extra_labels.items())
+    if not labels:
+        return ''
+    return "{{{}}}".format(','.join('{}="{}"'.format(key, escape(value)) for key, value in labels))
+
+
+class Counter:
+    """A monotonically increasing counter, with optional labels."""
+    kind = 'counter'
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.lock = threading.Lock()
+        self.values = collections.defaultdict(float)
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        """Increment the counter of a set of labels."""
+        share_snapshots()
+        with self.lock:
+            self.values[tuple(sorted(labels.items()))] += amount
+
+    def snapshot(self):
+        """Get a copy of the values of the counter."""
+        with self.lock:
+            return dict(self.values)
+
+    @staticmethod
+    def merge(values, other_values):
+        """Add the values of the counter in another process to values."""
+        for labels, value in other_values.items():
+            values[labels] = values.get(labels, 0) + value
+
+    def samples(self, values):
+        """Yield the samples of the counter with values."""
+        for labels, value in sorted(values.items()):
+            yield "{}{} {}".format(self.name, format_labels(labels), value)
+
+
+class Histogram:
+    """A histogram of observed values (usually latencies in seconds), with optional labels."""
+    kind = 'histogram'
+
+    def __init__(self, name, description, buckets=BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.values = {}
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        """Record an observed value for a set of labels."""
+        share_snapshots()
+        labels = tuple(sorted(labels.items()))
+        with self.lock:
+            counts, total = self.values.get(labels, ([0] * len(self.buckets), 0))
+            for index, bucket in enumerate(self.buckets):
+                if value <= bucket:
+                    counts[index] += 1
+            self.values[labels] = counts, total + value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observe the time it takes to run a block of code."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        """Get a copy of the values of the histogram."""
+        with self.lock:
+            return {labels: (list(counts), total) for labels, (counts, total) in self.values.items()}
+
+    @staticmethod
+    def merge(values, other_values):
+        """Add the values of the histogram in another process to values."""
+        for labels, (other_counts, other_total) in other_values.items():
+            counts, total = values.get(labels, ([0] * len(other_counts), 0))
+            values[labels] = [count + other_count for count, other_count in zip(counts, other_counts)], \
+                total + other_total
+
+    def samples(self, values):
+        """Yield the samples of the histogram with values."""
+        for labels, (counts, total) in sorted(values.items()):
+            for bucket, count in zip(self.buckets, counts):
+                yield "{}_bucket{} {}".format(
+                    self.name, format_labels(labels, le='+Inf' if bucket == float('inf') else bucket), count)
+            yield "{}_sum{} {}".format(self.name, format_labels(labels), total)
+            yield "{}_count{} {}".format(self.name, format_labels(labels), counts[-1])
+
+
+def snapshot():
+    """Get the values of all the registered metrics in the current process."""
+    return {metric.name: metric.snapshot() for metric in REGISTRY}
+
+
+def write_snapshot(path, values):
+    """Atomically replace the snapshot file at path with values."""
+    temporary_path = "{}.tmp".format(path)
+    with open(temporary_path, 'w') as snapshot_file:
+        json.dump({name: [[labels, value] for labels, value in metric_values.items()]
+                   for name, metric_values in values.items()}, snapshot_file)
+    os.replace(temporary_path, path)
+
+
+def read_snapshot(path):
+    """Read the values in a snapshot file, an empty snapshot if it can not be read."""
+    try:
+        with open(path) as snapshot_file:
+            values = json.load(snapshot_file)
+    except (OSError, ValueError):
+        return {}
+    return {name: {tuple(tuple(label) for label in labels): value for labels, value in metric_values}
+            for name, metric_values in values.items()}
+
+
+def merge_snapshot(values, other_values):
+    """Add the values of all the registered metrics in another snapshot to values."""
+    for metric in REGISTRY:
+        metric.merge(values.setdefault(metric.name, {}), other_values.get(metric.name, {}))
+
+
+@contextlib.contextmanager
+def locked_directory(directory):
+    """Hold the lock of a snapshots directory, so snapshots are not folded while others read or fold them."""
+    descriptor = os.open(directory, os.O_RDONLY)
+    try:
+        fcntl.flock(descriptor, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(descriptor)
+
+
+def fold_snapshot(path, values):
+    """Add the values of an exited process to the exited snapshot, and remove its own. Requires the lock."""
+    exited_path = os.path.join(os.path.dirname(path), EXITED_SNAPSHOT_NAME)
+    exited_values = read_snapshot(exited_path)
+    merge_snapshot(exited_values, values)
+    write_snapshot(exited_path, exited_values)
+    # A process exiting before its first flush has no snapshot of its own yet.
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
+
+
+def snapshot_pid(path):
+    """Get the pid of the process a snapshot file belongs to, or None for the exited snapshot."""
+    pid = os.path.basename(path).split('-', 1)[0]
+    return int(pid) if pid.isdigit() else None
+
+
+def is_alive(pid):
+    """Check if a process is running."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def flush_snapshots(path):
+    """Write the snapshot of the current process every FLUSH_INTERVAL seconds, for as long as path is its file."""
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        # Locked, so the snapshot is not written again after it was folded at exit.
+        with SNAPSHOT_LOCK:
+            if SNAPSHOT['path'] != path:
+                return
+            try:
+                write_snapshot(path, snapshot())
+            except OSError as exception:
+                LOGGER.warning("can not write metrics snapshot %s: %s", path, exception)
+
+
+def share_snapshots():
+    """
+    In a new process, start writing snapshots if PAKET_BRIDGE_METRICS_DIR is set.
+    Checked on every update rather than at import, since launchers set the
+    directory after importing the bridge, and since threads do not survive forks.
+    """
+    if SNAPSHOT['pid'] == os.getpid():
+        return
+    with SNAPSHOT_LOCK:
+        if SNAPSHOT['pid'] == os.getpid():
+            return
+        directory = os.environ.get('PAKET_BRIDGE_METRICS_DIR')
+        # Named by start time as well, so a process reusing the pid of one that exited does not replace its counts.
+        SNAPSHOT['path'] = directory and os.path.join(directory, "{}-{}.json".format(os.getpid(), time.time()))
+        SNAPSHOT['pid'] = os.getpid()
+        if SNAPSHOT['path']:
+            threading.Thread(
+                target=flush_snapshots, args=(SNAPSHOT['path'],), name='metrics-snapshots', daemon=True).start()
+
+
+@atexit.register
+def flush_at_exit():
+    """Add the counts of an exiting process to the exited snapshot, so none of them are lost."""
+    with SNAPSHOT_LOCK:
+        # Processes forked from one that shared snapshots inherit this hook, but not its snapshot file.
+        if not SNAPSHOT['path'] or SNAPSHOT['pid'] != os.getpid():
+            return
+        path, SNAPSHOT['path'] = SNAPSHOT['path'], None
+    try:
+        with locked_directory(os.path.dirname(path)):
+            fold_snapshot(path, snapshot())
+    except OSError as exception:
+        LOGGER.warning("can not fold metrics snapshot %s: %s", path, exception)
+
+
+def clear_snapshots(directory):
+    """Remove the snapshots left in directory by previous runs."""
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        os.remove(path)
+
+
+def collect():
+    """
+    Get the values of all the registered metrics, summed over all the processes sharing snapshots.
+    The snapshots of processes that died without folding their own, when killed, are folded on the way.
+    """
+    share_snapshots()
+    values = snapshot()
+    own_path = SNAPSHOT['path']
+    if own_path:
+        write_snapshot(own_path, values)
+        pattern = os.path.join(os.path.dirname(own_path), '*.json')
+        with locked_directory(os.path.dirname(own_path)):
+            for path in glob.glob(pattern):
+                pid = snapshot_pid(path)
+                if pid is not None and not is_alive(pid):
+                    fold_snapshot(path, read_snapshot(path))
+            for path in glob.glob(pattern):
+                if path != own_path:
+                    merge_snapshot(values, read_snapshot(path))
+    return values
+
+
+def exposition():
+    """Get all the registered metrics in the Prometheus text format."""
+    values = collect()
+    lines = []
+    for metric in REGISTRY:
+        lines.append("# HELP {} {}".format(metric.name, metric.description))
+        lines.append("# TYPE {} {}".format(metric.name, metric.kind))
+        lines.extend(metric.samples(values[metric.name]))
+    return '\n'.join(lines) + '\n'
+
+
+REQUEST_SECONDS = Histogram('bridge_request_seconds', 'Time spent serving requests, by route and HTTP status.')
+HANDLER_SECONDS = Histogram(
+    'bridge_handler_seconds', 'Time spent in route handlers, by route and outcome (status or internal error code).')
+PHASE_SECONDS = Histogram(
+    'bridge_phase_seconds', 'Time spent in each phase of a request (validation, build, horizon), by route.')
+HORIZON_CALLS = Counter('bridge_horizon_calls_total', 'Calls made to Horizon, by method and outcome.')
+HORIZON_RETRIES = Counter('bridge_horizon_retries_total', 'Horizon calls retried, by method.')
+CACHE_HITS = Counter('bridge_cache_hits_total', 'Cache lookups that were served from cache, by cache.')
+CACHE_MISSES = Counter('bridge_cache_misses_total', 'Cache lookups that were not served from cache, by cache.')
+COALESCED_CALLS = Counter(
+    'bridge_coalesced_calls_total', 'Horizon reads that waited on an identical read in flight, by kind.')
+RATE_LIMITED = Counter('bridge_rate_limited_total', 'Calls rejected for exceeding a rate limit, by route and key.')
+
+
+def current_route():
+    """Get the name of the route being served, if any."""
+    if flask.has_request_context() and flask.request.endpoint:
+        return flask.request.endpoint.rsplit('.', 1)[-1]
+    return 'background'
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Record the time spent in a phase of the current request."""
+    with PHASE_SECONDS.time(route=current_route(), phase=name):
+        yield
+
+
+def instrument(handler):
+    """Record the latency and outcome of a route handler, and the time spent validating its call."""
+    @functools.wraps(handler)
+    def _instrumented(*args, **kwargs):
+        start = time.perf_counter()
+        route = current_route()
+        if 'request_start' in flask.g:
+            PHASE_SECONDS.observe(start - flask.g.request_start, route=route, phase='validation')
+        outcome = 500
+        try:
+            response = handler(*args, **kwargs)
+            outcome = response.get('status', 200) if isinstance(response, dict) else 200
+            return response
+        except Exception as exception:
+            outcome = webserver.validation.INTERNAL_ERROR_CODES.get(type(exception), 500)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - start, route=route, outcome=outcome)
+    return _instrumented
+
+
+def instrument_blueprint(blueprint):
+    """Record the total latency of all the requests served by a blueprint."""
+    @blueprint.before_request
+    def start_request_timer():
+        """Note the time a request started."""
+        flask.g.request_start = time.perf_counter()
+
+    @blueprint.after_request
+    def record_request_latency(response):
+        """Record the time it took to serve a request."""
+        if 'request_start' in flask.g:
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - flask.g.request_start, route=current_route(), status=response.status_code)
+        return response
@@ -0,0 +1,35 @@
+"""Thread pools that can be created before the server forks its worker processes."""
+import concurrent.futures
+import os
+import threading
+
+
+class ThreadPool:
+    """
+    A thread pool executor, replaced in each process forked after it is
+    created: a forked process only gets a copy of the executor, without the
+    threads behind it, so work submitted to the copy would never run.
+    """
+
+    def __init__(self, max_workers, thread_name_prefix):
+        self.max_workers = max_workers
+        self.thread_name_prefix = thread_name_prefix
+        self.lock = threading.Lock()
+        self.pid = None
+        self.executor = None
+
+    def get_executor(self):
+        """Get the executor of the current process, creating it on first use."""
+        with self.lock:
+            if self.pid != os.getpid():
+                self.executor = concurrent.futures.ThreadPoolExecutor(self.max_workers, self.thread_name_prefix)
+                self.pid = os.getpid()
+            return self.executor
+
+    def submit(self, function, *args, **kwargs):
+        """Run function(*args, **kwargs) on the pool, returning its future."""
+        return self.get_executor().submit(function, *args, **kwargs)
+
+    def map(self, function, *iterables):
+        """Run function on the items of iterables on the pool, returning an iterator of the results in order."""
+        return self.get_executor().map(function, *iterables)
@@ -0,0 +1,160 @@
+"""
+Pre-flight validation of signed transaction envelopes.
+
+Envelopes that Horizon would certainly reject - malformed, expired, signed
+for another network, built on a used sequence number or missing signatures -
+are rejected locally, using the cached state of their source account, which
+is only reloaded from Horizon before rejecting an envelope for missing
+signatures. Checks that need account state are skipped when it is not
+cached, leaving the decision to Horizon.
+"""
+import time
+
+import paket_stellar
+
+import auth
+import horizon
+import transactions
+
+KNOWN_NETWORK_PASSPHRASES = (
+    'Test SDF Network ; September 2015', 'Public Global Stellar Network ; September 2015')
+ED25519_SIGNER = 'ed25519_public_key'
+PRE_AUTH_SIGNER = 'preauth_tx'
+
+
+class PreflightError(Exception):
+    """A signed envelope would certainly be rejected by Horizon."""
+
+
+class MalformedEnvelope(PreflightError):
+    """An envelope can not be decoded."""
+
+
+class TransactionExpired(PreflightError):
+    """The upper time bound of a transaction has passed."""
+
+
+class TransactionTooEarly(PreflightError):
+    """The lower time bound of a transaction has not passed yet."""
+
+
+class StaleSequence(PreflightError):
+    """A transaction's sequence number was already used by its source account."""
+
+
+class MissingSignatures(PreflightError):
+    """A transaction is not signed by enough of its source account's signers."""
+
+
+class WrongNetwork(PreflightError):
+    """A transaction was signed for another Stellar network."""
+
+
+def signed_by(envelope, pubkey, transaction_hash):
+    """Check if a decoded envelope has pubkey's signature on transaction_hash."""
+    keypair = auth.get_keypair(pubkey)
+    hint = keypair.signature_hint()
+    for decorated_signature in envelope.signatures:
+        if decorated_signature.hint != hint:
+            continue
+        try:
+            keypair.verify(transaction_hash, decorated_signature.signature)
+            return True
+        # pylint: disable=broad-except
+        # ed25519 raises its own error for bad signatures.
+        except Exception:
+            continue
+        # pylint: enable=broad-except
+    return False
+
+
+def check_time_bounds(transaction, now):
+    """Raise if a decoded transaction is not valid at now."""
+    min_time, max_time = transactions.time_bounds(transaction)
+    if max_time and max_time < now:
+        raise TransactionExpired("transaction expired at {}".format(max_time))
+    if min_time > now:
+        raise TransactionTooEarly("transaction is not valid before {}".format(min_time))
+
+
+def check_network(envelope, source):
+    """Raise if a decoded envelope is signed by its source on another network, and not on ours."""
+    our_passphrase = transactions.network_passphrase()
+    if signed_by(envelope, source, transactions.network_hash(envelope, our_passphrase)):
+        return
+    for passphrase in KNOWN_NETWORK_PASSPHRASES:
+        if passphrase != our_passphrase and signed_by(
+                envelope, source, transactions.network_hash(envelope, passphrase)):
+            raise WrongNetwork("transaction was signed for network '{}'".format(passphrase))
+
+
+def signatures_weight(envelope, account, transaction_hash):
+    """Get the total weight of the account signers that authorized a decoded envelope."""
+    pre_auth_key = paket_stellar.stellar_base.utils.encode_check('pre_auth_tx', transaction_hash).decode()
+    weight = 0
+    for signer in account['signers']:
+        key = signer.get('key', signer.get('public_key'))
+        if signer.get('type') == PRE_AUTH_SIGNER and key == pre_auth_key:
+            weight += signer['weight']
+        elif signer.get('type') == ED25519_SIGNER and signer['weight'] and signed_by(envelope, key, transaction_hash):
+            weight += signer['weight']
+    return weight
+
+
+def check_signatures(envelope, account, source, transaction_hash):
+    """Raise if a decoded envelope is not signed by enough of the signers of its source account."""
+    required_weight = max(1, account['thresholds']['low_threshold'])
+    weight = signatures_weight(envelope, account, transaction_hash)
+    if weight < required_weight:
+        raise MissingSignatures("signatures of {} weigh {}, at least {} required".format(
+            source, weight, required_weight))
+
+
+def check_account_state(envelope, transaction, source, transaction_hash):
+    """
+    Raise if a decoded envelope conflicts with the cached state of its source account.
+    Since the signers of the account may have changed since it was cached, an envelope
+    missing signatures is checked again against its current signers before it is rejected.
+    """
+    account = horizon.ACCOUNTS.get(source)
+    if account is None:
+        return
+    if int(transaction.sequence) <= int(account['sequence']):
+        raise StaleSequence("sequence {} of {} already used, account is at {}".format(
+            transaction.sequence, source, account['sequence']))
+    try:
+        check_signatures(envelope, account, source, transaction_hash)
+    except MissingSignatures as missing_signatures:
+        horizon.ACCOUNTS.invalidate(source)
+        try:
+            account = horizon.load_account(source)
+        # pylint: disable=broad-except
+        # When the current signers can not be loaded, the cached ones decide.
+        except Exception:
+            raise missing_signatures
+        # pylint: enable=broad-except
+        check_signatures(envelope, account, source, transaction_hash)
+
+
+def decode(envelope):
+    """Decode a signed envelope, raising MalformedEnvelope if it can not be."""
+    try:
+        decoded = transactions.decode(envelope)
+        transactions.address(decoded.tx.source)
+    # pylint: disable=broad-except
+    # stellar_base raises various errors for malformed envelopes.
+    except Exception as exception:
+        raise MalformedEnvelope("can not decode transaction envelope: {}".format(exception))
+    # pylint: enable=broad-except
+    return decoded
+
+
+def check(envelope, decoded=None):
+    """Validate a signed envelope, raising a PreflightError if it would be rejected. Return it decoded."""
+    decoded = decoded or decode(envelope)
+    transaction = decoded.tx
+    source = transactions.address(transaction.source)
+    check_time_bounds(transaction, time.time())
+    check_network(decoded, source)
+    check_account_state(decoded, transaction, source, transactions.network_hash(decoded))
+    return decoded
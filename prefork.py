@@ -0,0 +1,169 @@
+"""
+Run the PAKET bridge on a pre-forking production server.
+
+The app is imported once in the master process, before forking, so workers
+share its memory copy-on-write. Workers share the listening socket, are
+restarted gracefully on SIGHUP, and drain in-flight requests on SIGTERM.
+Since a request may be served by any worker, caches and rate limits are
+shared by all of them unless PAKET_BRIDGE_CACHE_BACKEND and
+PAKET_BRIDGE_RATE_LIMIT_SHARED_SLOTS say otherwise, and /metrics exposes the
+sum of the metrics of all of them. The background workers (ingestion and
+the scheduler) run in a single process of their own, which requires the
+shared cache backend. It is forked before the server starts by a supervisor
+process, which restarts it whenever it dies, and stops it when the server exits.
+Run with `python -m bridge.prefork`.
+"""
+import atexit
+import multiprocessing
+import os
+import signal
+import tempfile
+import time
+
+import gunicorn.app.base
+
+# Read when the caches are first used, so it applies even though `-m bridge.prefork` imports the bridge first.
+os.environ.setdefault('PAKET_BRIDGE_CACHE_BACKEND', 'shared')
+# Read when metrics are first updated, so every worker shares its metrics and /metrics shows their sum.
+if 'PAKET_BRIDGE_METRICS_DIR' not in os.environ:
+    os.environ['PAKET_BRIDGE_METRICS_DIR'] = tempfile.mkdtemp(prefix='paket-bridge-metrics-')
+
+# pylint: disable=wrong-import-position
+import util.logger
+
+import bridge
+import cache
+import metrics
+import ratelimit
+# pylint: enable=wrong-import-position
+
+LOGGER = util.logger.logging.getLogger('pkt.bridge.prefork')
+WORKERS = int(os.environ.get('PAKET_BRIDGE_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+WORKER_THREADS = int(os.environ.get('PAKET_BRIDGE_WORKER_THREADS', 4))
+GRACEFUL_TIMEOUT = int(os.environ.get('PAKET_BRIDGE_GRACEFUL_TIMEOUT', 30))
+MAX_REQUESTS = int(os.environ.get('PAKET_BRIDGE_WORKER_MAX_REQUESTS', 0))
+BACKGROUND_RESTART_DELAY = float(os.environ.get('PAKET_BRIDGE_BACKGROUND_RESTART_DELAY', 5))
+# Seconds between checks that the background process is alive, and that its parent still is.
+SUPERVISION_INTERVAL = 1
+# Rate limit buckets shared by all the workers, so each budget applies to the server rather than to each worker.
+RATE_LIMIT_SHARED_SLOTS = int(os.environ.get('PAKET_BRIDGE_RATE_LIMIT_SHARED_SLOTS', 65536))
+
+
+# pylint: disable=abstract-method
+# init is only needed for loading config files and command line arguments, which we do not use.
+class PreforkServer(gunicorn.app.base.BaseApplication):
+    """Gunicorn application serving an already imported WSGI app."""
+
+    def __init__(self, application, options):
+        self.application = application
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+# pylint: enable=abstract-method
+
+
+def run_background_workers(supervisor_pid):
+    """Run the background workers until the process is terminated, or its supervisor exits."""
+    bridge.start_workers()
+    while os.getppid() == supervisor_pid:
+        time.sleep(SUPERVISION_INTERVAL)
+
+
+def supervise_background_workers(master_pid):
+    """
+    Run the background workers in a child process, forking a new one whenever it
+    dies, until the master process exits or this process is terminated.
+    """
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signal_number, frame: stopping.append(signal_number))
+    while True:
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                run_background_workers(os.getppid())
+            finally:
+                os._exit(1)
+        while not os.waitpid(pid, os.WNOHANG)[0]:
+            if stopping or os.getppid() != master_pid:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+                return
+            time.sleep(SUPERVISION_INTERVAL)
+        LOGGER.error("background workers exited, restarting them in %s seconds", BACKGROUND_RESTART_DELAY)
+        time.sleep(BACKGROUND_RESTART_DELAY)
+        if stopping or os.getppid() != master_pid:
+            return
+
+
+def stop_background_supervisor(supervisor_pid, master_pid):
+    """Terminate the supervisor of the background workers, when the master process exits."""
+    # Gunicorn workers are forked from the master after this is registered, and must not run it when they exit.
+    if os.getpid() != master_pid:
+        return
+    try:
+        os.kill(supervisor_pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+
+
+def start_background_supervisor():
+    """
+    Fork the supervisor of the background workers, and return its pid.
+    Forked with os.fork, since the multiprocessing exit handlers of the gunicorn
+    workers would terminate a multiprocessing process started by the master.
+    """
+    master_pid = os.getpid()
+    supervisor_pid = os.fork()
+    if supervisor_pid == 0:
+        try:
+            supervise_background_workers(master_pid)
+        finally:
+            os._exit(0)
+    atexit.register(stop_background_supervisor, supervisor_pid, master_pid)
+    return supervisor_pid
+
+
+def share_rate_limits():
+    """
+    Keep the rate limit buckets in shared memory, unless PAKET_BRIDGE_RATE_LIMIT_SHARED_SLOTS
+    is set to 0. Call it before the server forks its workers, which share them.
+    """
+    if RATE_LIMIT_SHARED_SLOTS and not ratelimit.SHARED_SLOTS:
+        ratelimit.BUCKETS = ratelimit.SharedTokenBuckets(RATE_LIMIT_SHARED_SLOTS)
+
+
+def run():
+    """Run the bridge with WORKERS pre-forked worker processes."""
+    if WORKERS > 1 and cache.get_backend() != 'shared':
+        LOGGER.warning(
+            "running %s workers with %s caches: transaction statuses, replayed fingerprints and sequence "
+            "numbers are only known to the worker that recorded them", WORKERS, cache.get_backend())
+    share_rate_limits()
+    # Counts of previous runs would otherwise be added to those of this one.
+    metrics.clear_snapshots(os.environ['PAKET_BRIDGE_METRICS_DIR'])
+    if bridge.INGEST or bridge.scheduler.ENABLED:
+        # The background workers invalidate cached accounts and track sequence numbers for the other workers.
+        if cache.get_backend() != 'shared':
+            raise SystemExit("background workers require the shared cache backend, not {}".format(
+                cache.get_backend()))
+        # Forked before the server installs its signal handlers.
+        start_background_supervisor()
+    PreforkServer(bridge.APP, {
+        'bind': "0.0.0.0:{}".format(bridge.routes.PORT),
+        'workers': WORKERS,
+        'threads': WORKER_THREADS,
+        'preload_app': True,
+        'graceful_timeout': GRACEFUL_TIMEOUT,
+        'max_requests': MAX_REQUESTS,
+        'max_requests_jitter': MAX_REQUESTS // 10}).run()
+
+
+if __name__ == '__main__':
+    run()
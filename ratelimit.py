@@ -0,0 +1,162 @@
+"""Token bucket rate limiting of the bridge routes, per caller pubkey and IP."""
+import functools
+import math
+import multiprocessing
+import os
+import threading
+import time
+import zlib
+
+import flask
+
+import cache
+import metrics
+
+# Comma separated route:rate:burst budgets, rate in calls per second, for each caller pubkey and each IP.
+# A batch or a bulk lookup is a single call, charged to its own route's budget however many items it holds.
+DEFAULT_LIMITS = (
+    'submit_transaction:5:20,prepare_send_buls:5:20,schedule_transactions:1:10,bul_account:20:100,'
+    'batch:1:5,bul_accounts:1:5,prepare_escrow:1:10,prepare_relay:1:10')
+LIMITS = {
+    route: (float(rate), float(burst)) for route, rate, burst in (
+        limit.strip().split(':') for limit in os.environ.get('PAKET_BRIDGE_RATE_LIMITS', DEFAULT_LIMITS).split(',')
+        if limit.strip())}
+# Number of buckets shared by all worker processes, or 0 to keep buckets in each process.
+SHARED_SLOTS = int(os.environ.get('PAKET_BRIDGE_RATE_LIMIT_SHARED_SLOTS', 0))
+LOCAL_BUCKETS_SIZE = int(os.environ.get('PAKET_BRIDGE_RATE_LIMIT_BUCKETS', 100000))
+# Seconds after which an idle bucket is forgotten (and so is full again).
+IDLE_TTL = 60 * 60
+# Number of reverse proxies in front of the bridge, whose X-Forwarded-For entries are trusted to name the client.
+TRUSTED_PROXIES = int(os.environ.get('PAKET_BRIDGE_TRUSTED_PROXIES', 0))
+
+
+class TokenBuckets:
+    """Token buckets of a single process, forgetting the least recently used ones."""
+
+    def __init__(self, max_size=LOCAL_BUCKETS_SIZE):
+        self.lock = threading.Lock()
+        self.buckets = cache.TTLCache(max_size, IDLE_TTL)
+
+    def take(self, key, rate, burst):
+        """Take a token from the bucket of key. Return 0 if one was taken, or the seconds until one is available."""
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (burst, now))
+            tokens, retry_after = refill_and_take(tokens, now - updated, rate, burst)
+            self.buckets.set(key, (tokens, now))
+        return retry_after
+
+
+class SharedTokenBuckets:
+    """
+    Token buckets in shared memory, created before the server forks so all its
+    workers share them. Keys are hashed into a fixed number of slots, so keys
+    that collide share a budget.
+    """
+
+    def __init__(self, slots):
+        self.slots = slots
+        # Tokens and last update time of each slot.
+        self.array = multiprocessing.Array('d', 2 * slots)
+
+    def take(self, key, rate, burst):
+        """Take a token from the bucket of key. Return 0 if one was taken, or the seconds until one is available."""
+        index = 2 * (zlib.crc32(key.encode()) % self.slots)
+        now = time.monotonic()
+        with self.array.get_lock():
+            tokens, updated = self.array[index], self.array[index + 1]
+            if not updated:
+                tokens, updated = burst, now
+            tokens, retry_after = refill_and_take(tokens, now - updated, rate, burst)
+            self.array[index], self.array[index + 1] = tokens, now
+        return retry_after
+
+
+def refill_and_take(tokens, elapsed, rate, burst):
+    """Refill a bucket for the elapsed seconds and take a token. Return the tokens left and the retry delay."""
+    tokens = min(burst, tokens + elapsed * rate)
+    if tokens >= 1:
+        return tokens - 1, 0
+    return tokens, (1 - tokens) / rate
+
+
+BUCKETS = SharedTokenBuckets(SHARED_SLOTS) if SHARED_SLOTS else TokenBuckets()
+
+
+def check_limits(route, **callers):
+    """
+    Take a token from the bucket of each caller of a route, given as kind=identity
+    (e.g. ip=address). Return 0 if the call is allowed, or the seconds to wait otherwise.
+    """
+    if route not in LIMITS:
+        return 0
+    rate, burst = LIMITS[route]
+    retry_after = 0
+    for kind, caller in sorted(callers.items()):
+        if caller:
+            caller_retry_after = BUCKETS.take("{}:{}:{}".format(route, kind, caller), rate, burst)
+            if caller_retry_after:
+                metrics.RATE_LIMITED.inc(route=route, key=kind)
+            retry_after = max(retry_after, caller_retry_after)
+    return retry_after
+
+
+def client_ip(remote_addr, forwarded_for=None):
+    """
+    Get the IP of a client, which is the address added to X-Forwarded-For by the
+    outermost trusted proxy, if there are any, like werkzeug's ProxyFix does.
+    """
+    if TRUSTED_PROXIES and forwarded_for:
+        addresses = [address.strip() for address in forwarded_for.split(',')]
+        if len(addresses) >= TRUSTED_PROXIES:
+            return addresses[-TRUSTED_PROXIES]
+    return remote_addr
+
+
+def too_many_calls(route, retry_after):
+    """Get the result of a call rejected for exceeding the budget of a route."""
+    return {'status': 429, 'error': "too many {} calls, retry in {:.1f} seconds".format(route, retry_after)}
+
+
+def set_retry_after(response, retry_after):
+    """Tell the client of a rejected call when to retry it."""
+    response.headers['Retry-After'] = str(math.ceil(retry_after))
+    return response
+
+
+def route_name(endpoint):
+    """Get the name of a route, which its budget is configured by, from the name of its handler."""
+    return endpoint[:-len('_handler')] if endpoint.endswith('_handler') else endpoint
+
+
+def limit_blueprint(blueprint):
+    """
+    Reject requests to a blueprint's routes from IPs that exceeded their budget, with 429.
+    Pubkeys are not checked here, since the Pubkey header is not verified yet.
+    """
+    @blueprint.before_request
+    def reject_over_limit():
+        """Check the budget of the caller's IP for the requested route."""
+        route = route_name(metrics.current_route())
+        retry_after = check_limits(route, ip=flask.request.remote_addr)
+        if not retry_after:
+            return None
+        return set_retry_after(flask.make_response(flask.jsonify(too_many_calls(route, retry_after)), 429), retry_after)
+
+
+def limit_pubkey(handler):
+    """
+    Reject calls to an authenticated route from pubkeys that exceeded their budget.
+    Must be applied under webserver.validation.call, so only pubkeys whose signature
+    was verified are charged - anyone can put a victim's pubkey in a header.
+    """
+    route = route_name(handler.__name__)
+
+    @functools.wraps(handler)
+    def _limit_pubkey(user_pubkey, *args, **kwargs):
+        retry_after = check_limits(route, pubkey=user_pubkey)
+        if retry_after:
+            flask.after_this_request(functools.partial(set_retry_after, retry_after=retry_after))
+            return too_many_calls(route, retry_after)
+        return handler(user_pubkey, *args, **kwargs)
+    return _limit_pubkey
@@ -0,0 +1,96 @@
+"""Fast JSON encoding and negotiated compression of the bridge responses."""
+import gzip
+import json
+import os
+
+import flask
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+COMPRESSION_MIN_SIZE = int(os.environ.get('PAKET_BRIDGE_COMPRESSION_MIN_SIZE', 1024))
+GZIP_LEVEL = int(os.environ.get('PAKET_BRIDGE_GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('PAKET_BRIDGE_BROTLI_QUALITY', 5))
+
+
+def fast_dumps(obj, **kwargs):
+    """
+    Encode obj as compact JSON, with orjson if it is installed and no
+    pretty printing is asked for, falling back to the standard encoder.
+    """
+    if orjson is not None and not kwargs.get('indent'):
+        try:
+            return orjson.dumps(obj, default=kwargs.get('default'), option=orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            pass
+    if not kwargs.get('indent'):
+        kwargs.setdefault('separators', (',', ':'))
+    return json.dumps(obj, **kwargs)
+
+
+def configure_json(app):
+    """Make an app's JSON responses compact and unsorted, encoded by fast_dumps where Flask allows it."""
+    app.config['JSON_SORT_KEYS'] = False
+    app.config['JSONIFY_PRETTYPRINT_REGULAR'] = False
+    provider = getattr(app, 'json', None)
+    if provider is not None and hasattr(provider, 'dumps'):
+        provider.sort_keys = False
+        provider.compact = True
+        default = provider.default
+
+        def dumps(obj, **kwargs):
+            """Encode with the app's defaults for types JSON does not support."""
+            kwargs.setdefault('default', default)
+            kwargs.pop('sort_keys', None)
+            return fast_dumps(obj, **kwargs)
+        provider.dumps = dumps
+
+
+def accepted_encodings(accept_encoding):
+    """Get the content codings a client accepts, from its Accept-Encoding header."""
+    encodings = set()
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.strip().partition(';')
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        encodings.add(name.strip().lower())
+    return encodings
+
+
+def compress(response):
+    """Compress a response with brotli or gzip, if it is large enough and the client accepts it."""
+    if (response.direct_passthrough or response.is_streamed or response.status_code < 200 or
+            response.status_code in (204, 304) or 'Content-Encoding' in response.headers or
+            response.mimetype == 'text/event-stream'):
+        return response
+    response.vary.add('Accept-Encoding')
+    encodings = accepted_encodings(flask.request.headers.get('Accept-Encoding', ''))
+    if brotli is not None and 'br' in encodings:
+        encoding, compressor = 'br', lambda data: brotli.compress(data, quality=BROTLI_QUALITY)
+    elif 'gzip' in encodings:
+        encoding, compressor = 'gzip', lambda data: gzip.compress(data, GZIP_LEVEL)
+    else:
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESSION_MIN_SIZE:
+        return response
+    response.set_data(compressor(data))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def optimize_blueprint(blueprint):
+    """Encode the JSON responses of a blueprint's app quickly, and compress the responses of the blueprint."""
+    blueprint.record_once(lambda state: configure_json(state.app))
+    blueprint.after_request(compress)
@@ -1,5 +1,10 @@
 """JSON swagger API to PAKET."""
+import collections
+import functools
+import inspect
+import json
 import os
+import time
 
 import flasgger
 import flask
@@ -9,12 +14,31 @@ import util.logger
 import util.conversion
 import webserver.validation
 
+import auth
+import circuit
+import db
+import events
+import horizon
+import metrics
+import pools
+import preflight
+import ratelimit
+import responses
+import scheduler
+import submitter
 import swagger_specs
+import transactions
 
 LOGGER = util.logger.logging.getLogger('pkt.bridge')
 VERSION = swagger_specs.VERSION
 PORT = os.environ.get('PAKET_BRIDGE_PORT', 8001)
+BATCH_SIZE_LIMIT = int(os.environ.get('PAKET_BRIDGE_BATCH_SIZE_LIMIT', 1000))
+BUL_ACCOUNTS_FANOUT = int(os.environ.get('PAKET_BRIDGE_BUL_ACCOUNTS_FANOUT', 16))
+BUL_ACCOUNTS_EXECUTOR = pools.ThreadPool(BUL_ACCOUNTS_FANOUT, 'bul-accounts')
 BLUEPRINT = flask.Blueprint('bridge', __name__)
+metrics.instrument_blueprint(BLUEPRINT)
+ratelimit.limit_blueprint(BLUEPRINT)
+responses.optimize_blueprint(BLUEPRINT)
 
 
 # Input validators and fixers.
@@ -25,9 +49,141 @@ webserver.validation.KWARGS_CHECKERS_AND_FIXERS['_num'] = webserver.validation.c
 
 # Internal error codes.
 webserver.validation.INTERNAL_ERROR_CODES[paket_stellar.NotOnTestnet] = 120
+webserver.validation.INTERNAL_ERROR_CODES[auth.ReplayedFingerprint] = 121
+webserver.validation.INTERNAL_ERROR_CODES[db.InvalidCursor] = 122
 webserver.validation.INTERNAL_ERROR_CODES[paket_stellar.StellarTransactionFailed] = 200
 webserver.validation.INTERNAL_ERROR_CODES[paket_stellar.StellarAccountNotExists] = 201
 webserver.validation.INTERNAL_ERROR_CODES[paket_stellar.TrustError] = 202
+webserver.validation.INTERNAL_ERROR_CODES[circuit.CircuitOpen] = 203
+webserver.validation.INTERNAL_ERROR_CODES[horizon.OutcomeUnknown] = 204
+webserver.validation.INTERNAL_ERROR_CODES[preflight.MalformedEnvelope] = 210
+webserver.validation.INTERNAL_ERROR_CODES[preflight.TransactionExpired] = 211
+webserver.validation.INTERNAL_ERROR_CODES[preflight.TransactionTooEarly] = 212
+webserver.validation.INTERNAL_ERROR_CODES[preflight.StaleSequence] = 213
+webserver.validation.INTERNAL_ERROR_CODES[preflight.MissingSignatures] = 214
+webserver.validation.INTERNAL_ERROR_CODES[preflight.WrongNetwork] = 215
+
+
+# Transaction preparation.
+
+
+def prepare_account(from_pubkey, new_pubkey, starting_balance=50000000, offset=0):
+    """
+    Prepare a create account transaction on top of the tracked sequence of from_pubkey,
+    offset by the transactions from it preceding this one in a batch.
+    """
+    sequence = horizon.get_sequence(from_pubkey) + offset
+    with metrics.phase('build'):
+        return transactions.prepare_create_account(from_pubkey, sequence, new_pubkey, starting_balance)
+
+
+def prepare_trust(from_pubkey, limit=None, offset=0):
+    """
+    Prepare an add trust transaction on top of the tracked sequence of from_pubkey,
+    offset by the transactions from it preceding this one in a batch.
+    """
+    sequence = horizon.get_sequence(from_pubkey) + offset
+    with metrics.phase('build'):
+        return transactions.prepare_trust(from_pubkey, sequence, limit)
+
+
+def prepare_send_buls(from_pubkey, to_pubkey, amount_buls, offset=0):
+    """
+    Prepare a BUL transfer transaction on top of the tracked sequence of from_pubkey,
+    offset by the transactions from it preceding this one in a batch.
+    """
+    sequence = horizon.get_sequence(from_pubkey) + offset
+    with metrics.phase('build'):
+        return transactions.prepare_send_buls(from_pubkey, sequence, to_pubkey, amount_buls)
+
+
+# Calls that can be batched.
+BATCH_CALLS = {
+    'prepare_account': prepare_account,
+    'prepare_trust': prepare_trust,
+    'prepare_send_buls': prepare_send_buls}
+
+
+def check_and_fix_kwargs(kwargs):
+    """Run the webserver checkers and fixers on the arguments of a batched call."""
+    for key, value in kwargs.items():
+        for suffix, checker_and_fixer in webserver.validation.KWARGS_CHECKERS_AND_FIXERS.items():
+            if key.endswith(suffix):
+                kwargs[key] = checker_and_fixer(key, value)
+    return kwargs
+
+
+def internal_error_result(exception):
+    """Get the result of a call of a batch or bulk lookup that failed with an internal error."""
+    return {
+        'status': 400, 'error': str(exception),
+        'code': webserver.validation.INTERNAL_ERROR_CODES[type(exception)]}
+
+
+def check_batched_call(operation):
+    """
+    Check a single call of a batch, before any call of the batch is made.
+    Return the name of the call, the function preparing it and its fixed
+    arguments, or None and the error result of the call.
+    """
+    try:
+        arguments = dict(operation)
+        call = arguments.pop('call')
+        prepare = BATCH_CALLS[call]
+    except (TypeError, ValueError, KeyError):
+        return None, {'status': 400, 'error': "invalid batched call {}".format(operation)}
+    # The offset is set by the batch, not by its caller.
+    if 'offset' in arguments:
+        return None, {'status': 400, 'error': "invalid fields for {}: offset".format(call)}
+    try:
+        inspect.signature(prepare).bind(**arguments)
+    except TypeError as exception:
+        return None, {'status': 400, 'error': "invalid fields for {}: {}".format(call, exception)}
+    try:
+        return (call, prepare, check_and_fix_kwargs(arguments)), None
+    except tuple(webserver.validation.INTERNAL_ERROR_CODES) as exception:
+        return None, internal_error_result(exception)
+
+
+def prepare_batched_call(call, prepare, arguments, offsets):
+    """
+    Prepare a single checked call of a batch, returning its result or error.
+    Offsets holds the number of transactions already prepared from each source
+    account in the batch, so each transaction gets the next sequence number.
+    """
+    try:
+        transaction = prepare(offset=offsets[arguments['from_pubkey']], **arguments)
+    except tuple(webserver.validation.INTERNAL_ERROR_CODES) as exception:
+        LOGGER.info("batched %s failed: %s", call, exception)
+        return internal_error_result(exception)
+    # pylint: disable=broad-except
+    # A failed call must not fail the calls following it in the batch.
+    except Exception as exception:
+        LOGGER.exception("batched %s failed", call)
+        return {'status': 500, 'error': str(exception)}
+    # pylint: enable=broad-except
+    offsets[arguments['from_pubkey']] += 1
+    return {'status': 200, 'transaction': transaction}
+
+
+def get_bul_account_result(pubkey):
+    """Get the details of a BUL account for a bulk lookup, or the error that prevented it."""
+    try:
+        check_and_fix_kwargs({'queried_pubkey': pubkey})
+        return {'status': 200, 'account': horizon.get_bul_account(pubkey)}
+    except tuple(webserver.validation.INTERNAL_ERROR_CODES) as exception:
+        return internal_error_result(exception)
+    # pylint: disable=broad-except
+    # A failed lookup must not fail the lookups of the other accounts.
+    except Exception as exception:
+        LOGGER.warning("bulk lookup of %s failed: %s", pubkey, exception)
+        return {'status': 500, 'error': str(exception)}
+    # pylint: enable=broad-except
+
+
+def error_response(status, error):
+    """Create a JSON error response, for routes that are not wrapped by webserver.validation.call."""
+    return flask.make_response(flask.jsonify({'status': status, 'error': error}), status)
 
 
 # Wallet routes.
@@ -36,23 +192,117 @@ webserver.validation.INTERNAL_ERROR_CODES[paket_stellar.TrustError] = 202
 @BLUEPRINT.route("/v{}/submit_transaction".format(VERSION), methods=['POST'])
 @flasgger.swag_from(swagger_specs.SUBMIT_TRANSACTION)
 @webserver.validation.call(['transaction'])
-def submit_transaction_handler(transaction):
+@metrics.instrument
+def submit_transaction_handler(transaction, asynchronous=False):
     """
     Submit a signed transaction. This call is used to submit signed
     transactions. Signed transactions can be obtained by signing unsigned
     transactions returned by other calls. You can use the
     [laboratory](https://www.stellar.org/laboratory/#txsigner?network=test) to
     sign the transaction with your private key.
+    If asynchronous is set, the transaction is queued for submission and its
+    hash is returned immediately, to be polled with /transaction_status.
+    Transactions that would certainly fail - expired, signed for another
+    network, on a used sequence number or missing signatures - are rejected
+    without being submitted. Resubmitting a transaction returns the outcome
+    of its original submission, without submitting it again, and so without
+    checking it again against the account its original submission updated.
     ---
     :param transaction:
+    :param asynchronous:
     :return:
     """
-    return {'status': 200, 'response': paket_stellar.submit_transaction_envelope(transaction)}
+    with metrics.phase('preflight'):
+        decoded = preflight.decode(transaction)
+        if not submitter.is_known(transactions.transaction_hash(decoded)):
+            preflight.check(transaction, decoded)
+    if str(asynchronous).lower() in ('1', 'true'):
+        return {'status': 202, 'transaction_hash': submitter.enqueue(transaction, decoded)}
+    return {'status': 200, 'response': submitter.submit_once(transaction, decoded)}
+
+
+@BLUEPRINT.route("/v{}/transaction_status".format(VERSION), methods=['POST'])
+@flasgger.swag_from(swagger_specs.TRANSACTION_STATUS)
+@webserver.validation.call(['transaction_hash'])
+@metrics.instrument
+def transaction_status_handler(transaction_hash):
+    """
+    Get the status of a transaction queued by an asynchronous submission.
+    The status is one of scheduled (with its due time), pending, succeeded
+    (with the horizon response) or failed (with the error and its internal
+    error code).
+    ---
+    :param transaction_hash:
+    :return:
+    """
+    status = submitter.get_status(transaction_hash)
+    if status is None:
+        return {'status': 404, 'error': "no queued transaction with hash {}".format(transaction_hash)}
+    return dict(status=200, **status)
+
+
+@BLUEPRINT.route("/v{}/schedule_transactions".format(VERSION), methods=['POST'])
+@flasgger.swag_from(swagger_specs.SCHEDULE_TRANSACTIONS)
+@webserver.validation.call(['envelopes'])
+@metrics.instrument
+def schedule_transactions_handler(envelopes):
+    """
+    Schedule signed transactions for submission once they become valid.
+    The envelopes are a JSON encoded list of signed transactions, typically the
+    refund and merge transactions of an escrow, submitted in the order given:
+    each once its lower time bound passes and after the ones preceding it.
+    Failed submissions are retried with backoff, and their status can be
+    polled with /transaction_status. Transactions already due are submitted
+    at once, so they are checked like submitted transactions, and count
+    against the rate limit of /submit_transaction. Only a few transactions
+    can be scheduled per call, none due too far in the future, and the
+    server stops accepting them when too many are already scheduled.
+    ---
+    :param envelopes:
+    :return:
+    """
+    if not scheduler.ENABLED:
+        return {'status': 403, 'error': 'transaction scheduling is not enabled on this server'}
+    try:
+        envelopes = json.loads(envelopes)
+    except ValueError:
+        envelopes = None
+    if not isinstance(envelopes, list) or not all(isinstance(envelope, str) for envelope in envelopes):
+        return {'status': 400, 'error': 'envelopes must be a JSON encoded list of signed transactions'}
+    if len(envelopes) > scheduler.MAX_ENVELOPES:
+        return {'status': 400, 'error': "can not schedule more than {} transactions".format(scheduler.MAX_ENVELOPES)}
+    with metrics.phase('preflight'):
+        decoded = [preflight.decode(envelope) for envelope in envelopes]
+    due_now = [
+        (envelope, decoded_envelope) for envelope, decoded_envelope, due_timestamp in zip(
+            envelopes, decoded, scheduler.get_due_timestamps(decoded)) if due_timestamp <= time.time()]
+    # Submitted as soon as they are scheduled, so scheduling does not get around the checks and budget of submissions.
+    for _ in due_now:
+        retry_after = ratelimit.check_limits('submit_transaction', ip=flask.request.remote_addr)
+        if retry_after:
+            flask.after_this_request(functools.partial(ratelimit.set_retry_after, retry_after=retry_after))
+            return ratelimit.too_many_calls('submit_transaction', retry_after)
+    with metrics.phase('preflight'):
+        for envelope, decoded_envelope in due_now:
+            if not submitter.is_known(transactions.transaction_hash(decoded_envelope)):
+                preflight.check(envelope, decoded_envelope)
+    try:
+        return {'status': 202, 'scheduled': scheduler.SCHEDULER.schedule(envelopes, decoded)}
+    except scheduler.QueueFull as exception:
+        return {'status': 503, 'error': str(exception)}
+    except scheduler.DueTooLate as exception:
+        return {'status': 400, 'error': str(exception)}
+    # pylint: disable=broad-except
+    # stellar_base raises various errors for malformed envelopes.
+    except Exception as exception:
+        return {'status': 400, 'error': "invalid transaction envelope: {}".format(exception)}
+    # pylint: enable=broad-except
 
 
 @BLUEPRINT.route("/v{}/bul_account".format(VERSION), methods=['POST'])
 @flasgger.swag_from(swagger_specs.BUL_ACCOUNT)
 @webserver.validation.call(['queried_pubkey'])
+@metrics.instrument
 def bul_account_handler(queried_pubkey):
     """
     Get the details of a Stellar BUL account.
@@ -60,13 +310,69 @@ def bul_account_handler(queried_pubkey):
     :param queried_pubkey:
     :return:
     """
-    account = paket_stellar.get_bul_account(queried_pubkey)
+    account = horizon.get_bul_account(queried_pubkey)
     return dict(status=200, account=account)
 
 
+@BLUEPRINT.route("/v{}/bul_accounts".format(VERSION), methods=['POST'])
+@flasgger.swag_from(swagger_specs.BUL_ACCOUNTS)
+@webserver.validation.call(['queried_pubkeys'])
+@metrics.instrument
+def bul_accounts_handler(queried_pubkeys):
+    """
+    Get the details of multiple Stellar BUL accounts.
+    The pubkeys are given comma separated. Accounts are looked up
+    concurrently, and each gets its own result, with either the account
+    details or the error that prevented getting them. The lookup counts as
+    a single call against the rate limit of /bul_accounts.
+    ---
+    :param queried_pubkeys:
+    :return:
+    """
+    pubkeys = list(collections.OrderedDict.fromkeys(
+        pubkey.strip() for pubkey in queried_pubkeys.split(',') if pubkey.strip()))
+    if len(pubkeys) > BATCH_SIZE_LIMIT:
+        return {'status': 400, 'error': "can not query more than {} accounts".format(BATCH_SIZE_LIMIT)}
+    return {'status': 200, 'accounts': dict(zip(pubkeys, BUL_ACCOUNTS_EXECUTOR.map(get_bul_account_result, pubkeys)))}
+
+
+@BLUEPRINT.route("/v{}/bul_account_events".format(VERSION), methods=['GET', 'POST'])
+@flasgger.swag_from(swagger_specs.BUL_ACCOUNT_EVENTS)
+def bul_account_events_handler():
+    """
+    Stream the BUL payments to and from an account as server-sent events.
+    Each event holds the Horizon payment record; a comment is sent when idle
+    to keep the connection open. All clients share a single upstream stream.
+    Streams end after a while, and clients should reconnect; when the server
+    serves too many streams already, it responds with 503 and Retry-After.
+    This handler holds a server thread per stream, so only serves a few; the
+    ASGI entry point serves this route on its event loop instead.
+    ---
+    :return:
+    """
+    kwargs = {'queried_pubkey': flask.request.values.get('queried_pubkey')}
+    if kwargs['queried_pubkey'] is None:
+        return error_response(400, 'missing queried_pubkey')
+    try:
+        check_and_fix_kwargs(kwargs)
+    except tuple(webserver.validation.INTERNAL_ERROR_CODES) as exception:
+        return error_response(400, str(exception))
+    if not events.STREAMS.acquire(blocking=False):
+        response = error_response(503, 'too many event streams, retry later')
+        response.headers['Retry-After'] = str(events.STREAMS_RETRY_AFTER)
+        return response
+    response = flask.Response(
+        flask.stream_with_context(events.server_sent_events(kwargs['queried_pubkey'])),
+        mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Released when the response is closed, even if the stream never started.
+    response.call_on_close(events.STREAMS.release)
+    return response
+
+
 @BLUEPRINT.route("/v{}/prepare_account".format(VERSION), methods=['POST'])
 @flasgger.swag_from(swagger_specs.PREPARE_ACCOUNT)
 @webserver.validation.call(['from_pubkey', 'new_pubkey'])
+@metrics.instrument
 def prepare_account_handler(from_pubkey, new_pubkey, starting_balance=50000000):
     """
     Prepare a create account transaction.
@@ -77,21 +383,15 @@ def prepare_account_handler(from_pubkey, new_pubkey, starting_balance=50000000):
     :return:
     """
     try:
-        return {'status': 200, 'transaction': paket_stellar.prepare_create_account(
-            from_pubkey, new_pubkey, starting_balance)}
-    # pylint: disable=broad-except
-    # stellar_base throws this as a broad exception.
-    except Exception as exception:
-        LOGGER.info(str(exception))
-        if str(exception) == 'No sequence is present, maybe not funded?':
-            return {'status': 400, 'error': "{} is not a funded account".format(from_pubkey)}
-        raise
-    # pylint: enable=broad-except
+        return {'status': 200, 'transaction': prepare_account(from_pubkey, new_pubkey, starting_balance)}
+    except paket_stellar.StellarAccountNotExists:
+        return {'status': 400, 'error': "{} is not a funded account".format(from_pubkey)}
 
 
 @BLUEPRINT.route("/v{}/prepare_trust".format(VERSION), methods=['POST'])
 @flasgger.swag_from(swagger_specs.PREPARE_TRUST)
 @webserver.validation.call(['from_pubkey'])
+@metrics.instrument
 def prepare_trust_handler(from_pubkey, limit=None):
     """
     Prepare an add trust transaction.
@@ -100,12 +400,13 @@ def prepare_trust_handler(from_pubkey, limit=None):
     :param limit:
     :return:
     """
-    return {'status': 200, 'transaction': paket_stellar.prepare_trust(from_pubkey, limit)}
+    return {'status': 200, 'transaction': prepare_trust(from_pubkey, limit)}
 
 
 @BLUEPRINT.route("/v{}/prepare_send_buls".format(VERSION), methods=['POST'])
 @flasgger.swag_from(swagger_specs.PREPARE_SEND_BULS)
 @webserver.validation.call(['from_pubkey', 'to_pubkey', 'amount_buls'])
+@metrics.instrument
 def prepare_send_buls_handler(from_pubkey, to_pubkey, amount_buls):
     """
     Prepare a BUL transfer transaction.
@@ -115,7 +416,39 @@ def prepare_send_buls_handler(from_pubkey, to_pubkey, amount_buls):
     :param amount_buls:
     :return:
     """
-    return {'status': 200, 'transaction': paket_stellar.prepare_send_buls(from_pubkey, to_pubkey, amount_buls)}
+    return {'status': 200, 'transaction': prepare_send_buls(from_pubkey, to_pubkey, amount_buls)}
+
+
+@BLUEPRINT.route("/v{}/batch".format(VERSION), methods=['POST'])
+@flasgger.swag_from(swagger_specs.BATCH)
+@webserver.validation.call(['operations'])
+@metrics.instrument
+def batch_handler(operations):
+    """
+    Prepare multiple transactions in a single call.
+    The operations are a JSON encoded list of objects, each holding the name of
+    the call to batch (prepare_account, prepare_trust or prepare_send_buls)
+    under the 'call' key, and the arguments of that call under their usual names.
+    Transactions from the same source account are prepared with consecutive
+    sequence numbers, in the order given. The batch counts as a single call
+    against the rate limit of /batch. All the operations are checked before
+    any is prepared, and each gets its own result or error.
+    ---
+    :param operations:
+    :return:
+    """
+    try:
+        operations = json.loads(operations)
+    except ValueError:
+        operations = None
+    if not isinstance(operations, list):
+        return {'status': 400, 'error': 'operations must be a JSON encoded list'}
+    if len(operations) > BATCH_SIZE_LIMIT:
+        return {'status': 400, 'error': "can not batch more than {} operations".format(BATCH_SIZE_LIMIT)}
+    checked_calls = [check_batched_call(operation) for operation in operations]
+    offsets = collections.Counter()
+    return {'status': 200, 'results': [
+        error or prepare_batched_call(*checked_call, offsets=offsets) for checked_call, error in checked_calls]}
 
 
 @BLUEPRINT.route("/v{}/prepare_escrow".format(VERSION), methods=['POST'])
@@ -123,6 +456,9 @@ def prepare_send_buls_handler(from_pubkey, to_pubkey, amount_buls):
 @webserver.validation.call(
     ['launcher_pubkey', 'recipient_pubkey', 'courier_pubkey', 'payment_buls', 'collateral_buls', 'deadline_timestamp'],
     require_auth=True)
+@metrics.instrument
+@ratelimit.limit_pubkey
+@auth.reject_replays
 def prepare_escrow_handler(
         user_pubkey, launcher_pubkey, courier_pubkey, recipient_pubkey,
         payment_buls, collateral_buls, deadline_timestamp):
@@ -139,9 +475,17 @@ def prepare_escrow_handler(
     :param deadline_timestamp:
     :return:
     """
-    return dict(status=201, escrow_details=paket_stellar.prepare_escrow(
-        user_pubkey, launcher_pubkey, courier_pubkey, recipient_pubkey,
-        payment_buls, collateral_buls, deadline_timestamp))
+    # Not built in the bridge like the transactions above: paket_stellar owns the layout of escrows,
+    # and loads the escrow account itself, so it builds them.
+    with metrics.phase('build'):
+        escrow_details = horizon.call(
+            paket_stellar.prepare_escrow, user_pubkey, launcher_pubkey, courier_pubkey, recipient_pubkey,
+            payment_buls, collateral_buls, deadline_timestamp)
+    with metrics.phase('index'):
+        db.add_escrow(
+            user_pubkey, launcher_pubkey, courier_pubkey, recipient_pubkey,
+            payment_buls, collateral_buls, deadline_timestamp, escrow_details)
+    return dict(status=201, escrow_details=escrow_details)
 
 
 @BLUEPRINT.route("/v{}/prepare_relay".format(VERSION), methods=['POST'])
@@ -149,6 +493,9 @@ def prepare_escrow_handler(
 @webserver.validation.call(
     ['relayer_pubkey', 'relayee_pubkey', 'relayer_stroops', 'relayee_stroops', 'deadline_timestamp'],
     require_auth=True)
+@metrics.instrument
+@ratelimit.limit_pubkey
+@auth.reject_replays
 def prepare_relay_handler(
         user_pubkey, relayer_pubkey, relayee_pubkey, relayer_stroops,
         relayee_stroops, deadline_timestamp):
@@ -164,32 +511,50 @@ def prepare_relay_handler(
     :param deadline_timestamp:
     :return:
     """
-    return dict(status=201, relay_details=paket_stellar.prepare_relay(
-        user_pubkey, relayer_pubkey, relayee_pubkey, relayer_stroops, relayee_stroops, deadline_timestamp))
-
+    # Not built in the bridge like the transactions above: paket_stellar owns the layout of relays,
+    # and loads the relay account itself, so it builds them.
+    with metrics.phase('build'):
+        relay_details = horizon.call(
+            paket_stellar.prepare_relay, user_pubkey, relayer_pubkey, relayee_pubkey,
+            relayer_stroops, relayee_stroops, deadline_timestamp)
+    with metrics.phase('index'):
+        db.add_relay(
+            user_pubkey, relayer_pubkey, relayee_pubkey, relayer_stroops, relayee_stroops,
+            deadline_timestamp, relay_details)
+    return dict(status=201, relay_details=relay_details)
 
-# Debug routes.
 
-
-@BLUEPRINT.route("/v{}/debug/fund".format(VERSION), methods=['POST'])
-@flasgger.swag_from(swagger_specs.FUND_FROM_ISSUER)
-@webserver.validation.call(['funded_pubkey'])
-def fund_handler(funded_pubkey, funded_buls=1000000000):
+@BLUEPRINT.route("/v{}/packages".format(VERSION), methods=['POST'])
+@flasgger.swag_from(swagger_specs.PACKAGES)
+@webserver.validation.call(['queried_pubkey'])
+@metrics.instrument
+def packages_handler(queried_pubkey, role=None, active_only=False, limit=db.PACKAGES_PAGE_SIZE, cursor=None):
     """
-    Give an account BULs - for debug only.
+    Get the escrows and relays an account takes part in, from the local index.
+    Specify role (launcher, courier, recipient, relayer or relayee) to only get
+    packages where the account has that role, and active_only to only get
+    packages that were not yet settled. Packages are ordered by deadline, up to
+    limit at a time; pass the returned next_cursor as cursor to get the next ones.
     ---
+    :param queried_pubkey:
+    :param role:
+    :param active_only:
+    :param limit:
+    :param cursor:
     :return:
     """
-    return {'status': 200, 'response': paket_stellar.fund_from_issuer(funded_pubkey, funded_buls)}
+    if role is not None and role not in db.ROLE_NAMES:
+        return {'status': 400, 'error': "role must be one of {}".format(', '.join(db.ROLE_NAMES))}
+    limit = webserver.validation.check_and_fix_natural('limit', limit)
+    with metrics.phase('index'):
+        return dict(status=200, **db.get_packages(
+            queried_pubkey, role, str(active_only).lower() in ('1', 'true'), limit, cursor))
 
 
-@BLUEPRINT.route("/v{}/debug/log".format(VERSION), methods=['POST'])
-@flasgger.swag_from(swagger_specs.LOG)
-@webserver.validation.call
-def view_log_handler(lines_num=10):
-    """
-    Get last lines of log - for debug only.
-    Specify lines_num to get the x last lines.
-    """
-    with open(os.path.join(util.logger.LOG_DIR_NAME, util.logger.LOG_FILE_NAME)) as logfile:
-        return {'status': 200, 'log': logfile.readlines()[:-1 - lines_num:-1]}
+# Monitoring routes.
+
+
+@BLUEPRINT.route('/metrics', methods=['GET'])
+def metrics_handler():
+    """Get the bridge metrics in the Prometheus text format."""
+    return flask.Response(metrics.exposition(), mimetype='text/plain; version=0.0.4')
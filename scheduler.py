@@ -0,0 +1,234 @@
+"""Submission of pre-signed escrow transactions once their deadline passes."""
+import collections
+import heapq
+import os
+import threading
+import time
+
+import util.logger
+
+import db
+import submitter
+import transactions
+
+LOGGER = util.logger.logging.getLogger('pkt.bridge.scheduler')
+ENABLED = bool(os.environ.get('PAKET_BRIDGE_SCHEDULER'))
+BATCH_SIZE = int(os.environ.get('PAKET_BRIDGE_SCHEDULER_BATCH_SIZE', 100))
+MAX_ATTEMPTS = int(os.environ.get('PAKET_BRIDGE_SCHEDULER_MAX_ATTEMPTS', 5))
+# Bounds on what unauthenticated callers can make the bridge store: envelopes per call, envelopes in all,
+# and seconds until an envelope is due.
+MAX_ENVELOPES = int(os.environ.get('PAKET_BRIDGE_SCHEDULER_MAX_ENVELOPES', 16))
+MAX_QUEUED = int(os.environ.get('PAKET_BRIDGE_SCHEDULER_MAX_QUEUED', 10000))
+MAX_DELAY = int(os.environ.get('PAKET_BRIDGE_SCHEDULER_MAX_DELAY', 60 * 60 * 24 * 90))
+# Seconds between checks for envelopes scheduled by other processes.
+POLL_INTERVAL = int(os.environ.get('PAKET_BRIDGE_SCHEDULER_POLL_INTERVAL', 10))
+# Seconds to wait after a lower time bound, since ledgers close a few seconds apart.
+GRACE_SECONDS = 5
+RETRY_DELAY = 10
+MAX_RETRY_DELAY = 60 * 60
+
+Entry = collections.namedtuple('Entry', 'due_timestamp position transaction_hash source envelope attempts')
+
+
+class QueueFull(Exception):
+    """Too many envelopes are already scheduled."""
+
+
+class DueTooLate(Exception):
+    """An envelope would only be due too far in the future."""
+
+
+def get_due_timestamps(decoded):
+    """
+    Get the due time of each of a list of decoded envelopes, to be submitted in
+    order: once its lower time bound passes, and not before the one preceding it.
+    """
+    due_timestamps = []
+    for decoded_envelope in decoded:
+        due_timestamps.append(max(
+            due_timestamps[-1] if due_timestamps else 0,
+            transactions.time_bounds(decoded_envelope.tx)[0] + GRACE_SECONDS))
+    return due_timestamps
+
+
+class Scheduler:
+    """
+    A time ordered heap of pre-signed envelopes, each submitted once it is due.
+    Due envelopes are submitted in bulk - concurrently across source accounts,
+    and in scheduling order for each source, so a merge follows the refund it
+    depends on. Failed submissions are retried with exponential backoff, and
+    the heap is persisted in the local database so it survives restarts.
+    Envelopes can be scheduled in any process, but only a single process runs
+    the scheduler: it picks up the envelopes other processes recorded in the
+    database every POLL_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.heap = []
+        # Hashes of the entries in the heap or being submitted.
+        self.hashes = set()
+        self.thread = None
+
+    def push(self, entry):
+        """Put an entry in the heap and wake up the scheduler thread."""
+        with self.condition:
+            heapq.heappush(self.heap, entry)
+            self.hashes.add(entry.transaction_hash)
+            self.condition.notify()
+
+    def add(self, entry):
+        """Push a new entry, unless it is already in the heap or being submitted. Return True if it was pushed."""
+        with self.condition:
+            if entry.transaction_hash in self.hashes:
+                return False
+            self.push(entry)
+            return True
+
+    def forget(self, entry):
+        """Forget an entry that was submitted or given up on."""
+        db.remove_scheduled(entry.transaction_hash)
+        with self.condition:
+            self.hashes.discard(entry.transaction_hash)
+
+    def schedule(self, envelopes, decoded=None):
+        """
+        Schedule signed envelopes for submission in the given order, each due
+        once its lower time bound passes, and not before the one preceding it.
+        Pass the decoded envelopes, if they were already decoded, to save
+        decoding them again. Return the transaction hash and due time of each
+        envelope. Raise QueueFull or DueTooLate, scheduling none of them, if
+        they exceed the bounds on scheduled envelopes.
+        """
+        decoded = decoded or [transactions.decode(envelope) for envelope in envelopes]
+        due_timestamps = get_due_timestamps(decoded)
+        if due_timestamps and due_timestamps[-1] > time.time() + MAX_DELAY:
+            raise DueTooLate("transactions can only be scheduled up to {} seconds ahead".format(MAX_DELAY))
+        if db.count_scheduled() + len(envelopes) > MAX_QUEUED:
+            raise QueueFull('too many transactions are already scheduled')
+        scheduled = []
+        for envelope, decoded_envelope, due_timestamp in zip(envelopes, decoded, due_timestamps):
+            transaction_hash = transactions.transaction_hash(decoded_envelope)
+            scheduled.append({'transaction_hash': transaction_hash, 'due_timestamp': due_timestamp})
+            position = db.insert_scheduled(transaction_hash, envelope, due_timestamp)
+            if position is None:
+                LOGGER.info("transaction %s already scheduled", transaction_hash)
+                continue
+            entry = Entry(
+                due_timestamp, position, transaction_hash,
+                transactions.address(decoded_envelope.tx.source), envelope, 0)
+            self.set_status(entry)
+            # Other processes leave the entry for the scheduler process to pick up from the database.
+            if self.thread is not None:
+                self.add(entry)
+        return scheduled
+
+    @staticmethod
+    def set_status(entry, **details):
+        """Record that an entry is scheduled, until a while after it is due."""
+        status = dict(transaction_status=submitter.SCHEDULED, due_timestamp=entry.due_timestamp, **details)
+        submitter.STATUSES.set(
+            entry.transaction_hash, status, ttl=max(0, entry.due_timestamp - time.time()) + submitter.STATUS_TTL)
+
+    def pop_due(self, now):
+        """Pop up to BATCH_SIZE entries that are due at now."""
+        batch = []
+        with self.condition:
+            while self.heap and self.heap[0].due_timestamp <= now and len(batch) < BATCH_SIZE:
+                batch.append(heapq.heappop(self.heap))
+        return batch
+
+    def reschedule(self, entry):
+        """Persist and push an entry with a new due time or attempts count."""
+        db.add_scheduled(entry.transaction_hash, entry.envelope, entry.due_timestamp, entry.position, entry.attempts)
+        self.push(entry)
+
+    def retry(self, entry, now, error):
+        """
+        Reschedule a failed entry with exponential backoff, and return its new
+        due time, or give up on it after MAX_ATTEMPTS and return None.
+        """
+        if entry.attempts + 1 >= MAX_ATTEMPTS:
+            LOGGER.warning("giving up on scheduled transaction %s: %s", entry.transaction_hash, error)
+            self.forget(entry)
+            return None
+        entry = entry._replace(
+            due_timestamp=now + min(RETRY_DELAY * 2 ** entry.attempts, MAX_RETRY_DELAY), attempts=entry.attempts + 1)
+        self.set_status(entry, attempts=entry.attempts, error=error)
+        self.reschedule(entry)
+        return entry.due_timestamp
+
+    def submit_in_order(self, entries):
+        """
+        Submit the due entries of a single source in order. When one fails,
+        it is retried later, and so are the entries following it.
+        """
+        for index, entry in enumerate(entries):
+            status = submitter.submit(entry.transaction_hash, entry.envelope)
+            if status['transaction_status'] == submitter.SUCCEEDED:
+                LOGGER.info("submitted scheduled transaction %s", entry.transaction_hash)
+                self.forget(entry)
+                continue
+            now = int(time.time())
+            due_timestamp = self.retry(entry, now, status['error']) or now
+            for following_entry in entries[index + 1:]:
+                self.reschedule(following_entry._replace(due_timestamp=due_timestamp))
+            return
+
+    def submit_due(self, now):
+        """Submit the entries due at now, return the number of submitted entries."""
+        batch = self.pop_due(now)
+        sources = collections.OrderedDict()
+        for entry in batch:
+            sources.setdefault(entry.source, []).append(entry)
+        list(submitter.EXECUTOR.map(self.submit_in_order, sources.values()))
+        return len(batch)
+
+    def load(self):
+        """Push the entries recorded in the database that are not in the heap yet. Return their number."""
+        with self.condition:
+            known_hashes = set(self.hashes)
+        loaded = 0
+        for row in db.get_scheduled():
+            if row['transaction_hash'] not in known_hashes:
+                loaded += self.add(Entry(
+                    row['due_timestamp'], row['position'], row['transaction_hash'],
+                    transactions.address(transactions.decode(row['envelope']).tx.source), row['envelope'],
+                    row['attempts']))
+        return loaded
+
+    def run(self):
+        """Submit entries as they become due, forever."""
+        next_load = time.time() + POLL_INTERVAL
+        while True:
+            # pylint: disable=broad-except
+            # The scheduler thread must survive any failure.
+            try:
+                if time.time() >= next_load:
+                    self.load()
+                    next_load = time.time() + POLL_INTERVAL
+                with self.condition:
+                    now = time.time()
+                    if not self.heap or self.heap[0].due_timestamp > now:
+                        wait = next_load - now
+                        if self.heap:
+                            wait = min(wait, self.heap[0].due_timestamp - now)
+                        self.condition.wait(max(0, wait))
+                        continue
+                self.submit_due(now)
+            except Exception as exception:
+                LOGGER.error("scheduled submission failed: %s", exception)
+                time.sleep(RETRY_DELAY)
+            # pylint: enable=broad-except
+
+    def start(self):
+        """
+        Load the persisted entries and start submitting them in a background
+        thread. Must only be called in a single process.
+        """
+        LOGGER.info("scheduler started with %s transactions", self.load())
+        self.thread = threading.Thread(target=self.run, name='scheduler', daemon=True)
+        self.thread.start()
+
+
+SCHEDULER = Scheduler()
@@ -0,0 +1,64 @@
+"""Local tracking of Stellar account sequence numbers."""
+import time
+
+import cache
+
+
+class SequenceTracker:
+    """
+    Track the sequence numbers of source accounts, so transactions can be
+    prepared without loading the account from Horizon each time. A tracked
+    sequence only advances when a transaction from the account is seen
+    applied, so preparing transactions - which anyone can do for any account -
+    can not push it past the sequence the account is really at.
+    """
+
+    def __init__(self, loader, max_size=10000, ttl=300, name='sequences'):
+        """
+        :param loader: a callable returning the current sequence number of a pubkey from Horizon
+        :param max_size: maximal number of tracked accounts
+        :param ttl: seconds after seeding a tracked account from Horizon that it is resynced, however much it is used
+        :param name: name of the cache of tracked sequences, shared with other processes if configured
+        """
+        self.loader = loader
+        self.ttl = ttl
+        # Each tracked account maps to its current sequence number and the time it must be resynced at.
+        self.sequences = cache.gen_cache(name, max_size, ttl)
+
+    def get_tracked(self, pubkey):
+        """Get the tracked sequence of pubkey, or None if it is not tracked or due for a resync."""
+        tracked = self.sequences.get(pubkey)
+        if tracked is None or tracked[1] < time.time():
+            return None
+        return tracked[0]
+
+    def is_tracked(self, pubkey):
+        """Check if the sequence of pubkey is tracked, so getting it requires no Horizon call."""
+        return self.get_tracked(pubkey) is not None
+
+    def get(self, pubkey):
+        """
+        Get the current sequence number of pubkey, the one its next transaction
+        should be built on (as stellar_base expects), seeding it from Horizon
+        if it is not tracked or due for a resync.
+        """
+        sequence = self.get_tracked(pubkey)
+        if sequence is not None:
+            return sequence
+        sequence = int(self.loader(pubkey))
+
+        def seed(tracked):
+            """Seed the tracked sequence, unless another thread or process seeded it meanwhile."""
+            if tracked is None or tracked[1] < time.time():
+                return [sequence, time.time() + self.ttl]
+            return [max(sequence, tracked[0]), tracked[1]]
+        return self.sequences.update(pubkey, seed)[0]
+
+    def observe(self, pubkey, sequence):
+        """Advance the tracked sequence of pubkey after a transaction with sequence was applied."""
+        self.sequences.update(
+            pubkey, lambda tracked: None if tracked is None else [max(tracked[0], sequence), tracked[1]])
+
+    def reset(self, pubkey):
+        """Forget the tracked sequence of pubkey, so it will be resynced from Horizon."""
+        self.sequences.invalidate(pubkey)
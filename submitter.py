@@ -0,0 +1,163 @@
+"""Idempotent and asynchronous submission of signed transactions to Horizon."""
+import os
+import time
+
+import paket_stellar
+import util.logger
+import webserver.validation
+
+import cache
+import horizon
+import metrics
+import pools
+import transactions
+
+LOGGER = util.logger.logging.getLogger('pkt.bridge.submitter')
+WORKERS = int(os.environ.get('PAKET_BRIDGE_SUBMIT_WORKERS', 8))
+STATUS_TTL = float(os.environ.get('PAKET_BRIDGE_SUBMIT_STATUS_TTL', 60 * 60))
+STATUS_SIZE = int(os.environ.get('PAKET_BRIDGE_SUBMIT_STATUS_SIZE', 100000))
+EXECUTOR = pools.ThreadPool(WORKERS, 'submitter')
+# Seconds for which a retried submission gets Horizon's rejection of the original without resubmitting it.
+REJECTION_TTL = float(os.environ.get('PAKET_BRIDGE_SUBMIT_REJECTION_TTL', 5))
+STATUSES = cache.gen_cache('submission_statuses', STATUS_SIZE, STATUS_TTL)
+REJECTIONS = cache.gen_cache('submission_rejections', STATUS_SIZE, REJECTION_TTL)
+# Fields of a Horizon submission response kept for retries, leaving out the bulky envelope and meta XDR.
+RESPONSE_FIELDS = ('hash', 'ledger', 'result_xdr')
+# Seconds for which a transaction is marked pending before its submission starts and while it runs, so the mark
+# of a lost submission expires, and for which other submissions wait for its outcome before reporting it unknown.
+PENDING_TIMEOUT = float(os.environ.get('PAKET_BRIDGE_SUBMIT_PENDING_TIMEOUT', 60))
+PENDING_POLL_INTERVAL = .1
+SUBMISSIONS = cache.SingleFlight()
+
+SCHEDULED = 'scheduled'
+PENDING = 'pending'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+
+def claim(transaction_hash, renew=False):
+    """
+    Mark a transaction pending for PENDING_TIMEOUT seconds, in the statuses shared
+    by all the workers, unless it already is or it succeeded. Return True if it was
+    marked by this call. Pass renew to mark it again if it already is pending, by
+    the caller's own earlier claim.
+    """
+    claimed = []
+
+    def pending(status):
+        """Mark the transaction pending, unless it already is or it succeeded, possibly in another worker."""
+        transaction_status = (status or {}).get('transaction_status')
+        if transaction_status == SUCCEEDED or (transaction_status == PENDING and not renew):
+            return status
+        claimed.append(transaction_hash)
+        return {'transaction_status': PENDING}
+    STATUSES.update(transaction_hash, pending, PENDING_TIMEOUT)
+    return bool(claimed)
+
+
+def release(transaction_hash):
+    """Forget the pending status of a transaction whose submission failed, so it can be submitted again."""
+    STATUSES.update(transaction_hash, lambda status: None if (status or {}).get(
+        'transaction_status') == PENDING else status)
+
+
+def submit_to_horizon(transaction_hash, envelope, decoded, claimed=False):
+    """
+    Submit an envelope to Horizon, recording its success or rejection, and return
+    the Horizon response. Only the fields of the response kept for retries are
+    recorded. The transaction is claimed first, or the caller's claim renewed, and
+    None is returned without submitting it if another worker has it or submitted it.
+    """
+    if not claim(transaction_hash, renew=claimed):
+        return None
+    try:
+        response = horizon.submit_transaction(envelope, decoded)
+    except paket_stellar.StellarTransactionFailed as exception:
+        REJECTIONS.set(transaction_hash, str(exception))
+        if not claimed:
+            release(transaction_hash)
+        raise
+    except Exception:
+        if not claimed:
+            release(transaction_hash)
+        raise
+    STATUSES.set(transaction_hash, {'transaction_status': SUCCEEDED, 'response': {
+        field: response.get(field) for field in RESPONSE_FIELDS}})
+    return response
+
+
+def is_known(transaction_hash):
+    """
+    Check if a transaction succeeded, is queued or was recently rejected, so
+    submitting it again gets the original outcome rather than a new one.
+    """
+    status = STATUSES.get(transaction_hash) or {}
+    return status.get('transaction_status') in (PENDING, SUCCEEDED) or REJECTIONS.get(transaction_hash) is not None
+
+
+def submit_once(envelope, decoded=None, claimed=False):
+    """
+    Submit a signed envelope and return the Horizon response, unless the same
+    transaction was already submitted: return the hash, ledger and result of a
+    successful submission, raise the rejection of a recent one, and wait for the
+    outcome of one in flight, in this worker or another, instead of submitting
+    it again. Pass claimed if the caller already marked the transaction pending.
+    """
+    decoded = decoded or transactions.decode(envelope)
+    transaction_hash = transactions.transaction_hash(decoded)
+    deadline = time.monotonic() + PENDING_TIMEOUT
+    while True:
+        status = STATUSES.get(transaction_hash, {})
+        if status.get('transaction_status') == SUCCEEDED:
+            metrics.CACHE_HITS.inc(cache='submissions')
+            return status['response']
+        rejection = REJECTIONS.get(transaction_hash)
+        if rejection is not None:
+            metrics.CACHE_HITS.inc(cache='submissions')
+            raise paket_stellar.StellarTransactionFailed(rejection)
+        if claimed or status.get('transaction_status') != PENDING:
+            metrics.CACHE_MISSES.inc(cache='submissions')
+            response, shared = SUBMISSIONS.do(
+                transaction_hash, submit_to_horizon, transaction_hash, envelope, decoded, claimed)
+            if shared:
+                metrics.COALESCED_CALLS.inc(kind='submission')
+            if response is not None:
+                return response
+        elif time.monotonic() >= deadline:
+            raise horizon.OutcomeUnknown("transaction {} is still pending in another worker".format(transaction_hash))
+        else:
+            time.sleep(PENDING_POLL_INTERVAL)
+
+
+def submit(transaction_hash, envelope, claimed=False):
+    """
+    Submit an envelope, record its outcome and return it. Pass claimed if the
+    caller already marked the transaction pending.
+    """
+    try:
+        return {'transaction_status': SUCCEEDED, 'response': submit_once(envelope, claimed=claimed)}
+    # pylint: disable=broad-except
+    # Any failure must be reported through the status, since there is no caller to raise it to.
+    except Exception as exception:
+        LOGGER.info("queued transaction %s failed: %s", transaction_hash, exception)
+        status = {
+            'transaction_status': FAILED, 'error': str(exception),
+            'code': webserver.validation.INTERNAL_ERROR_CODES.get(type(exception), 500)}
+        STATUSES.set(transaction_hash, status)
+        return status
+    # pylint: enable=broad-except
+
+
+def enqueue(envelope, decoded=None):
+    """Queue a signed envelope for submission and return its transaction hash."""
+    transaction_hash = transactions.transaction_hash(decoded or transactions.decode(envelope))
+    if not claim(transaction_hash):
+        LOGGER.info("transaction %s already queued", transaction_hash)
+        return transaction_hash
+    EXECUTOR.submit(submit, transaction_hash, envelope, True)
+    return transaction_hash
+
+
+def get_status(transaction_hash):
+    """Get the status of a queued transaction, or None if it is unknown."""
+    return STATUSES.get(transaction_hash)
@@ -157,10 +157,43 @@ SUBMIT_TRANSACTION = {
         {
             'name': 'transaction', 'description': 'transaction to submit',
             'in': 'formData', 'required': True, 'type': 'string'
+        },
+        {
+            'name': 'asynchronous', 'description': 'queue the transaction and return its hash without waiting',
+            'in': 'formData', 'required': False, 'type': 'boolean'
+        }
+    ],
+    'responses': {
+        '200': {'description': 'horizon response'},
+        '202': {'description': 'hash of the queued transaction'}
+    }
+}
+
+TRANSACTION_STATUS = {
+    'parameters': [
+        {
+            'name': 'transaction_hash', 'description': 'hash of a transaction submitted asynchronously',
+            'in': 'formData', 'required': True, 'type': 'string'
         }
     ],
     'responses': {
-        '200': {'description': 'horizon response'}
+        '200': {'description': 'status of the transaction'},
+        '404': {'description': 'no such queued transaction'}
+    }
+}
+
+SCHEDULE_TRANSACTIONS = {
+    'parameters': [
+        {
+            'name': 'envelopes',
+            'description': 'JSON encoded list of signed transactions to submit in order, once each becomes valid',
+            'in': 'formData', 'required': True, 'type': 'string'
+        }
+    ],
+    'responses': {
+        '202': {'description': 'hashes and due timestamps of the scheduled transactions'},
+        '403': {'description': 'scheduling is not enabled'},
+        '503': {'description': 'too many transactions are already scheduled'}
     }
 }
 
@@ -176,6 +209,31 @@ BUL_ACCOUNT = {
     }
 }
 
+BUL_ACCOUNTS = {
+    'parameters': [
+        {
+            'name': 'queried_pubkeys', 'description': 'comma separated pubkeys of the accounts',
+            'in': 'formData', 'required': True, 'type': 'string'
+        }
+    ],
+    'responses': {
+        '200': {'description': 'details or error of each account, by pubkey'}
+    }
+}
+
+BUL_ACCOUNT_EVENTS = {
+    'produces': ['text/event-stream'],
+    'parameters': [
+        {
+            'name': 'queried_pubkey', 'description': 'pubkey of the watched account',
+            'in': 'formData', 'required': True, 'type': 'string'
+        }
+    ],
+    'responses': {
+        '200': {'description': 'server-sent events stream of BUL payments'}
+    }
+}
+
 PREPARE_ACCOUNT = {
     'parameters': [
         {
@@ -232,6 +290,20 @@ PREPARE_SEND_BULS = {
     }
 }
 
+BATCH = {
+    'parameters': [
+        {
+            'name': 'operations',
+            'description': 'JSON encoded list of calls to prepare, e.g. '
+                           '[{"call": "prepare_trust", "from_pubkey": "G..."}]',
+            'in': 'formData', 'required': True, 'type': 'string'
+        }
+    ],
+    'responses': {
+        '200': {'description': 'list of unsigned transactions or errors, in the order of the operations'}
+    }
+}
+
 PREPARE_ESCROW = {
     'parameters': [
         {'name': 'Pubkey', 'in': 'header', 'required': True, 'type': 'string'},
@@ -293,6 +365,33 @@ PREPARE_RELAY = {
 }
 
 
+PACKAGES = {
+    'parameters': [
+        {
+            'name': 'queried_pubkey', 'description': 'pubkey of the account taking part in the packages',
+            'in': 'formData', 'required': True, 'type': 'string'},
+        {
+            'name': 'role', 'description': 'only get packages where the account is the launcher, courier, '
+                                           'recipient, relayer or relayee',
+            'in': 'formData', 'required': False, 'type': 'string'},
+        {
+            'name': 'active_only', 'description': 'only get packages that were not yet settled',
+            'in': 'formData', 'required': False, 'type': 'boolean'},
+        {
+            'name': 'limit', 'description': 'maximal number of packages to get, up to 200 (50 by default)',
+            'in': 'formData', 'required': False, 'type': 'integer'},
+        {
+            'name': 'cursor', 'description': 'next_cursor of the previous page, to get the packages following it',
+            'in': 'formData', 'required': False, 'type': 'string'}
+    ],
+    'responses': {
+        '200': {
+            'description': 'escrows and relays, ordered by deadline, and the next_cursor of the following page',
+        }
+    }
+}
+
+
 FUND_FROM_ISSUER = {
     'tags': ['debug'],
     'parameters': [
@@ -323,6 +422,14 @@ LOG = {
                 'format': 'integer'
             }
         },
+        {
+            'name': 'logger_name', 'description': 'only return lines of this logger and its children',
+            'in': 'formData', 'required': False, 'type': 'string'
+        },
+        {
+            'name': 'level', 'description': 'only return lines of this level (e.g. INFO)',
+            'in': 'formData', 'required': False, 'type': 'string'
+        },
     ],
     'responses': {
         '200': {
@@ -330,3 +437,30 @@ LOG = {
         }
     }
 }
+
+
+FOLLOW_LOG = {
+    'tags': [
+        'debug'
+    ],
+    'produces': ['text/plain'],
+    'parameters': [
+        {
+            'name': 'logger_name', 'description': 'only stream lines of this logger and its children',
+            'in': 'formData', 'required': False, 'type': 'string'
+        },
+        {
+            'name': 'level', 'description': 'only stream lines of this level (e.g. INFO)',
+            'in': 'formData', 'required': False, 'type': 'string'
+        },
+        {
+            'name': 'follow_seconds', 'description': 'seconds to keep streaming (at most 600)',
+            'in': 'formData', 'required': False, 'type': 'integer'
+        },
+    ],
+    'responses': {
+        '200': {
+            'description': 'stream of log lines',
+        }
+    }
+}
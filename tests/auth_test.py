@@ -0,0 +1,48 @@
+"""Tests for auth module"""
+import unittest
+
+import paket_stellar
+import webserver.validation
+
+import auth
+
+
+class ReplayTest(unittest.TestCase):
+    """Test for replay rejection."""
+
+    def setUp(self):
+        self.pubkey = paket_stellar.get_keypair().address().decode()
+
+    def test_replay(self):
+        """Test that a fingerprint can only be used once."""
+        fingerprint = webserver.validation.generate_fingerprint('http://localhost/v3/prepare_escrow', {})
+        auth.record(self.pubkey, fingerprint)
+        with self.assertRaises(auth.ReplayedFingerprint):
+            auth.record(self.pubkey, fingerprint)
+
+    def test_other_pubkey(self):
+        """Test that a fingerprint used by one pubkey can still be used by another."""
+        fingerprint = webserver.validation.generate_fingerprint('http://localhost/v3/prepare_relay', {})
+        auth.record(self.pubkey, fingerprint)
+        auth.record(paket_stellar.get_keypair().address().decode(), fingerprint)
+
+
+class KeypairTest(unittest.TestCase):
+    """Test for the keypair cache."""
+
+    def test_cache_hit(self):
+        """Test that signatures of a pubkey are verified with a single decoded keypair."""
+        keypair = paket_stellar.get_keypair()
+        pubkey = keypair.address().decode()
+        auth.get_keypair.cache_clear()
+        for message in (b'first call', b'second call'):
+            auth.get_keypair(pubkey).verify(message, keypair.sign(message))
+        self.assertEqual(auth.get_keypair.cache_info().misses, 1)
+        self.assertEqual(auth.get_keypair.cache_info().hits, 1)
+
+    def test_library_untouched(self):
+        """Test that other callers of stellar_base still get keypairs of their own."""
+        pubkey = paket_stellar.get_keypair().address().decode()
+        self.assertIsNot(
+            paket_stellar.stellar_base.keypair.Keypair.from_address(pubkey),
+            paket_stellar.stellar_base.keypair.Keypair.from_address(pubkey))
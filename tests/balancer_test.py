@@ -0,0 +1,47 @@
+"""Tests for balancer module"""
+import unittest
+import unittest.mock
+
+import balancer
+
+
+class BalancerTest(unittest.TestCase):
+    """Test for Balancer."""
+
+    def setUp(self):
+        self.balancer = balancer.Balancer(['http://primary/', 'http://replica'], failure_threshold=1)
+        self.primary, self.replica = self.balancer.nodes
+
+    def test_preferred(self):
+        """Test that nodes are ranked by preference, skipping unavailable ones."""
+        self.primary.observe(1)
+        self.replica.observe(.1)
+        self.assertEqual(self.balancer.ranked(), [self.primary, self.replica])
+        self.primary.breaker.record_failure()
+        self.assertEqual(self.balancer.ranked(), [self.replica])
+
+    def test_fastest(self):
+        """Test that nodes are ranked by rolling latency, unmeasured ones first."""
+        self.assertEqual(self.primary.url, 'http://primary')
+        self.primary.observe(.1)
+        self.assertEqual(self.balancer.ranked(fastest_first=True), [self.replica, self.primary])
+        self.replica.observe(.2)
+        self.assertEqual(self.balancer.ranked(fastest_first=True), [self.primary, self.replica])
+        for _ in range(10):
+            self.primary.observe(1)
+        self.assertEqual(self.balancer.ranked(fastest_first=True), [self.replica, self.primary])
+
+    def test_stale_latency(self):
+        """Test that nodes are measured again once their rolling latency is stale."""
+        self.primary.observe(1)
+        self.replica.observe(.1)
+        self.assertEqual(self.balancer.ranked(fastest_first=True), [self.replica, self.primary])
+        with unittest.mock.patch('balancer.LATENCY_TTL', 0):
+            self.assertIsNone(self.primary.get_latency())
+            self.primary.observe(.2)
+        self.assertEqual(self.primary.latency, .2)
+        self.replica.measured_at -= balancer.LATENCY_TTL
+        self.assertEqual(self.balancer.ranked(fastest_first=True), [self.replica, self.primary])
+        self.primary.measured_at -= balancer.LATENCY_TTL
+        self.replica.observe(.1)
+        self.assertEqual(self.balancer.ranked(fastest_first=True), [self.primary, self.replica])
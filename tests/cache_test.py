@@ -0,0 +1,226 @@
+"""Tests for cache module"""
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+
+import paket_stellar
+
+import cache
+import horizon
+
+
+class TTLCacheTest(unittest.TestCase):
+    """Test for TTLCache."""
+
+    def test_get_and_set(self):
+        """Test getting a cached value."""
+        ttl_cache = cache.TTLCache()
+        self.assertIsNone(ttl_cache.get('key'))
+        ttl_cache.set('key', 'value')
+        self.assertEqual(ttl_cache.get('key'), 'value')
+
+    def test_expiry(self):
+        """Test that stale entries are not returned."""
+        ttl_cache = cache.TTLCache(ttl=.01)
+        ttl_cache.set('key', 'value')
+        time.sleep(.02)
+        self.assertIsNone(ttl_cache.get('key'))
+        self.assertEqual(len(ttl_cache), 0)
+
+    def test_lru_eviction(self):
+        """Test that the least recently used entry is evicted when full."""
+        ttl_cache = cache.TTLCache(max_size=2)
+        ttl_cache.set('first', 1)
+        ttl_cache.set('second', 2)
+        ttl_cache.get('first')
+        ttl_cache.set('third', 3)
+        self.assertEqual(ttl_cache.get('first'), 1)
+        self.assertIsNone(ttl_cache.get('second'))
+        self.assertEqual(ttl_cache.get('third'), 3)
+
+    def test_invalidate(self):
+        """Test invalidating entries."""
+        ttl_cache = cache.TTLCache()
+        ttl_cache.set('first', 1)
+        ttl_cache.set('second', 2)
+        ttl_cache.invalidate('first', 'missing')
+        self.assertIsNone(ttl_cache.get('first'))
+        self.assertEqual(ttl_cache.get('second'), 2)
+
+    def test_add(self):
+        """Test adding only missing or stale entries."""
+        ttl_cache = cache.TTLCache(ttl=.01)
+        self.assertTrue(ttl_cache.add('key', 1))
+        self.assertFalse(ttl_cache.add('key', 2))
+        self.assertEqual(ttl_cache.get('key'), 1)
+        time.sleep(.02)
+        self.assertTrue(ttl_cache.add('key', 3))
+        self.assertEqual(ttl_cache.get('key'), 3)
+
+    def test_update(self):
+        """Test atomically replacing and removing entries."""
+        ttl_cache = cache.TTLCache()
+        self.assertEqual(ttl_cache.update('key', lambda value: (value or 0) + 1), 1)
+        self.assertEqual(ttl_cache.update('key', lambda value: (value or 0) + 1), 2)
+        self.assertIsNone(ttl_cache.update('key', lambda value: None))
+        self.assertIsNone(ttl_cache.get('key'))
+
+    def test_update_unchanged(self):
+        """Test that an update keeping the value keeps its expiry."""
+        ttl_cache = cache.TTLCache()
+        ttl_cache.set('key', {'value': 1}, ttl=.01)
+        self.assertEqual(ttl_cache.update('key', lambda value: value, ttl=60), {'value': 1})
+        time.sleep(.02)
+        self.assertIsNone(ttl_cache.get('key'))
+
+
+def increment_shared(path, times):
+    """Increment a counter in a shared cache, from another process."""
+    shared_cache = cache.SharedCache('counters', path=path)
+    for _ in range(times):
+        shared_cache.update('counter', lambda value: (value or 0) + 1)
+
+
+class SharedCacheTest(unittest.TestCase):
+    """Test for SharedCache."""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+
+    def tearDown(self):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def test_get_and_set(self):
+        """Test getting a cached value, shared by caches of the same name only."""
+        shared_cache = cache.SharedCache('accounts', path=self.path)
+        self.assertIsNone(shared_cache.get('key'))
+        shared_cache.set('key', {'sequence': '1', 'signers': []})
+        self.assertEqual(shared_cache.get('key'), {'sequence': '1', 'signers': []})
+        self.assertEqual(cache.SharedCache('accounts', path=self.path).get('key'), {'sequence': '1', 'signers': []})
+        self.assertIsNone(cache.SharedCache('statuses', path=self.path).get('key'))
+
+    def test_expiry(self):
+        """Test that stale entries are not returned."""
+        shared_cache = cache.SharedCache('accounts', ttl=.01, path=self.path)
+        shared_cache.set('key', 'value')
+        time.sleep(.02)
+        self.assertIsNone(shared_cache.get('key'))
+        self.assertEqual(len(shared_cache), 0)
+
+    def test_add_update_and_invalidate(self):
+        """Test adding, updating and removing entries."""
+        shared_cache = cache.SharedCache('accounts', path=self.path)
+        self.assertTrue(shared_cache.add('key', 1))
+        self.assertFalse(shared_cache.add('key', 2))
+        self.assertEqual(shared_cache.update('key', lambda value: value + 1), 2)
+        shared_cache.invalidate('key', 'missing')
+        self.assertIsNone(shared_cache.get('key'))
+        self.assertIsNone(shared_cache.update('key', lambda value: value))
+        shared_cache.set('key', 1)
+        shared_cache.clear()
+        self.assertEqual(len(shared_cache), 0)
+
+    def test_eviction(self):
+        """Test that the entries closest to expiry are evicted when full."""
+        shared_cache = cache.SharedCache('accounts', max_size=2, path=self.path)
+        shared_cache.writes = cache.SHARED_EVICTION_INTERVAL - 3
+        for ttl, key in enumerate(('first', 'second', 'third')):
+            shared_cache.set(key, ttl, ttl=ttl + 10)
+        self.assertIsNone(shared_cache.get('first'))
+        self.assertEqual(len(shared_cache), 2)
+
+    def test_processes(self):
+        """Test that concurrent updates from several processes are atomic."""
+        processes = [
+            multiprocessing.Process(target=increment_shared, args=(self.path, 50)) for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.assertEqual(cache.SharedCache('counters', path=self.path).get('counter'), 200)
+
+    def test_gen_cache(self):
+        """Test choosing the backend configured when a cache is first used, not when it is declared."""
+        with unittest.mock.patch.dict(os.environ, PAKET_BRIDGE_CACHE_BACKEND='local'):
+            lazy_cache = cache.gen_cache('accounts')
+        with unittest.mock.patch.dict(os.environ, PAKET_BRIDGE_CACHE_BACKEND='shared'), \
+                unittest.mock.patch.object(cache, 'SharedCache') as shared_cache:
+            lazy_cache.set('key', 'value')
+        self.assertIs(lazy_cache.get_cache(), shared_cache.return_value)
+        shared_cache.return_value.set.assert_called_once_with('key', 'value')
+        with unittest.mock.patch.dict(os.environ, PAKET_BRIDGE_CACHE_BACKEND='local'):
+            self.assertIsInstance(cache.gen_cache('accounts').get_cache(), cache.TTLCache)
+
+    def test_namespace(self):
+        """Test that shared caches are named in the namespace of the bridge."""
+        with unittest.mock.patch.dict(os.environ, PAKET_BRIDGE_CACHE_BACKEND='shared'), \
+                unittest.mock.patch.object(cache, 'SharedCache') as shared_cache:
+            cache.gen_cache('accounts', 10, 1).get_cache()
+        shared_cache.assert_called_once_with("{}:accounts".format(cache.get_namespace()), 10, 1)
+        namespace = cache.get_namespace()
+        with unittest.mock.patch.object(paket_stellar, 'NETWORK', 'PUBLIC', create=True):
+            self.assertNotEqual(cache.get_namespace(), namespace)
+        with unittest.mock.patch.object(paket_stellar, 'ISSUER', 'another issuer'):
+            self.assertNotEqual(cache.get_namespace(), namespace)
+        with unittest.mock.patch.object(horizon, 'SERVERS', ['http://another-horizon']):
+            self.assertNotEqual(cache.get_namespace(), namespace)
+        with unittest.mock.patch.object(cache, 'NAMESPACE', 'bridge'):
+            self.assertEqual(cache.get_namespace(), 'bridge')
+
+
+class SingleFlightTest(unittest.TestCase):
+    """Test for SingleFlight."""
+
+    def setUp(self):
+        self.single_flight = cache.SingleFlight()
+        self.calls = 0
+        self.release = threading.Event()
+
+    def slow_call(self, value):
+        """Count calls and block until released."""
+        self.calls += 1
+        self.release.wait(5)
+        if value is None:
+            raise KeyError('no value')
+        return value
+
+    def call_concurrently(self, value, callers=5):
+        """Call slow_call from several threads, and return their results or errors."""
+        results = []
+
+        def caller():
+            try:
+                results.append(self.single_flight.do('key', self.slow_call, value))
+            except KeyError as exception:
+                results.append(exception)
+        threads = [threading.Thread(target=caller) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        while len(self.single_flight.calls) == 0:
+            time.sleep(.001)
+        time.sleep(.05)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_coalesce(self):
+        """Test that concurrent calls share a single call."""
+        results = self.call_concurrently('value')
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(sorted(results), [('value', False)] + [('value', True)] * 4)
+        self.assertEqual(self.single_flight.calls, {})
+        self.assertEqual(self.single_flight.do('key', str, 'again'), ('again', False))
+
+    def test_error(self):
+        """Test that an error is raised in all the coalesced callers."""
+        results = self.call_concurrently(None)
+        self.assertEqual(self.calls, 1)
+        self.assertTrue(all(isinstance(result, KeyError) for result in results))
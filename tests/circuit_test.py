@@ -0,0 +1,52 @@
+"""Tests for circuit module"""
+import time
+import unittest
+
+import circuit
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    """Test for CircuitBreaker."""
+
+    def setUp(self):
+        self.breaker = circuit.CircuitBreaker('test', failure_threshold=2, reset_timeout=60)
+
+    def fail(self):
+        """Make a failing call through the breaker."""
+        with self.assertRaises(IOError):
+            with self.breaker.guard(failures=(IOError,)):
+                raise IOError('upstream down')
+
+    def test_open(self):
+        """Test that the circuit opens after consecutive failures and rejects calls."""
+        self.fail()
+        self.breaker.before_call()
+        self.fail()
+        self.assertEqual(self.breaker.state, circuit.OPEN)
+        with self.assertRaises(circuit.CircuitOpen):
+            self.breaker.before_call()
+
+    def test_success_resets(self):
+        """Test that a success resets the failure count, and other errors count as successes."""
+        self.fail()
+        with self.assertRaises(KeyError):
+            with self.breaker.guard(failures=(IOError,)):
+                raise KeyError('missing account')
+        self.fail()
+        self.assertEqual(self.breaker.state, circuit.CLOSED)
+
+    def test_half_open(self):
+        """Test that a single probe is let through after the reset timeout."""
+        self.fail()
+        self.fail()
+        self.breaker.opened_at = time.monotonic() - 60
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, circuit.HALF_OPEN)
+        with self.assertRaises(circuit.CircuitOpen):
+            self.breaker.before_call()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, circuit.OPEN)
+        self.breaker.opened_at = time.monotonic() - 60
+        with self.breaker.guard():
+            pass
+        self.assertEqual(self.breaker.state, circuit.CLOSED)
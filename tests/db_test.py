@@ -0,0 +1,90 @@
+"""Tests for db module"""
+import os
+import tempfile
+import threading
+import unittest
+
+import db
+
+
+class PackagesIndexTest(unittest.TestCase):
+    """Test for the local packages index."""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.original_path, db.DB_PATH = db.DB_PATH, self.path
+        db.CONNECTIONS = threading.local()
+        db.add_escrow('escrow', 'launcher', 'courier', 'recipient', 10, 20, 200, {'merge_transaction': 'xdr'})
+        db.add_escrow('other_escrow', 'launcher', 'other_courier', 'recipient', 10, 20, 100, {})
+        db.add_relay('relay', 'courier', 'relayee', 15, 15, 150, {})
+
+    def tearDown(self):
+        db.CONNECTIONS.connection.close()
+        db.DB_PATH, db.CONNECTIONS = self.original_path, threading.local()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def test_get_packages(self):
+        """Test getting the packages of an account, by role and ordered by deadline."""
+        packages = db.get_packages('launcher')
+        self.assertEqual([escrow['escrow_pubkey'] for escrow in packages['escrows']], ['other_escrow', 'escrow'])
+        self.assertEqual(packages['relays'], [])
+        self.assertEqual(packages['escrows'][1]['transactions'], {'merge_transaction': 'xdr'})
+        packages = db.get_packages('courier')
+        self.assertEqual(len(packages['escrows']), 1)
+        self.assertEqual(len(packages['relays']), 1)
+        packages = db.get_packages('courier', role='relayer')
+        self.assertEqual((len(packages['escrows']), len(packages['relays'])), (0, 1))
+
+    def test_lazy_init(self):
+        """Test that the tables are created when the database is first used, not when the bridge is imported."""
+        self.assertIn(self.path, db.INITIALIZED_PATHS)
+        self.assertEqual(db.get_packages('nobody'), {'escrows': [], 'relays': [], 'next_cursor': None})
+
+    def test_pages(self):
+        """Test getting the packages of an account a page at a time, across escrows and relays."""
+        db.add_relay('late_relay', 'launcher', 'relayee', 15, 15, 200, {})
+        db.add_escrow('late_escrow', 'launcher', 'courier', 'recipient', 10, 20, 300, {})
+        pages, cursor = [], None
+        while True:
+            packages = db.get_packages('launcher', limit=2, cursor=cursor)
+            pages.append([package.get('escrow_pubkey') or package.get('relay_pubkey')
+                          for package in packages['escrows'] + packages['relays']])
+            cursor = packages['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(pages, [['other_escrow', 'escrow'], ['late_escrow', 'late_relay']])
+        with self.assertRaises(db.InvalidCursor):
+            db.get_packages('launcher', cursor='not a cursor')
+
+    def test_ingest_operation(self):
+        """Test following the life cycle of an escrow from its operations."""
+        db.ingest_operation({'source_account': 'escrow', 'type': 'set_options'})
+        self.assertEqual(db.get_package('escrow', 'escrow')['status'], db.LAUNCHED)
+        db.ingest_operation({'source_account': 'escrow', 'type': 'payment', 'to': 'courier'})
+        self.assertEqual(db.get_package('escrow', 'escrow')['status'], db.DELIVERED)
+        self.assertEqual(len(db.get_packages('launcher', active_only=True)['escrows']), 1)
+        db.ingest_operation({'source_account': 'escrow', 'type': 'account_merge'})
+        self.assertEqual(db.get_package('escrow', 'escrow')['status'], db.CLOSED)
+        self.assertFalse(db.ingest_operation({'source_account': 'unknown', 'type': 'account_merge'}))
+        self.assertFalse(db.ingest_operation({'source_account': 'relay', 'type': 'manage_offer'}))
+        self.assertEqual(db.get_package('relay', 'relay')['status'], db.PREPARED)
+
+    def test_ingest_relay_operations(self):
+        """Test telling a relay from a refund of a relay by the destination of its payments."""
+        db.ingest_operation({'source_account': 'relay', 'type': 'payment', 'to': 'courier'})
+        db.ingest_operation({'source_account': 'relay', 'type': 'payment', 'to': 'relayee'})
+        self.assertEqual(db.get_package('relay', 'relay')['status'], db.RELAYED)
+        db.ingest_operation({'source_account': 'relay', 'type': 'payment', 'to': 'courier'})
+        self.assertEqual(db.get_package('relay', 'relay')['status'], db.RELAYED)
+        db.add_relay('refunded_relay', 'courier', 'relayee', 15, 15, 150, {})
+        db.ingest_operation({'source_account': 'refunded_relay', 'type': 'payment', 'to': 'courier'})
+        self.assertEqual(db.get_package('relay', 'refunded_relay')['status'], db.REFUNDED)
+
+    def test_cursor(self):
+        """Test recording the ingestion cursor."""
+        self.assertEqual(db.get_cursor('operations'), 'now')
+        db.set_cursor('operations', '123-1')
+        self.assertEqual(db.get_cursor('operations'), '123-1')
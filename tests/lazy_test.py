@@ -0,0 +1,38 @@
+"""Tests for lazy module"""
+import unittest
+
+import lazy
+
+
+def gen_app(name):
+    """Create a WSGI app answering with its name."""
+    def app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [name.encode()]
+    return app
+
+
+class LazyDispatcherTest(unittest.TestCase):
+    """Test for LazyDispatcher."""
+
+    def setUp(self):
+        self.builds = 0
+        self.dispatcher = lazy.LazyDispatcher(gen_app('main'), self.factory, ('/',), ('/apispec', '/v3/debug/'))
+
+    def factory(self):
+        """Count the builds of the lazy app."""
+        self.builds += 1
+        return gen_app('lazy')
+
+    def get(self, path):
+        """Get the body the dispatcher answers a path with."""
+        return b''.join(self.dispatcher({'PATH_INFO': path}, lambda status, headers: None)).decode()
+
+    def test_dispatch(self):
+        """Test that the lazy app is only built when one of its paths is first requested."""
+        self.assertEqual(self.get('/v3/bul_account'), 'main')
+        self.assertEqual(self.builds, 0)
+        self.assertEqual(self.get('/'), 'lazy')
+        self.assertEqual(self.get('/apispec.json'), 'lazy')
+        self.assertEqual(self.get('/v3/debug/log'), 'lazy')
+        self.assertEqual(self.builds, 1)
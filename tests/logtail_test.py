@@ -0,0 +1,49 @@
+"""Tests for logtail module"""
+import os
+import tempfile
+import unittest
+
+import logtail
+
+
+class TailTest(unittest.TestCase):
+    """Test for tail."""
+
+    def setUp(self):
+        self.lines = [
+            "2018-06-01 {} pkt.bridge{}: message {}\n".format(
+                'INFO' if index % 3 else 'DEBUG', '.horizon' if index % 2 else '', index)
+            for index in range(2000)]
+        logfile, self.path = tempfile.mkstemp()
+        with os.fdopen(logfile, 'w') as logfile:
+            logfile.writelines(self.lines)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_tail(self):
+        """Test getting the last lines, with and without a memory map."""
+        for use_mmap in (False, True):
+            with self.subTest(use_mmap=use_mmap):
+                self.assertEqual(logtail.tail(self.path, 10, use_mmap=use_mmap), self.lines[:-11:-1])
+
+    def test_small_blocks(self):
+        """Test that lines spanning blocks are read whole."""
+        with open(self.path, 'rb') as logfile:
+            lines = list(logtail.reverse_lines(logfile, block_size=7))
+        self.assertEqual([line.decode() + '\n' for line in lines[1:]], self.lines[::-1])
+
+    def test_filter(self):
+        """Test filtering lines by logger and level."""
+        expected = [line for line in reversed(self.lines) if 'horizon' in line and 'INFO' in line][:5]
+        self.assertEqual(logtail.tail(self.path, 5, 'pkt.bridge.horizon', 'info'), expected)
+        self.assertEqual(logtail.tail(self.path, 5, 'pkt.identity'), [])
+
+    def test_logger_children(self):
+        """Test that a logger filter matches the logger and its children, by name rather than by text."""
+        lines = [
+            "2018-06-01 INFO pkt.bridge: message\n", "2018-06-01 INFO pkt.bridge.horizon:12: message\n",
+            "2018-06-01 INFO pkt.bridge2: message\n", "2018-06-01 INFO pkt.identity: pkt.bridge message\n",
+            "Traceback (most recent call last): pkt.bridge\n"]
+        self.assertEqual([line for line in lines if logtail.line_matches(line, 'pkt.bridge')], lines[:2])
+        self.assertEqual([line for line in lines if logtail.line_matches(line, level='info')], lines[:4])
@@ -0,0 +1,73 @@
+"""Tests for metrics module"""
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+import metrics
+
+
+class MetricsTest(unittest.TestCase):
+    """Test for metrics exposition."""
+
+    def setUp(self):
+        self.registry = list(metrics.REGISTRY)
+
+    def tearDown(self):
+        metrics.REGISTRY[:] = self.registry
+
+    def test_counter(self):
+        """Test counting with labels."""
+        counter = metrics.Counter('test_total', 'Test counter.')
+        counter.inc(route='bul_account')
+        counter.inc(2, route='bul_account')
+        self.assertIn('test_total{route="bul_account"} 3.0', metrics.exposition())
+
+    def test_histogram(self):
+        """Test observing values into buckets."""
+        histogram = metrics.Histogram('test_seconds', 'Test histogram.', buckets=(.1, 1, float('inf')))
+        histogram.observe(.05, route='batch')
+        histogram.observe(.5, route='batch')
+        exposition = metrics.exposition()
+        self.assertIn('# TYPE test_seconds histogram', exposition)
+        self.assertIn('test_seconds_bucket{route="batch",le="0.1"} 1', exposition)
+        self.assertIn('test_seconds_bucket{route="batch",le="1"} 2', exposition)
+        self.assertIn('test_seconds_bucket{route="batch",le="+Inf"} 2', exposition)
+        self.assertIn('test_seconds_count{route="batch"} 2', exposition)
+
+    def test_shared_snapshots(self):
+        """Test exposing the sum of the metrics of all the processes sharing snapshots."""
+        counter = metrics.Counter('test_total', 'Test counter.')
+        histogram = metrics.Histogram('test_seconds', 'Test histogram.', buckets=(.1, float('inf')))
+        with tempfile.TemporaryDirectory() as directory, \
+                unittest.mock.patch.dict(os.environ, PAKET_BRIDGE_METRICS_DIR=directory), \
+                unittest.mock.patch.dict(metrics.SNAPSHOT, pid=None, path=None):
+            metrics.write_snapshot(os.path.join(directory, 'exited-worker.json'), {
+                'test_total': {(('route', 'bul_account'),): 2},
+                'test_seconds': {(('route', 'batch'),): ([1, 1], .05)}})
+            counter.inc(route='bul_account')
+            histogram.observe(.5, route='batch')
+            exposition = metrics.exposition()
+            self.assertEqual(len(os.listdir(directory)), 2)
+        self.assertIn('test_total{route="bul_account"} 3.0', exposition)
+        self.assertIn('test_seconds_bucket{route="batch",le="0.1"} 1', exposition)
+        self.assertIn('test_seconds_count{route="batch"} 2', exposition)
+
+    def test_exited_snapshots(self):
+        """Test that the snapshots of exited processes are folded into a single one."""
+        counter = metrics.Counter('test_total', 'Test counter.')
+        with tempfile.TemporaryDirectory() as directory, \
+                unittest.mock.patch.dict(os.environ, PAKET_BRIDGE_METRICS_DIR=directory), \
+                unittest.mock.patch.dict(metrics.SNAPSHOT, pid=None, path=None):
+            for pid in (2 ** 22 + 1, 2 ** 22 + 2):
+                metrics.write_snapshot(os.path.join(directory, "{}-0.json".format(pid)), {
+                    'test_total': {(('route', 'bul_account'),): 2}})
+            counter.inc(route='bul_account')
+            self.assertIn('test_total{route="bul_account"} 5.0', metrics.exposition())
+            self.assertEqual(sorted(os.listdir(directory)), sorted([
+                metrics.EXITED_SNAPSHOT_NAME, os.path.basename(metrics.SNAPSHOT['path'])]))
+            metrics.flush_at_exit()
+            self.assertEqual(os.listdir(directory), [metrics.EXITED_SNAPSHOT_NAME])
+            self.assertEqual(
+                metrics.read_snapshot(os.path.join(directory, metrics.EXITED_SNAPSHOT_NAME))['test_total'],
+                {(('route', 'bul_account'),): 5})
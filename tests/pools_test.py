@@ -0,0 +1,27 @@
+"""Tests for pools module"""
+import os
+import unittest
+
+import pools
+
+
+class ThreadPoolTest(unittest.TestCase):
+    """Test for ThreadPool."""
+
+    def test_map(self):
+        """Test running work on the pool."""
+        self.assertEqual(list(pools.ThreadPool(2, 'test').map(abs, [-1, 2, -3])), [1, 2, 3])
+
+    def test_fork(self):
+        """Test that work submitted in a process forked after the pool was used still runs."""
+        pool = pools.ThreadPool(2, 'test')
+        self.assertEqual(pool.submit(abs, -1).result(), 1)
+        pid = os.fork()
+        if not pid:
+            # The child must exit whatever happens, so it does not go on running the tests.
+            # pylint: disable=protected-access,broad-except
+            try:
+                os._exit(0 if pool.submit(abs, -2).result(timeout=5) == 2 else 1)
+            except Exception:
+                os._exit(1)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
@@ -0,0 +1,99 @@
+"""Tests for preflight module"""
+import time
+import unittest
+import unittest.mock
+
+import paket_stellar
+
+import horizon
+import preflight
+import transactions
+
+
+class PreflightTest(unittest.TestCase):
+    """Test for pre-flight validation of signed envelopes."""
+
+    def setUp(self):
+        keypair = paket_stellar.get_keypair()
+        self.pubkey, self.seed = keypair.address().decode(), keypair.seed().decode()
+        self.sequence = 4294967296
+
+    def tearDown(self):
+        horizon.ACCOUNTS.invalidate(self.pubkey)
+
+    def envelope(self, seed=None, network='TESTNET', time_bounds=None):
+        """Get a BUL transfer envelope from the test account, optionally signed and time bounded."""
+        builder = paket_stellar.stellar_base.builder.Builder(
+            horizon_uri=paket_stellar.HORIZON_SERVER, secret=seed, address=None if seed else self.pubkey,
+            sequence=self.sequence, network=network)
+        builder.import_from_xdr(transactions.prepare_send_buls(self.pubkey, self.sequence, self.pubkey, 1))
+        if time_bounds:
+            builder.add_time_bounds(time_bounds)
+        if seed:
+            builder.sign()
+        return builder.gen_te().xdr().decode()
+
+    def cache_account(self, sequence):
+        """Cache the state of the test account."""
+        horizon.ACCOUNTS.set(self.pubkey, {
+            'sequence': str(sequence),
+            'signers': [{'key': self.pubkey, 'weight': 1, 'type': preflight.ED25519_SIGNER}],
+            'thresholds': {'low_threshold': 0, 'med_threshold': 0, 'high_threshold': 0}})
+
+    def test_valid(self):
+        """Test that a well signed envelope passes."""
+        self.cache_account(self.sequence)
+        envelope = self.envelope(self.seed)
+        self.assertEqual(transactions.transaction_hash(preflight.check(envelope)), transactions.transaction_hash(
+            transactions.decode(envelope)))
+
+    def test_malformed(self):
+        """Test rejecting an envelope that can not be decoded."""
+        with self.assertRaises(preflight.MalformedEnvelope):
+            preflight.check('not an envelope')
+
+    def test_time_bounds(self):
+        """Test rejecting expired and premature envelopes."""
+        now = int(time.time())
+        with self.assertRaises(preflight.TransactionExpired):
+            preflight.check(self.envelope(self.seed, time_bounds={'minTime': 0, 'maxTime': now - 60}))
+        with self.assertRaises(preflight.TransactionTooEarly):
+            preflight.check(self.envelope(self.seed, time_bounds={'minTime': now + 60, 'maxTime': 0}))
+
+    def test_wrong_network(self):
+        """Test rejecting an envelope signed for another network."""
+        with self.assertRaises(preflight.WrongNetwork):
+            preflight.check(self.envelope(self.seed, network='PUBLIC'))
+
+    def test_configured_network(self):
+        """Test that the network envelopes must be signed for is the one paket_stellar is configured for."""
+        self.cache_account(self.sequence)
+        with unittest.mock.patch.object(paket_stellar, 'NETWORK', 'PUBLIC', create=True):
+            preflight.check(self.envelope(self.seed, network='PUBLIC'))
+            with self.assertRaises(preflight.WrongNetwork):
+                preflight.check(self.envelope(self.seed))
+
+    def test_stale_sequence(self):
+        """Test rejecting an envelope on a sequence number the cached account already used."""
+        self.cache_account(self.sequence + 1)
+        with self.assertRaises(preflight.StaleSequence):
+            preflight.check(self.envelope(self.seed))
+
+    def test_missing_signatures(self):
+        """Test rejecting an envelope the account's signers did not sign, once the current signers are loaded."""
+        self.cache_account(self.sequence)
+        account = horizon.ACCOUNTS.get(self.pubkey)
+        with unittest.mock.patch.object(horizon, 'load_account', return_value=account) as load_account:
+            with self.assertRaises(preflight.MissingSignatures):
+                preflight.check(self.envelope())
+        load_account.assert_called_once_with(self.pubkey)
+
+    def test_changed_signers(self):
+        """Test that an envelope signed by a signer added after the account was cached passes."""
+        self.cache_account(self.sequence)
+        account = horizon.ACCOUNTS.get(self.pubkey)
+        horizon.ACCOUNTS.set(self.pubkey, dict(account, signers=[
+            {'key': paket_stellar.get_keypair().address().decode(), 'weight': 1, 'type': preflight.ED25519_SIGNER}]))
+        with unittest.mock.patch.object(horizon, 'load_account', return_value=account):
+            preflight.check(self.envelope(self.seed))
+        self.assertIsNone(horizon.ACCOUNTS.get(self.pubkey))
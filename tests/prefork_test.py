@@ -0,0 +1,86 @@
+"""Tests for prefork module"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+import cache
+
+PACKAGE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Runs the launcher module the way `python -m bridge.prefork` does, importing the bridge package first, without
+# starting the server, and prints the backend of a cache the bridge declared while being imported.
+ENTRY_POINT_SCRIPT = '''
+import runpy
+runpy.run_module('bridge.prefork')
+import horizon
+print(type(horizon.ACCOUNTS.get_cache()).__name__)
+'''
+# Shares the rate limits the way the launcher does before starting the server, and prints the kind of buckets.
+RATE_LIMITS_SCRIPT = '''
+import bridge.prefork as prefork
+import ratelimit
+prefork.share_rate_limits()
+print(type(ratelimit.BUCKETS).__name__)
+'''
+# Starts the supervisor with background workers that exit at once, after leaving a file named after their pid
+# in the directory given as argument, so every restart leaves a file.
+SUPERVISOR_SCRIPT = '''
+import os
+import sys
+import time
+import bridge.prefork as prefork
+
+def run_background_workers(supervisor_pid):
+    open(os.path.join(sys.argv[1], str(os.getpid())), 'w').close()
+
+prefork.run_background_workers = run_background_workers
+prefork.BACKGROUND_RESTART_DELAY = 0.1
+prefork.SUPERVISION_INTERVAL = 0.05
+prefork.start_background_supervisor()
+time.sleep(1)
+'''
+
+
+def gen_environment(directory):
+    """Create the environment of a launcher run from directory, with the bridge package linked in it."""
+    os.symlink(PACKAGE_PATH, os.path.join(directory, 'bridge'))
+    return dict(
+        os.environ, PAKET_BRIDGE_SHARED_CACHE_PATH=os.path.join(directory, 'cache.db'),
+        PYTHONPATH=os.pathsep.join([directory, PACKAGE_PATH, os.environ.get('PYTHONPATH', '')]))
+
+
+class EntryPointTest(unittest.TestCase):
+    """Test for the pre-forking launcher."""
+
+    def test_shared_backend(self):
+        """Test that the launcher's default backend applies to the caches declared before it ran."""
+        with tempfile.TemporaryDirectory() as directory:
+            environment = gen_environment(directory)
+            environment.pop('PAKET_BRIDGE_CACHE_BACKEND', None)
+            output = subprocess.check_output(
+                [sys.executable, '-c', ENTRY_POINT_SCRIPT], cwd=directory, env=environment)
+        self.assertEqual(output.decode().split()[-1], cache.SharedCache.__name__)
+
+    def test_shared_rate_limits(self):
+        """Test that the launcher shares the rate limits of its workers by default, unless told not to."""
+        with tempfile.TemporaryDirectory() as directory:
+            environment = gen_environment(directory)
+            environment.pop('PAKET_BRIDGE_RATE_LIMIT_SHARED_SLOTS', None)
+            output = subprocess.check_output([sys.executable, '-c', RATE_LIMITS_SCRIPT], cwd=directory, env=environment)
+            self.assertEqual(output.decode().split()[-1], 'SharedTokenBuckets')
+            environment['PAKET_BRIDGE_RATE_LIMIT_SHARED_SLOTS'] = '0'
+            output = subprocess.check_output([sys.executable, '-c', RATE_LIMITS_SCRIPT], cwd=directory, env=environment)
+            self.assertEqual(output.decode().split()[-1], 'TokenBuckets')
+
+    def test_supervised_background_workers(self):
+        """Test that the background workers are restarted when they exit, and stopped with the server."""
+        with tempfile.TemporaryDirectory() as directory, tempfile.TemporaryDirectory() as runs_directory:
+            subprocess.check_call(
+                [sys.executable, '-c', SUPERVISOR_SCRIPT, runs_directory], cwd=directory,
+                env=gen_environment(directory))
+            runs = len(os.listdir(runs_directory))
+            self.assertGreater(runs, 1)
+            time.sleep(.5)
+            self.assertEqual(len(os.listdir(runs_directory)), runs)
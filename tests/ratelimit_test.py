@@ -0,0 +1,65 @@
+"""Tests for ratelimit module"""
+import unittest
+import unittest.mock
+
+import ratelimit
+
+
+class TokenBucketsTest(unittest.TestCase):
+    """Test for the local and shared token buckets."""
+
+    def check_buckets(self, buckets):
+        """Test that a burst is allowed, then calls are limited to the rate, per key."""
+        for _ in range(3):
+            self.assertEqual(buckets.take('key', 1, 3), 0)
+        retry_after = buckets.take('key', 1, 3)
+        self.assertGreater(retry_after, .9)
+        self.assertLessEqual(retry_after, 1)
+        self.assertEqual(buckets.take('other_key', 1, 3), 0)
+
+    def test_local(self):
+        """Test buckets kept in the process."""
+        self.check_buckets(ratelimit.TokenBuckets())
+
+    def test_shared(self):
+        """Test buckets kept in shared memory."""
+        self.check_buckets(ratelimit.SharedTokenBuckets(1024))
+
+    def test_refill(self):
+        """Test refilling a bucket, up to its burst size."""
+        self.assertEqual(ratelimit.refill_and_take(0, .5, 2, 3), (0, 0))
+        self.assertEqual(ratelimit.refill_and_take(0, 10, 2, 3), (2, 0))
+        self.assertEqual(ratelimit.refill_and_take(0, .25, 2, 3), (.5, .25))
+
+
+class CheckLimitsTest(unittest.TestCase):
+    """Test for the budgets of the callers of a route."""
+
+    def setUp(self):
+        ratelimit.LIMITS['route'] = (.01, 1)
+
+    def tearDown(self):
+        del ratelimit.LIMITS['route']
+
+    def test_callers(self):
+        """Test that each kind of caller and each route has its own budget."""
+        self.assertEqual(ratelimit.check_limits('route', ip='1.2.3.4'), 0)
+        self.assertGreater(ratelimit.check_limits('route', ip='1.2.3.4'), 0)
+        self.assertEqual(ratelimit.check_limits('route', pubkey='1.2.3.4'), 0)
+        self.assertEqual(ratelimit.check_limits('unlimited_route', ip='1.2.3.4'), 0)
+
+    def test_client_ip(self):
+        """Test that X-Forwarded-For is only trusted as far as there are trusted proxies."""
+        self.assertEqual(ratelimit.client_ip('10.0.0.1', '1.2.3.4'), '10.0.0.1')
+        with unittest.mock.patch('ratelimit.TRUSTED_PROXIES', 1):
+            self.assertEqual(ratelimit.client_ip('10.0.0.1', '6.6.6.6, 1.2.3.4'), '1.2.3.4')
+            self.assertEqual(ratelimit.client_ip('10.0.0.1'), '10.0.0.1')
+        with unittest.mock.patch('ratelimit.TRUSTED_PROXIES', 2):
+            self.assertEqual(ratelimit.client_ip('10.0.0.1', '6.6.6.6, 1.2.3.4, 10.0.0.2'), '1.2.3.4')
+            self.assertEqual(ratelimit.client_ip('10.0.0.1', '1.2.3.4'), '10.0.0.1')
+
+    def test_default_limits(self):
+        """Test that the routes limited by pubkey have budgets by default."""
+        limits = dict(limit.split(':', 1) for limit in ratelimit.DEFAULT_LIMITS.split(','))
+        for route in ('prepare_escrow', 'prepare_relay', 'batch', 'bul_accounts'):
+            self.assertIn(route, limits)
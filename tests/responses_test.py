@@ -0,0 +1,52 @@
+"""Tests for responses module"""
+import gzip
+import json
+import unittest
+
+import flask
+
+import responses
+
+
+class ResponsesTest(unittest.TestCase):
+    """Test for JSON encoding and compression of responses."""
+
+    def setUp(self):
+        blueprint = flask.Blueprint('test', __name__)
+        responses.optimize_blueprint(blueprint)
+
+        @blueprint.route('/large')
+        def large():
+            """A response above the compression threshold."""
+            return flask.jsonify({'escrow_details': 'A' * responses.COMPRESSION_MIN_SIZE})
+
+        @blueprint.route('/small')
+        def small():
+            """A response below the compression threshold."""
+            return flask.jsonify({'status': 200})
+
+        app = flask.Flask(__name__)
+        app.register_blueprint(blueprint)
+        self.client = app.test_client()
+
+    def test_gzip(self):
+        """Test compressing a large response for a client that accepts gzip."""
+        response = self.client.get('/large', headers={'Accept-Encoding': 'gzip, br;q=0'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(
+            json.loads(gzip.decompress(response.get_data()).decode()),
+            {'escrow_details': 'A' * responses.COMPRESSION_MIN_SIZE})
+
+    def test_uncompressed(self):
+        """Test leaving small responses and responses to clients that accept no compression as they are."""
+        self.assertNotIn('Content-Encoding', self.client.get('/small', headers={'Accept-Encoding': 'gzip'}).headers)
+        self.assertNotIn('Content-Encoding', self.client.get('/large').headers)
+
+    def test_compact_json(self):
+        """Test that JSON responses are compact."""
+        self.assertEqual(self.client.get('/small').get_data().strip(), b'{"status":200}')
+
+    def test_accepted_encodings(self):
+        """Test parsing Accept-Encoding headers."""
+        self.assertEqual(responses.accepted_encodings('gzip;q=0.5, br;q=0, identity'), {'gzip', 'identity'})
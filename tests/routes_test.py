@@ -2,16 +2,24 @@
 import json
 import time
 import unittest
+import unittest.mock
 
 import paket_stellar
 import util.logger
 import webserver.validation
 
+import horizon
+import ratelimit
 import routes
+import scheduler
+import submitter
+import transactions
 
 LOGGER = util.logger.logging.getLogger('pkt.bridge.test')
 APP = webserver.setup(routes.BLUEPRINT)
 APP.testing = True
+# The tests make many calls from a single address, only RateLimitTest sets limits.
+ratelimit.LIMITS.clear()
 
 
 class BridgeBaseTest(unittest.TestCase):
@@ -194,6 +202,109 @@ class SubmitTransactionTest(BridgeBaseTest):
             seed=self.funder_seed, transaction=signed_send_buls)
 
 
+class ResubmitTest(BridgeBaseTest):
+    """Test for resubmitting a transaction whose submission updated its source account."""
+
+    def setUp(self):
+        self.pubkey = paket_stellar.get_keypair().address().decode()
+        # Left unsigned, since the source account is unknown until the first submission, so preflight passes.
+        self.transaction = transactions.prepare_send_buls(self.pubkey, 4294967296, self.pubkey, 1)
+        self.decoded = transactions.decode(self.transaction)
+        self.transaction_hash = transactions.transaction_hash(self.decoded)
+        self.submissions = 0
+
+    def tearDown(self):
+        submitter.STATUSES.invalidate(self.transaction_hash)
+        submitter.REJECTIONS.invalidate(self.transaction_hash)
+        horizon.ACCOUNTS.invalidate(self.pubkey)
+
+    def submit_transaction(self, envelope, decoded=None):
+        """Fake Horizon submission, after which the source account is cached at the transaction's sequence."""
+        self.submissions += 1
+        horizon.ACCOUNTS.set(self.pubkey, {
+            'sequence': str(self.decoded.tx.sequence), 'thresholds': {'low_threshold': 0},
+            'signers': [{'key': self.pubkey, 'weight': 1, 'type': 'ed25519_public_key'}]})
+        return {
+            'hash': self.transaction_hash, 'ledger': 1, 'envelope_xdr': envelope,
+            'result_xdr': 'result', 'result_meta_xdr': 'meta'}
+
+    def test_resubmit(self):
+        """Test that resubmitting returns the original response, rather than failing preflight on the new sequence."""
+        with unittest.mock.patch.object(horizon, 'submit_transaction', self.submit_transaction):
+            response = self.call(
+                'submit_transaction', 200, 'could not submit transaction', transaction=self.transaction)['response']
+            self.assertEqual(response['result_meta_xdr'], 'meta')
+            self.assertEqual(self.call(
+                'submit_transaction', 200, 'could not resubmit transaction',
+                transaction=self.transaction)['response'], {
+                    'hash': self.transaction_hash, 'ledger': 1, 'result_xdr': 'result'})
+            self.assertEqual(self.call(
+                'submit_transaction', 202, 'could not queue submitted transaction',
+                transaction=self.transaction, asynchronous=True)['transaction_hash'], self.transaction_hash)
+        self.assertEqual(self.submissions, 1)
+
+
+class AsynchronousSubmitTest(BridgeBaseTest):
+    """Test for asynchronous submission and transaction_status endpoint."""
+
+    def test_submit_asynchronous(self):
+        """Test queueing a signed transaction and polling its status."""
+        new_pubkey = paket_stellar.get_keypair().address().decode()
+        unsigned_account = self.call(
+            'prepare_account', 200, 'could not get create account transaction',
+            from_pubkey=self.funder_pubkey, new_pubkey=new_pubkey)['transaction']
+        signed_account = self.sign_transaction(unsigned_account, self.funder_seed)
+        transaction_hash = self.call(
+            'submit_transaction', 202, 'could not queue transaction',
+            transaction=signed_account, asynchronous=True)['transaction_hash']
+        for _ in range(30):
+            status = self.call(
+                'transaction_status', 200, 'could not get transaction status', transaction_hash=transaction_hash)
+            if status['transaction_status'] != 'pending':
+                break
+            time.sleep(1)
+        self.assertEqual(status['transaction_status'], 'succeeded', status.get('error'))
+
+    def test_unknown_transaction_status(self):
+        """Test getting the status of a transaction that was never queued."""
+        self.call('transaction_status', 404, 'unknown transaction has status', transaction_hash='00' * 32)
+
+
+class ScheduleTransactionsTest(BridgeBaseTest):
+    """Test for schedule_transactions route."""
+
+    def setUp(self):
+        self.pubkey = paket_stellar.get_keypair().address().decode()
+        # Unsigned and without time bounds, so due as soon as they are scheduled, and failing preflight.
+        self.envelopes = [
+            transactions.prepare_send_buls(self.pubkey, 4294967296 + offset, self.pubkey, 1) for offset in (1, 2)]
+        horizon.ACCOUNTS.set(self.pubkey, {
+            'sequence': '4294967296', 'thresholds': {'low_threshold': 0},
+            'signers': [{'key': self.pubkey, 'weight': 1, 'type': 'ed25519_public_key'}]})
+
+    def tearDown(self):
+        horizon.ACCOUNTS.invalidate(self.pubkey)
+        ratelimit.LIMITS.clear()
+
+    def test_due_transactions_checked(self):
+        """Test that transactions due at once are checked before they are scheduled."""
+        with unittest.mock.patch.object(scheduler, 'ENABLED', True), \
+                unittest.mock.patch.object(scheduler.SCHEDULER, 'schedule') as schedule:
+            response = self.call('schedule_transactions', envelopes=json.dumps(self.envelopes))
+        self.assertEqual(response['code'], 214)
+        schedule.assert_not_called()
+
+    def test_due_transactions_limited(self):
+        """Test that transactions due at once count against the rate limit of submissions."""
+        ratelimit.LIMITS['submit_transaction'] = (.01, 1)
+        with unittest.mock.patch.object(scheduler, 'ENABLED', True), \
+                unittest.mock.patch.object(scheduler.SCHEDULER, 'schedule') as schedule:
+            self.call(
+                'schedule_transactions', 429, 'due transactions beyond the budget of submissions scheduled',
+                envelopes=json.dumps(self.envelopes))
+        schedule.assert_not_called()
+
+
 class BulAccountTest(BridgeBaseTest):
     """Test for bul_account endpoint."""
 
@@ -215,6 +326,22 @@ class BulAccountTest(BridgeBaseTest):
                 self.call('bul_account', 200, 'could not verify account exist', queried_pubkey=account)
 
 
+class BulAccountsTest(BridgeBaseTest):
+    """Test for bul_accounts endpoint."""
+
+    def test_bul_accounts(self):
+        """Test getting multiple accounts, some of which do not exist."""
+        pubkey, _ = self.create_and_setup_new_account()
+        missing_pubkey = paket_stellar.get_keypair().address().decode()
+        accounts = self.call(
+            'bul_accounts', 200, 'could not get accounts',
+            queried_pubkeys=','.join((self.funder_pubkey, pubkey, missing_pubkey)))['accounts']
+        self.assertEqual(accounts[self.funder_pubkey]['status'], 200)
+        self.assertEqual(accounts[pubkey]['status'], 200)
+        self.assertEqual(accounts[pubkey]['account']['bul_balance'], 0)
+        self.assertNotEqual(accounts[missing_pubkey]['status'], 200)
+
+
 class PrepareAccountTest(BridgeBaseTest):
     """Test for prepare_account endpoint."""
 
@@ -252,6 +379,51 @@ class PrepareSendBulsTest(BridgeBaseTest):
             from_pubkey=self.funder_pubkey, to_pubkey=pubkey, amount_buls=50000000)
 
 
+class BatchTest(BridgeBaseTest):
+    """Test for batch endpoint."""
+
+    def test_batch(self):
+        """Test preparing multiple transactions in one call."""
+        pubkey, _ = self.create_and_setup_new_account()
+        new_pubkeys = [paket_stellar.get_keypair().address().decode() for _ in range(3)]
+        operations = [
+            {'call': 'prepare_account', 'from_pubkey': self.funder_pubkey, 'new_pubkey': new_pubkey}
+            for new_pubkey in new_pubkeys]
+        operations.append({
+            'call': 'prepare_send_buls', 'from_pubkey': self.funder_pubkey, 'to_pubkey': pubkey, 'amount_buls': 5})
+        operations.append({'call': 'prepare_trust'})
+        results = self.call(
+            'batch', 200, 'could not prepare batch', operations=json.dumps(operations))['results']
+        self.assertEqual(len(results), len(operations))
+        for result in results[:-1]:
+            self.assertEqual(result['status'], 200, result.get('error'))
+        self.assertEqual(results[-1]['status'], 400)
+
+        sequences = [
+            paket_stellar.stellar_base.transaction_envelope.TransactionEnvelope.from_xdr(
+                result['transaction']).tx.sequence for result in results[:-1]]
+        self.assertEqual(len(set(sequences)), len(sequences), 'batched transactions share sequence numbers')
+
+    def test_failed_call(self):
+        """Test that a call failing unexpectedly does not fail the calls following it."""
+        def prepare_failing(from_pubkey, offset=0):
+            """Fail like a bug would."""
+            raise RuntimeError("can not prepare for {} at {}".format(from_pubkey, offset))
+        operations = [
+            {'call': 'prepare_trust', 'from_pubkey': self.funder_pubkey},
+            {'call': 'prepare_trust', 'from_pubkey': self.funder_pubkey, 'limt': 5},
+            {'call': 'prepare_send_buls', 'from_pubkey': self.funder_pubkey, 'to_pubkey': self.funder_pubkey,
+             'amount_buls': 5}]
+        with unittest.mock.patch.dict(routes.BATCH_CALLS, prepare_trust=prepare_failing):
+            results = self.call(
+                'batch', 200, 'could not prepare batch', operations=json.dumps(operations))['results']
+        self.assertEqual([result['status'] for result in results], [500, 400, 200])
+
+    def test_invalid_batch(self):
+        """Test batching a malformed list of operations."""
+        self.call('batch', 400, 'malformed batch accepted', operations='not json')
+
+
 class PrepareEscrowTest(BridgeBaseTest):
     """Test for prepare_escrow endpoint."""
 
@@ -260,7 +432,90 @@ class PrepareEscrowTest(BridgeBaseTest):
         payment, collateral = 50000000, 100000000
         deadline = int(time.time())
         LOGGER.info('preparing new escrow and relay')
-        LOGGER.debug(self.prepare_relay(payment, collateral, deadline))
+        relay_details = self.prepare_relay(payment, collateral, deadline)
+        LOGGER.debug(relay_details)
+        # The transactions paket_stellar prepares, which clients sign and submit.
+        self.assertLessEqual(
+            {'set_options_transaction', 'payment_transaction', 'merge_transaction'},
+            set(relay_details['escrow']['transactions']['escrow_details']))
+        self.assertLessEqual(
+            {'set_options_transaction', 'relay_transaction', 'sequence_merge_transaction'},
+            set(relay_details['transactions']['relay_details']))
+
+
+class CircuitOpenTest(BridgeBaseTest):
+    """Test for failing fast while Horizon is unavailable."""
+
+    def tearDown(self):
+        horizon.BREAKER.record_success()
+
+    def test_prepare_escrow(self):
+        """Test that an open circuit rejects preparing an escrow without calling paket_stellar."""
+        for _ in range(horizon.BREAKER.failure_threshold):
+            horizon.BREAKER.record_failure()
+        pubkeys = [paket_stellar.get_keypair().address().decode() for _ in range(3)]
+        escrow_seed = paket_stellar.get_keypair().seed().decode()
+        with unittest.mock.patch.object(paket_stellar, 'prepare_escrow') as prepare_escrow:
+            response = self.call(
+                'prepare_escrow', seed=escrow_seed, launcher_pubkey=pubkeys[0], courier_pubkey=pubkeys[1],
+                recipient_pubkey=pubkeys[2], payment_buls=50000000, collateral_buls=100000000,
+                deadline_timestamp=int(time.time()))
+        self.assertEqual(response['code'], 203)
+        prepare_escrow.assert_not_called()
+
+
+class PackagesTest(BridgeBaseTest):
+    """Test for packages endpoint."""
+
+    def test_packages(self):
+        """Test finding a prepared escrow in the packages of its launcher."""
+        escrow_details = self.prepare_escrow(50000000, 100000000, int(time.time()) + 60 * 60)
+        packages = self.call(
+            'packages', 200, 'can not get packages', queried_pubkey=escrow_details['launcher'][0],
+            role='launcher', active_only=True)
+        self.assertEqual(
+            [escrow['escrow_pubkey'] for escrow in packages['escrows']], [escrow_details['escrow'][0]])
+        self.call('packages', 400, 'invalid role accepted', queried_pubkey=escrow_details['launcher'][0], role='x')
+
+
+class RateLimitTest(BridgeBaseTest):
+    """Test for rate limiting."""
+
+    def tearDown(self):
+        ratelimit.LIMITS.clear()
+
+    def test_rate_limit(self):
+        """Test that calls beyond the budget of a route are rejected with Retry-After."""
+        ratelimit.LIMITS['bul_account'] = (.01, 2)
+        for _ in range(2):
+            self.call('bul_account', 200, 'call within budget rejected', queried_pubkey=self.funder_pubkey)
+        response = self.app.post(
+            "/v{}/bul_account".format(routes.VERSION), data={'queried_pubkey': self.funder_pubkey})
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response.headers['Retry-After']), 1)
+
+    def test_batched_calls(self):
+        """Test that a batch is charged a single call to its own budget, however many calls it holds."""
+        ratelimit.LIMITS['prepare_send_buls'] = (.01, 1)
+        ratelimit.LIMITS['batch'] = (.01, 1)
+        operation = {
+            'call': 'prepare_send_buls', 'from_pubkey': self.funder_pubkey, 'to_pubkey': self.funder_pubkey,
+            'amount_buls': 5}
+        results = self.call('batch', 200, 'batch rejected', operations=json.dumps([operation] * 2))['results']
+        self.assertEqual([result['status'] for result in results], [200, 200])
+        response = self.app.post("/v{}/batch".format(routes.VERSION), data={'operations': json.dumps([operation])})
+        self.assertEqual(response.status_code, 429)
+
+
+class MetricsRouteTest(BridgeBaseTest):
+    """Test for metrics endpoint."""
+
+    def test_metrics(self):
+        """Test that served requests show up in the metrics."""
+        self.call('bul_account', 200, 'could not get funder account', queried_pubkey=self.funder_pubkey)
+        response = self.app.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('bridge_handler_seconds_count{outcome="200",route="bul_account_handler"}', response.data.decode())
 
 
 class EndToEndTest(BridgeBaseTest):
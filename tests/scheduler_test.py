@@ -0,0 +1,100 @@
+"""Tests for scheduler module"""
+import os
+import tempfile
+import threading
+import unittest
+import unittest.mock
+
+import db
+import scheduler
+import submitter
+import transactions
+
+
+class SchedulerTest(unittest.TestCase):
+    """Test for Scheduler."""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.original_path, db.DB_PATH = db.DB_PATH, self.path
+        db.CONNECTIONS = threading.local()
+        db.init_db()
+        self.scheduler = scheduler.Scheduler()
+        self.submitted = []
+        self.failing = set()
+
+    def tearDown(self):
+        db.CONNECTIONS.connection.close()
+        db.DB_PATH, db.CONNECTIONS = self.original_path, threading.local()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def submit(self, transaction_hash, envelope):
+        """Fake submission, failing the hashes in self.failing."""
+        self.submitted.append(transaction_hash)
+        if transaction_hash in self.failing:
+            return {'transaction_status': submitter.FAILED, 'error': 'tx_too_early'}
+        return {'transaction_status': submitter.SUCCEEDED, 'response': {}}
+
+    def add(self, due_timestamp, transaction_hash, source):
+        """Schedule an entry without decoding an envelope."""
+        position = db.insert_scheduled(transaction_hash, 'xdr', due_timestamp)
+        self.scheduler.push(scheduler.Entry(due_timestamp, position, transaction_hash, source, 'xdr', 0))
+
+    def test_submit_due(self):
+        """Test that only due entries are submitted, in order for each source."""
+        self.add(200, 'late', 'escrow')
+        self.add(100, 'refund', 'escrow')
+        self.add(100, 'merge', 'escrow')
+        with unittest.mock.patch.object(submitter, 'submit', self.submit):
+            self.assertEqual(self.scheduler.submit_due(150), 2)
+        self.assertEqual(self.submitted, ['refund', 'merge'])
+        self.assertEqual([row['transaction_hash'] for row in db.get_scheduled()], ['late'])
+
+    def test_retry(self):
+        """Test that a failed entry is retried with backoff, along with the entries following it."""
+        self.add(100, 'refund', 'escrow')
+        self.add(100, 'merge', 'escrow')
+        self.failing.add('refund')
+        with unittest.mock.patch.object(submitter, 'submit', self.submit):
+            self.scheduler.submit_due(150)
+            self.assertEqual(self.submitted, ['refund'])
+            self.assertEqual(self.scheduler.submit_due(150), 0)
+            self.failing.clear()
+            self.scheduler.submit_due(self.scheduler.heap[0].due_timestamp)
+        self.assertEqual(self.submitted, ['refund', 'refund', 'merge'])
+        self.assertEqual(db.get_scheduled(), [])
+
+    def test_give_up(self):
+        """Test that an entry is dropped after the maximal number of attempts."""
+        self.add(100, 'refund', 'escrow')
+        self.failing.add('refund')
+        with unittest.mock.patch.object(submitter, 'submit', self.submit):
+            for _ in range(scheduler.MAX_ATTEMPTS):
+                self.scheduler.submit_due(float('inf'))
+        self.assertEqual(len(self.submitted), scheduler.MAX_ATTEMPTS)
+        self.assertEqual(self.scheduler.heap, [])
+        self.assertEqual(db.get_scheduled(), [])
+
+    def test_load(self):
+        """Test picking up the entries other processes recorded, once."""
+        self.add(100, 'refund', 'escrow')
+        db.insert_scheduled('merge', 'xdr', 100)
+        decoded = unittest.mock.Mock()
+        decoded.tx.source = 'escrow'
+        with unittest.mock.patch.object(transactions, 'decode', return_value=decoded):
+            self.assertEqual(self.scheduler.load(), 1)
+            self.assertEqual(self.scheduler.load(), 0)
+        self.assertEqual([entry.transaction_hash for entry in sorted(self.scheduler.heap)], ['refund', 'merge'])
+
+    def test_queue_full(self):
+        """Test that envelopes beyond the bound on scheduled envelopes are rejected, all of them."""
+        self.add(100, 'refund', 'escrow')
+        with unittest.mock.patch.object(transactions, 'decode'), \
+                unittest.mock.patch.object(transactions, 'time_bounds', return_value=(0, 0)), \
+                unittest.mock.patch.object(scheduler, 'MAX_QUEUED', 2):
+            with self.assertRaises(scheduler.QueueFull):
+                self.scheduler.schedule(['merge', 'other'])
+        self.assertEqual(db.count_scheduled(), 1)
@@ -0,0 +1,51 @@
+"""Tests for sequences module"""
+import time
+import unittest
+
+import sequences
+
+
+class SequenceTrackerTest(unittest.TestCase):
+    """Test for SequenceTracker."""
+
+    def setUp(self):
+        self.loads = []
+        self.tracker = sequences.SequenceTracker(self.load)
+
+    def load(self, pubkey):
+        """Fake Horizon loader."""
+        self.loads.append(pubkey)
+        return 100
+
+    def test_get(self):
+        """Test that a sequence is seeded once, and not advanced by getting it."""
+        self.assertEqual(self.tracker.get('pubkey'), 100)
+        self.assertEqual(self.tracker.get('pubkey'), 100)
+        self.assertEqual(self.loads, ['pubkey'])
+
+    def test_observe(self):
+        """Test advancing a tracked sequence after submission."""
+        self.tracker.get('pubkey')
+        self.tracker.observe('pubkey', 110)
+        self.assertEqual(self.tracker.get('pubkey'), 110)
+        self.tracker.observe('pubkey', 105)
+        self.assertEqual(self.tracker.get('pubkey'), 110)
+        self.tracker.observe('other_pubkey', 105)
+        self.assertFalse(self.tracker.is_tracked('other_pubkey'))
+
+    def test_reset(self):
+        """Test resyncing a tracked sequence."""
+        self.tracker.get('pubkey')
+        self.tracker.reset('pubkey')
+        self.assertEqual(self.tracker.get('pubkey'), 100)
+        self.assertEqual(self.loads, ['pubkey', 'pubkey'])
+
+    def test_resync(self):
+        """Test that an account in constant use is still resynced once its ttl since seeding passes."""
+        tracker = sequences.SequenceTracker(self.load, ttl=.05)
+        self.assertEqual(tracker.get('pubkey'), 100)
+        for _ in range(3):
+            time.sleep(.03)
+            tracker.observe('pubkey', 101)
+            tracker.get('pubkey')
+        self.assertEqual(self.loads, ['pubkey', 'pubkey'])
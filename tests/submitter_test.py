@@ -0,0 +1,108 @@
+"""Tests for submitter module"""
+import threading
+import time
+import unittest
+import unittest.mock
+
+import paket_stellar
+
+import horizon
+import submitter
+import transactions
+
+
+class SubmitOnceTest(unittest.TestCase):
+    """Test for idempotent submission."""
+
+    def setUp(self):
+        pubkey = paket_stellar.get_keypair().address().decode()
+        self.envelope = transactions.prepare_send_buls(pubkey, 4294967296, pubkey, 1)
+        self.transaction_hash = transactions.transaction_hash(transactions.decode(self.envelope))
+        self.submissions = 0
+        self.rejected = False
+
+    def tearDown(self):
+        submitter.STATUSES.invalidate(self.transaction_hash)
+        submitter.REJECTIONS.invalidate(self.transaction_hash)
+
+    def submit_transaction(self, envelope, decoded=None):
+        """Fake Horizon submission, slow enough for concurrent submissions to overlap."""
+        self.submissions += 1
+        time.sleep(.05)
+        if self.rejected:
+            raise paket_stellar.StellarTransactionFailed({'result_codes': {'transaction': 'tx_failed'}})
+        return {
+            'hash': self.transaction_hash, 'ledger': 1, 'envelope_xdr': self.envelope,
+            'result_xdr': 'result', 'result_meta_xdr': 'meta'}
+
+    def test_resubmit(self):
+        """Test that resubmitting a successful transaction returns the same hash, ledger and result as the original."""
+        with unittest.mock.patch.object(horizon, 'submit_transaction', self.submit_transaction):
+            self.assertFalse(submitter.is_known(self.transaction_hash))
+            response = submitter.submit_once(self.envelope)
+            self.assertEqual(response['result_meta_xdr'], 'meta')
+            self.assertTrue(submitter.is_known(self.transaction_hash))
+            self.assertEqual(submitter.submit_once(self.envelope), {
+                field: response[field] for field in submitter.RESPONSE_FIELDS})
+        self.assertEqual(self.submissions, 1)
+
+    def test_pending_in_another_worker(self):
+        """Test that a transaction pending in another worker is not submitted again, but waited for."""
+        response = {'hash': self.transaction_hash, 'ledger': 1, 'result_xdr': 'result'}
+        self.assertTrue(submitter.claim(self.transaction_hash))
+        self.assertFalse(submitter.claim(self.transaction_hash))
+        threading.Timer(.2, submitter.STATUSES.set, args=(self.transaction_hash, {
+            'transaction_status': submitter.SUCCEEDED, 'response': response})).start()
+        with unittest.mock.patch.object(horizon, 'submit_transaction', self.submit_transaction):
+            self.assertEqual(submitter.submit_once(self.envelope), response)
+        self.assertEqual(self.submissions, 0)
+
+    def test_pending_timeout(self):
+        """Test that a transaction pending in another worker for too long has an unknown outcome."""
+        submitter.claim(self.transaction_hash)
+        with unittest.mock.patch.object(horizon, 'submit_transaction', self.submit_transaction), \
+                unittest.mock.patch.object(submitter, 'PENDING_TIMEOUT', .2):
+            with self.assertRaises(horizon.OutcomeUnknown):
+                submitter.submit_once(self.envelope)
+        self.assertEqual(self.submissions, 0)
+
+    def test_concurrent(self):
+        """Test that concurrent submissions of a transaction share a single call."""
+        with unittest.mock.patch.object(horizon, 'submit_transaction', self.submit_transaction):
+            threads = [threading.Thread(target=submitter.submit_once, args=(self.envelope,)) for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(self.submissions, 1)
+
+    def test_rejection(self):
+        """Test that resubmitting a rejected transaction raises the original rejection, until it expires."""
+        self.rejected = True
+        with unittest.mock.patch.object(horizon, 'submit_transaction', self.submit_transaction):
+            for _ in range(2):
+                with self.assertRaises(paket_stellar.StellarTransactionFailed):
+                    submitter.submit_once(self.envelope)
+            self.assertEqual(self.submissions, 1)
+            submitter.REJECTIONS.invalidate(self.transaction_hash)
+            with self.assertRaises(paket_stellar.StellarTransactionFailed):
+                submitter.submit_once(self.envelope)
+        self.assertEqual(self.submissions, 2)
+
+    def test_abandoned_claim(self):
+        """Test that the pending mark of a submission that never finished expires, and is not waited for."""
+        with unittest.mock.patch.object(submitter, 'PENDING_TIMEOUT', .1):
+            self.assertTrue(submitter.claim(self.transaction_hash))
+        time.sleep(.2)
+        self.assertFalse(submitter.is_known(self.transaction_hash))
+        with unittest.mock.patch.object(horizon, 'submit_transaction', self.submit_transaction):
+            self.assertEqual(submitter.submit_once(self.envelope)['hash'], self.transaction_hash)
+        self.assertEqual(self.submissions, 1)
+
+    def test_failure_releases_claim(self):
+        """Test that a submission failing without a rejection can be submitted again."""
+        with unittest.mock.patch.object(horizon, 'submit_transaction', side_effect=horizon.OutcomeUnknown('timeout')):
+            with self.assertRaises(horizon.OutcomeUnknown):
+                submitter.submit_once(self.envelope)
+        self.assertFalse(submitter.is_known(self.transaction_hash))
+        self.assertTrue(submitter.claim(self.transaction_hash))
@@ -1,4 +1,21 @@
 """Run all tests."""
 # pylint: disable=wildcard-import
 # pylint: disable=unused-wildcard-import
+from tests.auth_test import *
+from tests.balancer_test import *
+from tests.cache_test import *
+from tests.circuit_test import *
+from tests.db_test import *
+from tests.lazy_test import *
+from tests.logtail_test import *
+from tests.metrics_test import *
+from tests.pools_test import *
+from tests.preflight_test import *
+from tests.prefork_test import *
+from tests.ratelimit_test import *
+from tests.responses_test import *
 from tests.routes_test import *
+from tests.scheduler_test import *
+from tests.sequences_test import *
+from tests.submitter_test import *
+from tests.transactions_test import *
@@ -0,0 +1,42 @@
+"""Tests for transactions module"""
+import binascii
+import unittest
+import unittest.mock
+
+import paket_stellar
+
+import transactions
+
+
+class NetworkTest(unittest.TestCase):
+    """Test for building transactions on the network of paket_stellar."""
+
+    def setUp(self):
+        self.pubkey = paket_stellar.get_keypair().address().decode()
+
+    def test_passphrase(self):
+        """Test that the network passphrase follows the network setting of paket_stellar."""
+        networks = paket_stellar.stellar_base.network.NETWORKS
+        with unittest.mock.patch.object(paket_stellar, 'NETWORK', None, create=True):
+            self.assertEqual(transactions.network_passphrase(), networks['TESTNET'])
+        with unittest.mock.patch.object(paket_stellar, 'NETWORK', 'public', create=True):
+            self.assertEqual(transactions.network_passphrase(), networks['PUBLIC'])
+        with unittest.mock.patch.object(paket_stellar, 'NETWORK', 'Private Network', create=True):
+            self.assertEqual(transactions.network_passphrase(), 'Private Network')
+
+    def test_envelope_hash(self):
+        """Test that the hash of a transaction, and so its pre-authorization, depends on the network."""
+        hashes = []
+        for network in ('TESTNET', 'PUBLIC'):
+            with unittest.mock.patch.object(paket_stellar, 'NETWORK', network, create=True):
+                hashes.append(transactions.transaction_hash(
+                    transactions.gen_send_buls_envelope(self.pubkey, 4294967296, self.pubkey, 1)))
+        self.assertNotEqual(*hashes)
+
+    def test_decoded_hash(self):
+        """Test that a decoded envelope of another network than the testnet keeps its hash on that network."""
+        with unittest.mock.patch.object(paket_stellar, 'NETWORK', 'PUBLIC', create=True):
+            envelope = transactions.gen_send_buls_envelope(self.pubkey, 4294967296, self.pubkey, 1)
+            decoded = transactions.decode(transactions.envelope_xdr(envelope))
+            self.assertEqual(transactions.transaction_hash(decoded), binascii.hexlify(envelope.hash_meta()).decode())
+            self.assertEqual(transactions.transaction_hash(decoded), transactions.transaction_hash(envelope))
@@ -0,0 +1,127 @@
+"""Stellar transaction helpers for the PAKET bridge."""
+import binascii
+import functools
+import hashlib
+import os
+
+import paket_stellar
+import util.conversion
+
+# Operation attributes that hold the pubkey of an account affected by the operation.
+ACCOUNT_ATTRIBUTES = ('source', 'destination', 'trustor')
+# Fee per operation, in stroops.
+BASE_FEE = int(os.environ.get('PAKET_BRIDGE_BASE_FEE', 100))
+
+
+def network_passphrase():
+    """
+    Get the passphrase of the Stellar network paket_stellar builds its transactions for, which the bridge's
+    envelopes, the pre-authorized hashes of packages and the signatures it checks all depend on. That is
+    paket_stellar's NETWORK, a stellar_base network name or passphrase, if set, or stellar_base's default.
+    """
+    network = getattr(paket_stellar, 'NETWORK', None) or 'TESTNET'
+    return paket_stellar.stellar_base.network.NETWORKS.get(network.upper(), network)
+
+
+def address(value):
+    """Normalize an address extracted from a decoded transaction to a string."""
+    if isinstance(value, bytes):
+        return value.decode()
+    return value
+
+
+def decode(envelope):
+    """Decode a base64 XDR transaction envelope."""
+    return paket_stellar.stellar_base.transaction_envelope.TransactionEnvelope.from_xdr(envelope)
+
+
+def network_hash(envelope, passphrase=None):
+    """
+    Get the hash a decoded envelope's signatures sign on a network, by default
+    the bridge's. Decoded envelopes are always for stellar_base's default
+    network, so their own hash_meta is only right on the testnet.
+    """
+    # The signature base starts with the hash of the network passphrase.
+    signature_base = envelope.signature_base()
+    return hashlib.sha256(
+        hashlib.sha256((passphrase or network_passphrase()).encode()).digest() + signature_base[32:]).digest()
+
+
+def transaction_hash(envelope):
+    """Get the hex encoded hash of a decoded transaction envelope on the bridge's network."""
+    return binascii.hexlify(network_hash(envelope)).decode()
+
+
+def time_bounds(transaction):
+    """Get the lower and upper time bounds of a decoded transaction, 0 meaning unbounded."""
+    bounds = transaction.time_bounds
+    if isinstance(bounds, (list, tuple)):
+        bounds = bounds[0] if bounds else None
+    if bounds is None:
+        return 0, 0
+    if isinstance(bounds, dict):
+        return int(bounds.get('minTime', 0)), int(bounds.get('maxTime', 0))
+    return int(bounds.minTime), int(bounds.maxTime)
+
+
+def touched_pubkeys(transaction):
+    """Get the set of pubkeys of all the accounts affected by a decoded transaction."""
+    pubkeys = {address(transaction.source)}
+    for operation in transaction.operations:
+        for attribute in ACCOUNT_ATTRIBUTES:
+            pubkey = address(getattr(operation, attribute, None))
+            if pubkey:
+                pubkeys.add(pubkey)
+    return pubkeys
+
+
+@functools.lru_cache(maxsize=1)
+def bul_asset():
+    """Get the BUL asset, which all the packages hold."""
+    return paket_stellar.stellar_base.asset.Asset(paket_stellar.BUL_TOKEN_CODE, paket_stellar.ISSUER)
+
+
+def gen_envelope(pubkey, sequence, operations, time_bounds=None):
+    """
+    Get an unsigned envelope of a transaction from pubkey built on sequence.
+    Unlike a builder, this neither queries Horizon for the base fee nor
+    copies the operations, so constant operations can be shared.
+    """
+    transaction = paket_stellar.stellar_base.transaction.Transaction(
+        source=pubkey, sequence=sequence, time_bounds=time_bounds,
+        fee=BASE_FEE * len(operations), operations=operations)
+    return paket_stellar.stellar_base.transaction_envelope.TransactionEnvelope(
+        transaction, network_id=network_passphrase())
+
+
+def envelope_xdr(envelope):
+    """Get an unsigned envelope as a base64 XDR string."""
+    return envelope.xdr().decode()
+
+
+def gen_payment_operation(destination, amount):
+    """Get an operation paying amount BULs, in units, to destination."""
+    return paket_stellar.stellar_base.operation.Payment(destination, bul_asset(), amount)
+
+
+def prepare_create_account(from_pubkey, sequence, new_pubkey, starting_balance):
+    """Prepare a create account transaction."""
+    return envelope_xdr(gen_envelope(from_pubkey, sequence, [paket_stellar.stellar_base.operation.CreateAccount(
+        new_pubkey, util.conversion.stroops_to_units(starting_balance))]))
+
+
+def prepare_trust(from_pubkey, sequence, limit=None):
+    """Prepare an add trust transaction."""
+    return envelope_xdr(gen_envelope(from_pubkey, sequence, [paket_stellar.stellar_base.operation.ChangeTrust(
+        bul_asset(), None if limit is None else util.conversion.stroops_to_units(limit))]))
+
+
+def gen_send_buls_envelope(from_pubkey, sequence, to_pubkey, amount_buls):
+    """Get an unsigned envelope of a BUL transfer."""
+    return gen_envelope(
+        from_pubkey, sequence, [gen_payment_operation(to_pubkey, util.conversion.stroops_to_units(amount_buls))])
+
+
+def prepare_send_buls(from_pubkey, sequence, to_pubkey, amount_buls):
+    """Prepare a BUL transfer transaction."""
+    return envelope_xdr(gen_send_buls_envelope(from_pubkey, sequence, to_pubkey, amount_buls))